@@ -0,0 +1,191 @@
+"""Run the benchmark suite
+
+Usage: python -m benchmarks [--suite bot,imports] [--backends postgres,sqlite] [--rows 10,10000,1000000]
+                            [--save-baseline]
+
+The results are compared with benchmarks/baseline.json, the run fails when
+one regresses beyond the tolerance. Sizes missing from the baseline are reported.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy.engine import make_url
+
+from benchmarks.fake_discord import FakeDiscord
+from benchmarks.harness import (BenchConfig, Measurement, RoundTripCounter, guild_ids, reset_schema, running,
+                                seed_weekly_posts, throwaway_database, to_dict, wait_for)
+from benchmarks.importtime import bench_imports
+from src import create_bot
+from src.models.weekly_post import WeeklyPost
+from src.util.memory import memory_usage
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+GUILDS = 100
+STARTUP_TIMEOUT = 600
+
+# Metrics where a higher value is an improvement
+HIGHER_IS_BETTER = {'throughput_per_s'}
+# Shown against the baseline but never failing the run. The p99 of a few runs is close to their
+# slowest, and the peak RSS includes seeding the posts, both vary by over 20% between runs.
+# create_bot runs once per size, the first size run also pays for the imports the others share.
+REPORT_ONLY = {'p99_ms', 'peak_rss_mib', 'create_bot'}
+# Timing changes under this many milliseconds per operation are run to run noise. On a single
+# CPU machine the p50 of the same tree's send_posts varies from 7 to 12 ms between runs.
+NOISE_FLOOR_MS = 5.0
+
+
+async def bench_rows(rows: int, iterations: int, fake: FakeDiscord) -> dict:
+    """Benchmark startup, sending due posts and /addwp with the given number of seeded posts"""
+    results = {name: Measurement() for name in ('create_bot', 'startup', 'send_posts', 'addwp')}
+
+    start = time.perf_counter()
+    bot = create_bot(BenchConfig)
+    results['create_bot'].add(time.perf_counter() - start)
+
+    await reset_schema()
+    await seed_weekly_posts(rows, fake.guild_ids)
+    counter = RoundTripCounter()
+
+    start = time.perf_counter()
+    start_count = counter.count
+    async with running(bot) as task:
+        await wait_for(lambda: bot.get_cog('WeeklyPostCog') is not None, STARTUP_TIMEOUT, task)
+        cog = bot.get_cog('WeeklyPostCog')
+        await wait_for(lambda: len(cog.schedule) >= rows, STARTUP_TIMEOUT, task)
+        results['startup'].add(time.perf_counter() - start, round_trips=counter.count - start_count)
+        # The benchmark sends the due posts itself, the loop would claim those falling due meanwhile.
+        # The heartbeat's statements would be counted as those of whichever operation they run during.
+        cog.send_posts.cancel()
+        cog.heartbeat.cancel()
+
+        for _ in range(iterations):
+            now = cog.schedule.next_fire_time()
+            due = len(await WeeklyPost.get_due(now))
+            sent = fake.messages_sent
+            with counter.measure(results['send_posts'], operations=due):
+                await cog._send_due_posts(now) # pylint: disable=protected-access
+            assert fake.messages_sent - sent == due
+
+        main_guild, main_channel = int(bot.config.DISCORD_GUILD_ID), int(bot.config.DISCORD_MAIN_CHANNEL_ID)
+        for i in range(iterations):
+            options = [
+                {'name': 'content', 'type': 3, 'value': f'Benchmark post {i}'},
+                {'name': 'day_of_week', 'type': 4, 'value': i % 7},
+                {'name': 'hour', 'type': 4, 'value': i % 24},
+            ]
+            with counter.measure(results['addwp']):
+                await fake.interact('addwp', options, main_guild, main_channel)
+
+    counter.remove()
+    summary = to_dict(results)
+    summary['peak_rss_mib'] = memory_usage()[1] / 2**20
+    return summary
+
+async def run_suite(
+    backend: str,
+    row_counts: list[int],
+    iterations: int,
+    database_uri: str,
+    latency: float
+) -> dict: # pylint: disable=too-many-arguments
+    """Benchmark every row count against the fake Discord"""
+    BenchConfig.SQLALCHEMY_DATABASE_URI = database_uri
+    fake = FakeDiscord(guild_ids(GUILDS), latency=latency)
+    await fake.start()
+    try:
+        report = {}
+        for rows in row_counts:
+            print(f'Benchmarking {rows} rows on {backend}...', file=sys.stderr)
+            report[f'{backend} rows={rows}'] = await bench_rows(rows, iterations, fake)
+        return report
+    finally:
+        await fake.stop()
+
+def _noise(metric: str, stats: dict, base_stats: dict) -> bool:
+    """Return whether the change of a timing metric is too small to be a regression"""
+    if metric == 'throughput_per_s':
+        # Counted per post for some operations, judged on the time of the whole operation
+        metric = 'p50_ms'
+    if not metric.endswith('_ms') or metric not in stats or metric not in base_stats:
+        return False
+    return abs(stats[metric] - base_stats[metric]) < NOISE_FLOOR_MS
+
+def compare(report: dict, baseline: dict, tolerance: float) -> tuple[list[str], list[str]]:
+    """
+    Print the report next to the baseline, return the regressions beyond
+    the tolerance and the measured sizes the baseline has no numbers for
+    """
+    regressions = []
+    missing = [size for size in report if size not in baseline]
+    for size, operations in report.items():
+        for operation, stats in operations.items():
+            if not isinstance(stats, dict):
+                stats = {'value': stats}
+            base_stats = baseline.get(size, {}).get(operation, {})
+            if not isinstance(base_stats, dict):
+                base_stats = {'value': base_stats}
+            for metric, value in stats.items():
+                base = base_stats.get(metric)
+                if base is None or metric == 'runs':
+                    print(f'{size:>22} {operation:>12} {metric:>20} {value:12.3f}')
+                    continue
+                change = (value - base) / base if base else 0.0
+                worse = -change if metric in HIGHER_IS_BETTER else change
+                flag = ''
+                if worse > tolerance and not _noise(metric, stats, base_stats):
+                    flag = ' higher' if REPORT_ONLY & {operation, metric} else ' REGRESSION'
+                print(f'{size:>22} {operation:>12} {metric:>20} {value:12.3f} {base:12.3f} {change:+8.1%}{flag}')
+                if flag == ' REGRESSION':
+                    regressions.append(f'{size} {operation} {metric} {change:+.1%}')
+    return regressions, missing
+
+def main():
+    """Run the benchmarks and compare them with the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', default='bot,imports', help='comma separated suites to run')
+    parser.add_argument('--backends', default='postgres,sqlite', help='comma separated database backends')
+    parser.add_argument('--rows', default='10,10000,1000000', help='comma separated seeded post counts')
+    parser.add_argument('--iterations', type=int, default=20, help='runs of each operation')
+    parser.add_argument('--database-uri', help='async database URI, defaults to a temporary database per backend')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake Discord request')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    suites = args.suite.split(',')
+    report = {}
+    if 'imports' in suites:
+        report['imports'] = to_dict(bench_imports(args.iterations))
+    if 'bot' in suites:
+        row_counts = [int(rows) for rows in args.rows.split(',')]
+        backends = args.backends.split(',')
+        if args.database_uri:
+            backends = [make_url(args.database_uri).get_backend_name()]
+        for backend in backends:
+            with throwaway_database(backend, args.database_uri) as database_uri:
+                report.update(asyncio.run(run_suite(backend, row_counts, args.iterations, database_uri, args.latency)))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    regressions, missing = compare(report, baseline, args.tolerance)
+    for size in missing:
+        print(f'No baseline for {size} in {args.baseline}, it was not compared.', file=sys.stderr)
+    for regression in regressions:
+        print(f'Regression: {regression}', file=sys.stderr)
+
+    if args.save_baseline:
+        # Merged so saving one backend or size keeps the numbers of the others
+        baseline.update(report)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f'Saved baseline to {args.baseline}.', file=sys.stderr)
+    elif regressions:
+        print(f'{len(regressions)} regressions beyond {args.tolerance:.0%}.', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
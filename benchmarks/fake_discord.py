@@ -0,0 +1,335 @@
+"""Local stand-in for the Discord REST API and gateway"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import discord
+from aiohttp import WSMsgType, web
+from discord.http import Route
+
+APPLICATION_ID = 100000000000000001
+BOT_USER_ID = 100000000000000001
+OWNER_ID = 100000000000000002
+CDN_URL_TTL = 24 * 3600 # Seconds attachment URLs are valid for
+
+Payload = dict[str, Any]
+
+
+def user_payload(user_id: int, name: str, bot: bool = False) -> Payload:
+    """Return a user object"""
+    return {'id': str(user_id), 'username': name, 'discriminator': '0001', 'avatar': None, 'bot': bot}
+
+def json_response(data: Any) -> web.Response:
+    """Return a JSON response with the exact content type discord.py expects"""
+    return web.Response(body=json.dumps(data).encode(), content_type='application/json')
+
+class FakeDiscord:
+    """
+    Serves the REST routes and the gateway events the bot uses.
+
+    Every guild has one text channel whose ID is the guild ID plus one,
+    any other channel ID is accepted when sending messages. Sent messages
+    and uploaded bytes are counted and interaction followups resolve the
+    waiters of their token.
+    """
+
+    def __init__(self, guild_ids: list[int], latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.guild_ids = guild_ids
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.messages_sent = 0
+        self.bytes_uploaded = 0
+        self.requests = 0
+        self._ids = itertools.count(200000000000000000)
+        self._sockets: list[tuple[web.WebSocketResponse, itertools.count]] = []
+        self._followups: dict[str, asyncio.Future] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._log = logging.getLogger('FakeDiscord')
+
+    @property
+    def base_url(self) -> str:
+        """Return the URL the API is served at"""
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        """Serve the API and point discord.py at it"""
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get('/gateway', self._gateway)
+        app.router.add_get('/api/v10/gateway/bot', self._get_gateway_bot)
+        app.router.add_get('/api/v10/users/@me', self._get_me)
+        app.router.add_get('/api/v10/oauth2/applications/@me', self._get_application)
+        app.router.add_get('/api/v10/guilds/{guild_id}', self._get_guild)
+        app.router.add_get('/api/v10/channels/{channel_id}', self._get_channel)
+        app.router.add_post('/api/v10/channels/{channel_id}/messages', self._send_message)
+        app.router.add_post('/api/v10/attachments/refresh-urls', self._refresh_urls)
+        app.router.add_put('/api/v10/applications/{application_id}/commands', self._sync_commands)
+        app.router.add_post('/api/v10/interactions/{interaction_id}/{token}/callback', self._interaction_callback)
+        app.router.add_post('/api/v10/webhooks/{application_id}/{token}', self._followup)
+        app.router.add_patch('/api/v10/webhooks/{application_id}/{token}/messages/@original', self._edit_original)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1] # pylint: disable=protected-access
+        Route.BASE = f'{self.base_url}/api/v10'
+        self._log.info('Serving fake Discord on %s.', self.base_url)
+
+    async def stop(self):
+        """Close the gateway connections and stop serving"""
+        for socket, _ in self._sockets:
+            await socket.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+        Route.BASE = f'https://discord.com/api/v{discord.http.INTERNAL_API_VERSION}'
+
+    async def dispatch(self, event: str, data: Payload):
+        """Send a gateway event to every connected shard"""
+        for socket, sequence in self._sockets:
+            await socket.send_json({'op': 0, 't': event, 's': next(sequence), 'd': data})
+
+    async def interact(
+        self,
+        name: str,
+        options: list[Payload],
+        guild_id: int,
+        channel_id: int,
+        timeout: float = 30.0
+    ) -> float: # pylint: disable=too-many-arguments
+        """Invoke an app command through the gateway and return the seconds until its followup"""
+        token = f'token-{next(self._ids)}'
+        waiter = asyncio.get_running_loop().create_future()
+        self._followups[token] = waiter
+        start = asyncio.get_running_loop().time()
+        await self.dispatch('INTERACTION_CREATE', {
+            # Timestamped like real snowflakes, the bot measures command latency from it
+            'id': str(discord.utils.time_snowflake(datetime.now(timezone.utc))),
+            'application_id': str(APPLICATION_ID),
+            'type': 2,
+            'token': token,
+            'version': 1,
+            'guild_id': str(guild_id),
+            'channel_id': str(channel_id),
+            'app_permissions': '0',
+            'member': {
+                'user': user_payload(OWNER_ID, 'owner'),
+                'roles': [],
+                'joined_at': self._timestamp(),
+                'deaf': False,
+                'mute': False,
+                'flags': 0,
+                'permissions': '8',
+            },
+            'data': {'id': str(next(self._ids)), 'name': name, 'type': 1, 'options': options},
+        })
+        await asyncio.wait_for(waiter, timeout)
+        return asyncio.get_running_loop().time() - start
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.requests += 1
+        if self.latency and request.path != '/gateway':
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def _gateway(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        entry = (socket, itertools.count(1))
+        self._sockets.append(entry)
+        await socket.send_json({'op': 10, 'd': {'heartbeat_interval': 41250}})
+
+        async for message in socket:
+            if message.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data)
+            if payload['op'] == 1:
+                await socket.send_json({'op': 11})
+            elif payload['op'] == 2:
+                await self._identify(entry, payload['d'])
+            elif payload['op'] == 6:
+                await socket.send_json({'op': 0, 't': 'RESUMED', 's': next(entry[1]), 'd': {}})
+
+        self._sockets.remove(entry)
+        return socket
+
+    async def _identify(self, entry: tuple[web.WebSocketResponse, itertools.count], data: Payload):
+        socket, sequence = entry
+        shard_id, shard_count = data.get('shard', [0, 1])
+        guild_ids = [guild_id for guild_id in self.guild_ids if (guild_id >> 22) % shard_count == shard_id]
+        await socket.send_json({'op': 0, 't': 'READY', 's': next(sequence), 'd': {
+            'v': 10,
+            'user': user_payload(BOT_USER_ID, 'dusty', bot=True),
+            'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guild_ids],
+            'session_id': f'session-{shard_id}',
+            'resume_gateway_url': f'ws://{self.host}:{self.port}/gateway',
+            'shard': [shard_id, shard_count],
+            'application': {'id': str(APPLICATION_ID), 'flags': 0},
+        }})
+        for guild_id in guild_ids:
+            await socket.send_json({'op': 0, 't': 'GUILD_CREATE', 's': next(sequence), 'd': self._guild(guild_id)})
+
+    async def _get_gateway_bot(self, request: web.Request) -> web.Response: # pylint: disable=unused-argument
+        return json_response({
+            'url': f'ws://{self.host}:{self.port}/gateway',
+            'shards': 1,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1},
+        })
+
+    async def _get_me(self, request: web.Request) -> web.Response: # pylint: disable=unused-argument
+        return json_response(user_payload(BOT_USER_ID, 'dusty', bot=True))
+
+    async def _get_application(self, request: web.Request) -> web.Response: # pylint: disable=unused-argument
+        return json_response({
+            'id': str(APPLICATION_ID),
+            'name': 'dusty',
+            'description': '',
+            'icon': None,
+            'rpc_origins': [],
+            'bot_public': False,
+            'bot_require_code_grant': False,
+            'owner': user_payload(OWNER_ID, 'owner'),
+            'verify_key': '',
+            'flags': 0,
+        })
+
+    async def _get_guild(self, request: web.Request) -> web.Response:
+        return json_response(self._guild(int(request.match_info['guild_id'])))
+
+    async def _get_channel(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        return json_response(self._channel(channel_id, channel_id - 1))
+
+    async def _send_message(self, request: web.Request) -> web.Response:
+        self.messages_sent += 1
+        _, message = await self._read_message(request, int(request.match_info['channel_id']))
+        return json_response(message)
+
+    async def _refresh_urls(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        expires = f'{int(time.time()) + CDN_URL_TTL:x}'
+        return json_response({'refreshed_urls': [
+            {'original': url, 'refreshed': url.split('?')[0] + f'?ex={expires}'}
+            for url in data['attachment_urls']
+        ]})
+
+    async def _sync_commands(self, request: web.Request) -> web.Response:
+        commands = await request.json()
+        for command in commands:
+            command.update(id=str(next(self._ids)), application_id=str(APPLICATION_ID), version='1')
+        return json_response(commands)
+
+    async def _interaction_callback(self, request: web.Request) -> web.Response: # pylint: disable=unused-argument
+        return web.Response(status=204)
+
+    async def _followup(self, request: web.Request) -> web.Response:
+        data, message = await self._read_message(request, 0)
+        waiter = self._followups.pop(request.match_info['token'], None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(data)
+        return json_response(message)
+
+    async def _edit_original(self, request: web.Request) -> web.Response:
+        _, message = await self._read_message(request, 0)
+        return json_response(message)
+
+    async def _read_message(self, request: web.Request, channel_id: int) -> tuple[Payload, Payload]:
+        """Read a JSON or multipart message body, return its payload and the created message"""
+        if request.content_type != 'multipart/form-data':
+            data = await request.json()
+            return data, self._message(channel_id, data.get('content'))
+
+        data, attachments = {}, []
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == 'payload_json':
+                data = json.loads(await part.text())
+                continue
+            size = 0
+            while chunk := await part.read_chunk():
+                size += len(chunk)
+            self.bytes_uploaded += size
+            attachments.append(self._attachment(channel_id, part.filename, size))
+        message = self._message(channel_id, data.get('content'))
+        message['attachments'] = attachments
+        return data, message
+
+    def _guild(self, guild_id: int) -> Payload:
+        return {
+            'id': str(guild_id),
+            'name': f'guild-{guild_id}',
+            'icon': None,
+            'owner_id': str(OWNER_ID),
+            'unavailable': False,
+            'large': False,
+            'member_count': 1,
+            'features': [],
+            'emojis': [],
+            'stickers': [],
+            'roles': [{
+                'id': str(guild_id),
+                'name': '@everyone',
+                'permissions': '0',
+                'position': 0,
+                'color': 0,
+                'hoist': False,
+                'managed': False,
+                'mentionable': False,
+            }],
+            'channels': [self._channel(guild_id + 1, guild_id)],
+            'members': [],
+            'threads': [],
+            'voice_states': [],
+            'presences': [],
+            'stage_instances': [],
+            'guild_scheduled_events': [],
+        }
+
+    @staticmethod
+    def _channel(channel_id: int, guild_id: int) -> Payload:
+        return {
+            'id': str(channel_id),
+            'guild_id': str(guild_id),
+            'type': 0,
+            'name': f'channel-{channel_id}',
+            'position': 0,
+            'permission_overwrites': [],
+        }
+
+    def _message(self, channel_id: int, content: Optional[str]) -> Payload:
+        return {
+            'id': str(next(self._ids)),
+            'channel_id': str(channel_id),
+            'author': user_payload(BOT_USER_ID, 'dusty', bot=True),
+            'content': content or '',
+            'timestamp': self._timestamp(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'pinned': False,
+            'type': 0,
+        }
+
+    def _attachment(self, channel_id: int, filename: str, size: int) -> Payload:
+        attachment_id = next(self._ids)
+        expires = f'{int(time.time()) + CDN_URL_TTL:x}'
+        return {
+            'id': str(attachment_id),
+            'filename': filename,
+            'size': size,
+            'url': f'{self.base_url}/attachments/{channel_id}/{attachment_id}/{filename}?ex={expires}',
+            'proxy_url': f'{self.base_url}/attachments/{channel_id}/{attachment_id}/{filename}',
+        }
+
+    @staticmethod
+    def _timestamp() -> str:
+        return datetime.now(timezone.utc).isoformat()
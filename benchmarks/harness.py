@@ -0,0 +1,171 @@
+"""Benchmark harness"""
+import asyncio
+import logging
+import random
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator, Optional
+
+from sqlalchemy import event
+from sqlmodel import SQLModel
+
+from benchmarks.fake_discord import OWNER_ID
+from src.config import Config
+from src.extensions import db
+
+SEED_CHUNK_SIZE = 10000
+MINUTES_PER_WEEK = 7 * 24 * 60
+
+
+def guild_ids(count: int) -> list[int]:
+    """Return snowflake-like guild IDs spread over the shards"""
+    return [(i + 1) << 22 | i for i in range(count)]
+
+@dataclass
+class BenchConfig(Config):
+    """Benchmark config object"""
+    ENV: str = 'bench'
+    LEVEL: int = logging.WARNING
+    METRICS_ENABLED: bool = False
+    # Flushed when the bot closes, a flush in the middle of a measured operation would count as its round-trips
+    AUDIT_FLUSH_INTERVAL: float = 3600.0
+    DISCORD_BOT_TOKEN: str = 'bench-token'
+    DISCORD_OWNER_ID: str = str(OWNER_ID)
+    DISCORD_GUILD_ID: str = str(guild_ids(1)[0])
+    DISCORD_MAIN_CHANNEL_ID: str = str(guild_ids(1)[0] + 1)
+
+@dataclass
+class Measurement:
+    """Timings of repeated runs of an operation"""
+    samples: list[float] = field(default_factory=list)
+    operations: int = 0
+    round_trips: int = 0
+
+    def add(self, seconds: float, operations: int = 1, round_trips: int = 0):
+        """Record one run covering the given number of operations"""
+        self.samples.append(seconds)
+        self.operations += operations
+        self.round_trips += round_trips
+
+    def summary(self) -> dict[str, float]:
+        """Return the latency percentiles in milliseconds, throughput and round-trips per operation"""
+        samples = sorted(self.samples)
+        total = sum(samples)
+        return {
+            'runs': len(samples),
+            'p50_ms': statistics.median(samples) * 1000 if samples else 0.0,
+            'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000 if samples else 0.0,
+            'throughput_per_s': self.operations / total if total else 0.0,
+            'round_trips_per_op': self.round_trips / self.operations if self.operations else 0.0,
+        }
+
+class RoundTripCounter:
+    """
+    Counts the statements sent to the database
+    """
+
+    def __init__(self):
+        self.count = 0
+        event.listen(db.engine.sync_engine, 'before_cursor_execute', self._increment)
+
+    def _increment(self, *args): # pylint: disable=unused-argument
+        self.count += 1
+
+    def remove(self):
+        """Stop counting"""
+        event.remove(db.engine.sync_engine, 'before_cursor_execute', self._increment)
+
+    @contextmanager
+    def measure(self, measurement: Measurement, operations: int = 1) -> Iterator[None]:
+        """Record the time and statements of the block as one run"""
+        start_count = self.count
+        start = time.perf_counter()
+        yield
+        measurement.add(time.perf_counter() - start, operations, self.count - start_count)
+
+@contextmanager
+def throwaway_database(backend: str, database_uri: Optional[str] = None) -> Iterator[str]:
+    """Yield the given database URI, or the URI of a temporary database of the backend removed on exit"""
+    if database_uri:
+        yield database_uri
+        return
+
+    if backend == 'sqlite':
+        with tempfile.TemporaryDirectory() as directory:
+            yield f'sqlite+aiosqlite:///{directory}/bench.db'
+        return
+
+    # Dev dependency, only needed to run the benchmarks
+    import testing.postgresql # pylint: disable=import-outside-toplevel,import-error
+    with testing.postgresql.Postgresql() as postgresql:
+        yield postgresql.url().replace('postgresql://', 'postgresql+asyncpg://', 1)
+
+async def reset_schema():
+    """Drop and create every table"""
+    # Imported here so the metadata holds every table, as in the migrations
+    from src.models import ( # pylint: disable=import-outside-toplevel,unused-import
+        bot_state,
+        command_audit,
+        post_attachment,
+        post_delivery,
+        scheduler_lease,
+        weekly_post
+    )
+    async with db.engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+async def seed_weekly_posts(rows: int, guilds: list[int], seed: int = 0):
+    """
+    Insert weekly posts in random guilds, spread evenly over the minutes of the week.
+    The slots after any time hold the same number of posts, give or take one, so the
+    posts due at once and the round-trips per post do not depend on when the benchmark runs.
+    """
+    # Imported here so the models bind to the engine created for the benchmark
+    from src.models.weekly_post import WeeklyPost # pylint: disable=import-outside-toplevel
+
+    rand = random.Random(seed)
+    for start in range(0, rows, SEED_CHUNK_SIZE):
+        chunk = []
+        for i in range(start, min(rows, start + SEED_CHUNK_SIZE)):
+            guild_id = rand.choice(guilds)
+            slot = i % MINUTES_PER_WEEK
+            chunk.append({
+                'guild_id': guild_id,
+                'channel_id': guild_id + 1,
+                'content': f'Weekly post {i}',
+                'day_of_week': slot // (24 * 60),
+                'hour': slot // 60 % 24,
+                'minute': slot % 60,
+            })
+        await WeeklyPost.create_many(chunk)
+
+@asynccontextmanager
+async def running(bot) -> AsyncIterator[asyncio.Task]:
+    """Run the bot in the background until the block exits"""
+    task = asyncio.create_task(bot.start(bot.token))
+    try:
+        yield task
+    finally:
+        await bot.close()
+        await asyncio.gather(task, return_exceptions=True)
+        if bot.log_listener is not None:
+            bot.log_listener.stop()
+
+async def wait_for(predicate, timeout: float, task: asyncio.Task, interval: float = 0.01):
+    """Wait until the predicate holds, failing if the bot task exits first"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if task.done():
+            task.result()
+            raise RuntimeError('The bot stopped before the benchmark finished.')
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Timed out after {timeout} seconds.')
+        await asyncio.sleep(interval)
+
+def to_dict(results: dict[str, Measurement]) -> dict[str, dict[str, float]]:
+    """Return the summaries of the measurements"""
+    return {name: measurement.summary() for name, measurement in results.items()}
@@ -0,0 +1,58 @@
+"""Import time benchmark"""
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from benchmarks.harness import Measurement
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Statements run by each entry point before it does any work
+ENTRY_POINTS = {
+    'import_src': 'import src',
+    'import_bot': 'import src.bot',
+    'import_migrations': 'import src.config, src.extensions, src.models.bot_state, src.models.weekly_post',
+}
+
+
+@dataclass
+class ImportMeasurement(Measurement):
+    """Import times of an entry point and the modules it imported"""
+    modules: int = 0
+
+    def summary(self) -> dict[str, float]:
+        """Return the import time percentiles and the modules imported per run, imports make no round-trips"""
+        summary = super().summary()
+        del summary['round_trips_per_op']
+        # A growing count flags new eager imports
+        summary['modules'] = self.modules / self.operations if self.operations else 0.0
+        return summary
+
+def import_time(statement: str) -> tuple[float, int]:
+    """Run the statement in a fresh interpreter and return its import seconds and the modules it imported"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    total_us, modules = 0, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules += 1
+        # Nested imports are indented, top level ones add up to the total
+        if not name[1:].startswith(' '):
+            total_us += int(cumulative)
+    return total_us / 1e6, modules
+
+def bench_imports(runs: int) -> dict[str, ImportMeasurement]:
+    """Measure the import time of every entry point"""
+    results = {}
+    for name, statement in ENTRY_POINTS.items():
+        measurement = results[name] = ImportMeasurement()
+        for _ in range(runs):
+            seconds, modules = import_time(statement)
+            measurement.add(seconds)
+            measurement.modules += modules
+    return results
@@ -0,0 +1,84 @@
+"""Command line tools
+
+Usage: python cli.py export-posts [--output posts.jsonl] [--format csv|jsonl]
+       python cli.py import-posts posts.csv [--format csv|jsonl]
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from src.config import get_config
+from src.extensions import db
+
+
+async def export_posts(args: argparse.Namespace, chunk_size: int):
+    """Export every weekly post to a file or stdout"""
+    # Imported here so the arguments are parsed without loading the models and discord.py
+    # pylint: disable=import-outside-toplevel
+    from src.util.post_transfer import export_posts as export_rows, format_for
+
+    fmt = args.format or (format_for(args.output) if args.output else 'jsonl')
+    start = time.perf_counter()
+
+    async def progress(exported: int):
+        print(f'Exported {exported} posts...', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as fp:
+            exported = await export_rows(fp, fmt, chunk_size, progress)
+    else:
+        exported = await export_rows(sys.stdout, fmt, chunk_size, progress)
+    print(f'Exported {exported} posts in {time.perf_counter() - start:.1f} s.', file=sys.stderr)
+
+async def import_posts(args: argparse.Namespace, chunk_size: int) -> bool:
+    """Import weekly posts from a file, return whether every row was imported"""
+    # pylint: disable=import-outside-toplevel
+    from src.util.post_transfer import format_for, import_posts as import_rows, read_rows
+
+    fmt = args.format or format_for(args.input)
+    start = time.perf_counter()
+
+    async def progress(imported: int):
+        print(f'Imported {imported} posts...', file=sys.stderr)
+
+    with open(args.input, encoding='utf-8', newline='') as fp:
+        report = await import_rows(read_rows(fp, fmt), chunk_size, progress)
+    for line_num, error in report.errors:
+        print(f'Line {line_num}: {error}', file=sys.stderr)
+    print(f'Imported {report.imported} posts and rejected {report.rejected} in '
+          f'{time.perf_counter() - start:.1f} s.', file=sys.stderr)
+    return report.rejected == 0
+
+async def run(args: argparse.Namespace) -> bool:
+    """Run the command against the configured database"""
+    config = get_config(args.config)
+    db.init_engine(config)
+    try:
+        if args.command == 'export-posts':
+            await export_posts(args, config.POST_TRANSFER_CHUNK_SIZE)
+            return True
+        return await import_posts(args, config.POST_TRANSFER_CHUNK_SIZE)
+    finally:
+        await db.engine.dispose()
+
+def main():
+    """Parse the arguments and run the command"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', help='config to use, defaults to the CONFIG environment variable')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export-posts', help='write the weekly posts as CSV or JSON lines')
+    export_parser.add_argument('--output', '-o', help='file to write, defaults to stdout')
+    export_parser.add_argument('--format', choices=('csv', 'jsonl'), help='defaults to the output file extension')
+
+    import_parser = commands.add_parser('import-posts', help='add weekly posts from CSV or JSON lines')
+    import_parser.add_argument('input', help='file to read')
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'), help='defaults to the input file extension')
+
+    if not asyncio.run(run(parser.parse_args())):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
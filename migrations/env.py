@@ -6,16 +6,24 @@ from logging.config import fileConfig
 import logging
 
 from alembic import context
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import TextClause
 
-from src import create_bot
+from src.config import get_config
 from src.extensions import db
 
 from src.models import (
+    bot_state,
+    command_audit,
+    post_attachment,
+    post_delivery,
+    scheduler_lease,
     weekly_post
 )
 
-# Create bot instance
-bot = create_bot()
+# Only the database engine is needed, creating the bot would load discord.py
+app_config = get_config()
+db.init_engine(app_config)
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -32,11 +40,18 @@ logger = logging.getLogger('alembic.env')
 # target_metadata = mymodel.Base.metadata
 config.set_main_option(
     'sqlalchemy.url',
-    bot.config.SQLALCHEMY_DATABASE_URI
+    app_config.SQLALCHEMY_DATABASE_URI
 )
-logger.info(bot.config.SQLALCHEMY_DATABASE_URI)
+logger.info(app_config.SQLALCHEMY_DATABASE_URI)
 target_metadata = db.Model.metadata
 
+@compiles(TextClause, 'sqlite')
+def compile_sqlite_text(element, compiler, **kw):
+    """SQLite has no now(), the server defaults of the applied revisions that use it get CURRENT_TIMESTAMP"""
+    if element.text == 'now()':
+        return 'CURRENT_TIMESTAMP'
+    return compiler.visit_textclause(element, **kw)
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -80,7 +95,9 @@ def do_run_migrations(connection):
     context.configure(
         connection=connection, 
         target_metadata=target_metadata,
-        process_revision_directives=process_revision_directives
+        process_revision_directives=process_revision_directives,
+        # SQLite can only alter columns by copying the table
+        render_as_batch=connection.dialect.name == 'sqlite'
     )
 
     with context.begin_transaction():
@@ -95,8 +112,12 @@ async def run_migrations_online():
     """
     connectable = db.engine
     
-    async with connectable.connect() as connection:
-        await connection.run_sync(do_run_migrations)
+    try:
+        async with connectable.connect() as connection:
+            await connection.run_sync(do_run_migrations)
+    finally:
+        # Pooled connections would keep the process alive, even after a failed migration
+        await connectable.dispose()
 
 
 if context.is_offline_mode():
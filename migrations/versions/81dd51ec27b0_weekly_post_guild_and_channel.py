@@ -0,0 +1,44 @@
+"""weekly-post-guild-and-channel
+
+Revision ID: 81dd51ec27b0
+Revises: 9cd1d5a0b1a8
+Create Date: 2026-10-18 12:14:52.671305
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '81dd51ec27b0'
+down_revision = '9cd1d5a0b1a8'
+branch_labels = None
+depends_on = None
+
+
+weekly_post = sa.table(
+    'weekly_post',
+    sa.column('guild_id', sa.BigInteger()),
+    sa.column('channel_id', sa.BigInteger()),
+)
+
+
+def upgrade():
+    op.add_column('weekly_post', sa.Column('guild_id', sa.BigInteger(), nullable=True))
+    op.add_column('weekly_post', sa.Column('channel_id', sa.BigInteger(), nullable=True))
+    op.create_index(op.f('ix_weekly_post_guild_id'), 'weekly_post', ['guild_id'], unique=False)
+
+    # Existing posts were sent to the configured guild's main channel
+    guild_id = os.getenv('DISCORD_GUILD_ID')
+    channel_id = os.getenv('DISCORD_MAIN_CHANNEL_ID')
+    if guild_id and channel_id:
+        op.execute(weekly_post.update().values(guild_id=int(guild_id), channel_id=int(channel_id)))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_weekly_post_guild_id'), table_name='weekly_post')
+    op.drop_column('weekly_post', 'channel_id')
+    op.drop_column('weekly_post', 'guild_id')
@@ -0,0 +1,63 @@
+"""weekly-post-next-run-at
+
+Revision ID: 9cd1d5a0b1a8
+Revises: 957f1a6aeb4e
+Create Date: 2026-10-18 11:02:13.204981
+
+"""
+from datetime import datetime, timedelta, timezone
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '9cd1d5a0b1a8'
+down_revision = '957f1a6aeb4e'
+branch_labels = None
+depends_on = None
+
+
+weekly_post = sa.table(
+    'weekly_post',
+    sa.column('id', sa.Integer()),
+    sa.column('day_of_week', sa.Integer()),
+    sa.column('hour', sa.Integer()),
+    sa.column('minute', sa.Integer()),
+    sa.column('next_run_at', sa.DateTime(timezone=True)),
+)
+
+def next_occurrence(now, day_of_week, hour, minute):
+    """Return the first datetime after now on the given weekday, hour and minute"""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    candidate += timedelta(days=(day_of_week - now.weekday()) % 7)
+    if candidate <= now:
+        candidate += timedelta(weeks=1)
+    return candidate
+
+
+def upgrade():
+    op.add_column('weekly_post', sa.Column('next_run_at', sa.DateTime(timezone=True), nullable=True))
+
+    # Backfill the next run of existing posts
+    bind = op.get_bind()
+    now = datetime.now(timezone.utc)
+    rows = bind.execute(
+        sa.select(weekly_post.c.id, weekly_post.c.day_of_week, weekly_post.c.hour, weekly_post.c.minute)
+    ).fetchall()
+    for row in rows:
+        bind.execute(
+            weekly_post.update()
+            .where(weekly_post.c.id == row.id)
+            .values(next_run_at=next_occurrence(now, row.day_of_week, row.hour, row.minute))
+        )
+
+    with op.batch_alter_table('weekly_post') as batch_op:
+        batch_op.alter_column('next_run_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+    op.create_index(op.f('ix_weekly_post_next_run_at'), 'weekly_post', ['next_run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_weekly_post_next_run_at'), table_name='weekly_post')
+    op.drop_column('weekly_post', 'next_run_at')
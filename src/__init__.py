@@ -1,31 +1,35 @@
 """Bot Configuration"""
-import logging
+from typing import TYPE_CHECKING
 
-from src.bot import DustyBot
-from src.cogs import cogs
-from src.config import get_config
-from src.extensions import db
+if TYPE_CHECKING:
+    from src.bot import DustyBot
+    from src.config import Config
 
-DefaultConfig = get_config()
-
-def create_bot(config_object=DefaultConfig) -> DustyBot:
+def create_bot(config_object: 'Config' = None) -> 'DustyBot':
     """Create Flask App"""
-    bot = DustyBot(config_object)
-    bot.set_cogs(cogs)
+    # Imported here so importing src, as migrations and tools do, does not load discord.py
+    # pylint: disable=import-outside-toplevel
+    from src.bot import DustyBot
+    from src.cogs import cogs
+    from src.config import get_config
+    from src.util.logger import configure_logging
+
+    config_object = config_object or get_config()
+    bot = DustyBot(config_object, cogs)
 
     # Configure logger
-    logging.basicConfig(
-        datefmt='%x %X %z',
-        format='%(name)s [%(asctime)s] [%(levelname)s] %(message)s',
-        level=config_object.LEVEL,
-    )
+    bot.log_listener = configure_logging(config_object)
 
     register_extensions(bot)
 
     return bot
 
-def register_extensions(bot: DustyBot):
+def register_extensions(bot: 'DustyBot'):
     """Register all extensions"""
+    from src.extensions import audit, db, metrics, profiler # pylint: disable=import-outside-toplevel
     db.init_bot(bot)
+    metrics.init_bot(bot)
+    audit.init_bot(bot)
+    profiler.init_bot(bot)
 
 __version__ = '0.1.0'
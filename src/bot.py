@@ -1,59 +1,140 @@
 """Discord bot"""
+import asyncio
+import hashlib
+import json
 import logging
-import traceback
-from logging import Formatter
+import os
+import socket
+import time
+from dataclasses import asdict, dataclass
+from logging.handlers import QueueListener
+from typing import Any, Awaitable, Optional, TypeVar
+from uuid import uuid4
 
-from discord import Activity, ActivityType, Guild, HTTPException, Intents, InvalidData, NotFound, TextChannel
-from discord.ext.commands import Bot, ExtensionFailed, ExtensionNotFound, NoEntryPointError
+import yarl
+from discord import (Activity, ActivityType, Guild, HTTPException, Intents, Interaction, InvalidData, MemberCacheFlags,
+                     NotFound, TextChannel, version_info)
+from discord.app_commands import AppCommandError, Command
+from discord.ext.commands import AutoShardedBot, Cog, ExtensionFailed, ExtensionNotFound, NoEntryPointError
+from discord.gateway import DiscordWebSocket
+from discord.shard import Shard
 
 from src.config import Config
-from src.exceptions.bot import MissingBotTokenException
+from src.exceptions.bot import MissingBotTokenException, MissingShardCountException
 from src.exceptions.cog import LoadCogException
+from src.exceptions.database import DatabaseException
+from src.models.bot_state import BotState
+from src.util.date_util import utcnow
+from src.util.logger import log_duration
+from src.util.memory import memory_usage
 
+T = TypeVar('T')
 
-class DustyBot(Bot):
+GATEWAY_SESSION_KEY = 'gateway_session:'
+RESUME_TIMEOUT = 30 # Seconds to wait for a resumed connection before identifying
+# discord.py releases whose shard internals resuming relies on, from the first up to the last excluded
+RESUME_VERSIONS = ((2, 2), (2, 3))
+
+@dataclass
+class GatewaySession:
+    """Gateway session of a shard kept for the next process to resume"""
+    session_id: str
+    sequence: int
+    resume_url: str
+    shard_count: int
+    saved_at: float
+
+class DustyBot(AutoShardedBot):
     """
     Dusty Bot object
     """
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, cogs: dict[str, list[str]] = None):
+        cogs = cogs or {}
+        shard_count = int(config.DISCORD_SHARD_COUNT) if config.DISCORD_SHARD_COUNT else None
+        shard_ids = parse_shard_ids(config.DISCORD_SHARD_IDS)
+        if shard_ids is not None and shard_count is None:
+            # Discord's recommended count is only known once connecting, too late to pick shards out of it
+            raise MissingShardCountException()
         super().__init__(
             command_prefix=config.DISCORD_COMMAND_PREFIX,
             description=config.DISCORD_BOT_DESCRIPTION,
-            intents=Intents.all()
+            intents=required_intents(cogs, config.DISCORD_INTENTS),
+            member_cache_flags=member_cache_flags(config.DISCORD_MEMBER_CACHE),
+            max_messages=config.DISCORD_MAX_MESSAGES or None,
+            chunk_guilds_at_startup=config.DISCORD_CHUNK_GUILDS_AT_STARTUP,
+            shard_count=shard_count,
+            shard_ids=shard_ids
         )
 
         self.config = config
         self.token: str = config.DISCORD_BOT_TOKEN
         self.ready: bool = False
+        # Set while the bot shuts down, so cogs can tell a shutdown from a reload
+        self.closing: bool = False
+        # Identifies this process among the replicas, as the holder of leases
+        self.instance_id: str = f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
         self.my_guild: Guild = None
         self.main_channel: TextChannel = None
         self.db = None
-        self._cogs: list[str] = []
+        self.metrics = None
+        self.audit = None
+        self.profiler = None
+        self.log_listener: QueueListener = None
+        self._cogs: list[str] = list(cogs)
+        # State cogs hand off to their next instance when their extension is reloaded
+        self.cog_state: dict[str, Any] = {}
+        self._gateway_sessions: dict[int, GatewaySession] = {}
         self._log = logging.getLogger('DustyBot')
 
         if not self.token:
             raise MissingBotTokenException()
 
-    def set_cogs(self, cogs: list[str]):
-        """Set the bot cogs to load when it runs"""
-        self._cogs = cogs
+    def owns_guild(self, guild_id: int) -> bool:
+        """Return whether the guild belongs to a shard run by this process"""
+        if self.shard_ids is None:
+            return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def can_resume_sessions(self) -> bool:
+        """
+        Return whether gateway sessions are saved and resumed across restarts.
+        Resuming registers the shards through discord.py internals and starts
+        without the guilds Discord sends on identify, so it is only done with the
+        releases it was written against, the others identify as usual.
+        """
+        # pylint: disable=protected-access
+        first, last = RESUME_VERSIONS
+        return (
+            self.config.DISCORD_RESUME_SESSIONS
+            and first <= (version_info.major, version_info.minor) < last
+            and hasattr(self, '_AutoShardedClient__shards')
+            and hasattr(self._connection, '_ready_tasks')
+        )
+
+    def memory_report(self) -> str:
+        """Return the process memory usage and the size of the discord caches"""
+        rss, peak_rss = memory_usage()
+        return (
+            f'rss={rss / 2**20:.1f}MiB peak_rss={peak_rss / 2**20:.1f}MiB '
+            f'guilds={len(self.guilds)} '
+            f'members={sum(len(guild.members) for guild in self.guilds)} '
+            f'users={len(self.users)} '
+            f'messages={len(self.cached_messages)} '
+            f'intents={self.intents.value}'
+        )
 
     def run(self):
         """Run the bot"""
         if not self.token:
             raise MissingBotTokenException()
 
-        formatter = Formatter(
-            fmt='%(name)s [%(asctime)s] [%(levelname)s] %(message)s',
-            datefmt='%x %X %z'
-        )
-        super().run(
-            token=self.token,
-            reconnect=True,
-            log_formatter=formatter,
-            log_level=logging.INFO
-        )
+        try:
+            # Logging is routed through the queue listener set up by create_bot
+            super().run(token=self.token, reconnect=True, log_handler=None)
+        finally:
+            if self.log_listener is not None:
+                self.log_listener.stop()
 
     async def load_cogs(self):
         """Load the cogs in the cogs folder"""
@@ -63,6 +144,30 @@ class DustyBot(Bot):
             except (ExtensionNotFound, NoEntryPointError, ExtensionFailed) as e:
                 raise LoadCogException(ext) from e
 
+    async def reload_cogs(self, *extensions: str) -> list[str]:
+        """
+        Reload the given extensions, or every cog, in place without reconnecting.
+        Extensions that are not loaded yet are loaded, a failed reload keeps
+        the previous version. The command tree is synced if the commands changed.
+        """
+        extensions = extensions or tuple(self._cogs)
+        for ext in extensions:
+            try:
+                if ext in self.extensions:
+                    await self.reload_extension(ext)
+                else:
+                    await self.load_extension(ext)
+            except (ExtensionNotFound, NoEntryPointError, ExtensionFailed) as e:
+                raise LoadCogException(ext) from e
+            self._log.info('Reloaded extension %s.', ext)
+
+        await self.sync_tree()
+        return list(extensions)
+
+    async def add_cog(self, cog: Cog, /, **kwargs: Any):
+        await super().add_cog(cog, **kwargs)
+        self.profiler.instrument(cog)
+
     async def on_ready(self):
         if not self.ready:
             self.ready = True
@@ -79,34 +184,201 @@ class DustyBot(Bot):
                 '\n========================================================\n',
                 str(self.user)
             )
+            self._log.info('Database pool: %s', self.db.pool_stats())
+            self._log.info('Memory: %s', self.memory_report())
 
     async def setup_hook(self):
+        self.tree.error(self.on_app_command_error)
+        with log_duration(self._log, 'Setup'):
+            # Before the cogs load, so their loops are timed
+            await self.profiler.start()
+            await asyncio.gather(
+                self._timed('Fetch guild', self.fetch_main_guild()),
+                self._timed('Fetch main channel', self.fetch_main_channel()),
+                self._timed('Fetch owner', self.fetch_owner_id()),
+                self._timed('Database warm up', self.db.warm_up()),
+                self._timed('Start metrics server', self.metrics.start()),
+                self._timed('Start audit log', self.audit.start()),
+                self._timed('Load cogs', self.load_cogs()),
+                self._timed('Load gateway sessions', self.load_gateway_sessions()),
+            )
+            await self._timed('Command tree sync', self.sync_tree())
+
+    async def launch_shard(self, gateway: yarl.URL, shard_id: int, *, initial: bool = False):
+        """Resume the session the previous process saved for the shard, or identify if there is none"""
+        session = self._gateway_sessions.pop(shard_id, None)
+        if (
+            session is None
+            or session.shard_count != self.shard_count
+            or not hasattr(self, '_AutoShardedClient__queue')
+        ):
+            return await super().launch_shard(gateway, shard_id, initial=initial)
+
+        try:
+            coro = DiscordWebSocket.from_client(
+                self,
+                initial=initial,
+                gateway=yarl.URL(session.resume_url),
+                shard_id=shard_id,
+                session=session.session_id,
+                sequence=session.sequence,
+                resume=True
+            )
+            ws = await asyncio.wait_for(coro, timeout=RESUME_TIMEOUT)
+        except Exception: # pylint: disable=broad-except
+            self._log.warning('Could not resume the session of shard ID %d, identifying.', shard_id, exc_info=True)
+            return await super().launch_shard(gateway, shard_id, initial=initial)
+
+        # Register the shard the way AutoShardedClient.launch_shard does. A session
+        # Discord rejects is invalidated and the shard identifies on its own.
+        # pylint: disable=no-member
+        shard = Shard(ws, self, self._AutoShardedClient__queue.put_nowait)
+        self._AutoShardedClient__shards[shard_id] = shard
+        shard.launch()
+
+    async def on_shard_resumed(self, shard_id: int):
+        """Count a shard resumed on startup as ready, Discord sends no READY for a resumed session"""
+        # pylint: disable=protected-access
+        state = self._connection
+        if self.is_ready() or shard_id in state._ready_tasks:
+            return
+
+        self._log.info('Resumed the gateway session of shard ID %d.', shard_id)
+        state._ready_tasks[shard_id] = asyncio.create_task(asyncio.sleep(0))
+        if len(state._ready_tasks) == len(state.shard_ids):
+            state._ready_task = asyncio.create_task(state._delay_ready())
+
+    async def load_gateway_sessions(self):
+        """Load the gateway sessions saved by the previous process that are recent enough to resume"""
+        if not self.config.DISCORD_RESUME_SESSIONS:
+            return
+        if not self.can_resume_sessions():
+            self._log.warning('Resuming gateway sessions is not supported with discord.py %d.%d.%d, identifying.',
+                              version_info.major, version_info.minor, version_info.micro)
+            return
+
+        try:
+            values = await BotState.pop_values(GATEWAY_SESSION_KEY)
+        except DatabaseException:
+            self._log.error('Error loading the gateway sessions.', exc_info=True)
+            return
+
+        for key, value in values.items():
+            session = GatewaySession(**json.loads(value))
+            if time.time() - session.saved_at <= self.config.DISCORD_RESUME_MAX_AGE:
+                self._gateway_sessions[int(key[len(GATEWAY_SESSION_KEY):])] = session
+        self._log.info('Loaded %d gateway sessions to resume.', len(self._gateway_sessions))
+
+    async def save_gateway_sessions(self):
+        """Disconnect the shards without ending their sessions and save them for the next process"""
+        for shard_id, info in self.shards.items():
+            shard: Shard = info._parent # pylint: disable=protected-access
+            shard._cancel_task() # pylint: disable=protected-access
+            # Closing with 1000 or 1001 would end the session
+            await shard.ws.close(code=4000)
+
+            ws = shard.ws
+            if ws.session_id is None or ws.sequence is None:
+                continue
+            session = GatewaySession(ws.session_id, ws.sequence, str(ws.gateway), self.shard_count, time.time())
+            try:
+                await BotState.set_value(f'{GATEWAY_SESSION_KEY}{shard_id}', json.dumps(asdict(session)))
+            except DatabaseException:
+                self._log.error('Error saving the gateway session of shard ID %d.', shard_id, exc_info=True)
+
+    async def on_app_command_completion(self, interaction: Interaction, command: Command):
+        """Record the latency of completed app commands and audit them"""
+        seconds = (utcnow() - interaction.created_at).total_seconds()
+        self.metrics.app_command_seconds.observe(seconds, command=command.qualified_name, status='ok')
+        if self.profiler.enabled:
+            self.profiler.record(f'command:{command.qualified_name}', seconds)
+        self.audit.record(interaction, command.qualified_name, 'ok')
+
+    async def on_app_command_error(self, interaction: Interaction, error: AppCommandError):
+        """Log app command errors, record the latency of failed commands and audit them"""
+        command = interaction.command
+        name = command.qualified_name if command else 'unknown'
+        self._log.error('Ignoring exception in command %s.', name, exc_info=error)
+        seconds = (utcnow() - interaction.created_at).total_seconds()
+        self.metrics.app_command_seconds.observe(seconds, command=name, status='error')
+        if self.profiler.enabled:
+            self.profiler.record(f'command:{name}', seconds)
+        self.audit.record(interaction, name, 'error', error)
+
+    async def fetch_main_guild(self):
+        """Fetch the configured guild"""
+        guild_id = self.config.DISCORD_GUILD_ID
+        if not guild_id:
+            return
+
         try:
-            guild_id = self.config.DISCORD_GUILD_ID
             self.my_guild = await self.fetch_guild(int(guild_id))
         except HTTPException as e:
-            self._log.error('Error fetching guild with ID %s.', guild_id)
-            traceback.print_exception(e)
+            self._log.error('Error fetching guild with ID %s.', guild_id, exc_info=e)
+
+    async def fetch_main_channel(self):
+        """Fetch the configured main channel"""
+        channel_id = self.config.DISCORD_MAIN_CHANNEL_ID
+        if not channel_id:
+            return
 
         try:
-            channel_id = self.config.DISCORD_MAIN_CHANNEL_ID
             self.main_channel = await self.fetch_channel(int(channel_id))
         except (HTTPException, InvalidData, NotFound) as e:
-            self._log.error('Error fetching channel with ID %s.', channel_id)
-            traceback.print_exception(e)
+            self._log.error('Error fetching channel with ID %s.', channel_id, exc_info=e)
 
+    async def fetch_owner_id(self):
+        """Use the configured owner, or the application owner if none is set"""
         try:
             self.owner_id = int(self.config.DISCORD_OWNER_ID)
         except ValueError:
             app_info = await self.application_info()
             self.owner_id = app_info.owner.id
 
-        await self.load_cogs()
+    async def sync_tree(self, force: bool = False):
+        """Sync the app commands with Discord if their definitions changed since the last sync"""
+        commands = [command.to_dict() for command in self.tree.get_commands()]
+        tree_hash = hashlib.sha256(json.dumps(commands, sort_keys=True).encode()).hexdigest()
+        key = f'command_tree_hash:{self.application_id}'
+
+        try:
+            synced_hash = await BotState.get_value(key)
+        except DatabaseException:
+            self._log.warning('Error reading the command tree hash.', exc_info=True)
+            synced_hash = None
+
+        if synced_hash == tree_hash and not force:
+            self._log.info('Command tree unchanged, skipping sync.')
+            return
+
         await self.tree.sync()
+        try:
+            await BotState.set_value(key, tree_hash)
+        except DatabaseException:
+            self._log.error('Error storing the command tree hash.', exc_info=True)
+
+    async def _timed(self, phase: str, coro: Awaitable[T]) -> T:
+        """Await the coroutine and log how long it took"""
+        with log_duration(self._log, phase):
+            return await coro
 
     async def close(self):
-        await self.db.engine.dispose()
+        self.closing = True
+        # First, since the process is killed a few seconds after it is asked to stop
+        # and unloading the cogs waits for their loops
+        await asyncio.gather(
+            self.audit.stop(),
+            *(cog.before_close() for cog in self.cogs.values() if hasattr(cog, 'before_close'))
+        )
+        if self.can_resume_sessions() and not self.is_closed():
+            await self.save_gateway_sessions()
+        # Unloads the cogs while the database is still available
         await super().close()
+        await self.metrics.stop()
+        # Commands that completed while closing
+        await self.audit.flush()
+        self.profiler.disable()
+        await self.db.engine.dispose()
         self._log.info(
             '\n========================================================\n'
             '\n\tDUSTY BOT IS OFFLINE !\n'
@@ -114,3 +386,32 @@ class DustyBot(Bot):
             '\n========================================================\n',
             str(self.user)
         )
+
+def parse_flags(value: str) -> dict[str, bool]:
+    """Parse a comma separated list of flag names into flag keyword arguments"""
+    return {name.strip(): True for name in value.split(',') if name.strip()}
+
+def required_intents(cogs: dict[str, list[str]], extra: str = '') -> Intents:
+    """Return the union of the intents needed by the cogs and the extra intents"""
+    flags = parse_flags(extra)
+    for intents in cogs.values():
+        flags.update(parse_flags(','.join(intents)))
+    return Intents(**flags)
+
+def member_cache_flags(value: str) -> MemberCacheFlags:
+    """Return member cache flags with only the given flags enabled"""
+    flags = MemberCacheFlags.none()
+    for name in parse_flags(value):
+        setattr(flags, name, True)
+    return flags
+
+def parse_shard_ids(value: str) -> Optional[list[int]]:
+    """Parse a comma separated list of shard ids and ranges such as 0,2,4-7"""
+    if not value:
+        return None
+
+    shard_ids = []
+    for part in value.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids
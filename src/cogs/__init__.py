@@ -1,5 +1,8 @@
 """List of bot cogs"""
 
-cogs = [
-    'src.cogs.weekly_post'
-]
+# Extension mapped to the gateway intents its cog needs,
+# the bot only requests the union of these intents
+cogs = {
+    'src.cogs.weekly_post': ['guilds'],
+    'src.cogs.admin': [],
+}
@@ -0,0 +1,236 @@
+"""Bot administration cog"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Literal, Optional
+
+from aiohttp import ClientError
+from discord import Attachment, File, HTTPException, Interaction, app_commands
+from discord.ext import commands, tasks
+
+from src.bot import DustyBot
+from src.exceptions.cog import LoadCogException
+from src.exceptions.database import DatabaseException
+from src.exceptions.profiler import ProfileInProgressException
+from src.util.checks import is_owner
+from src.util.logger import log_app_command
+from src.util.media import download
+from src.util.post_transfer import export_posts, format_for, import_posts, read_rows
+
+MAX_UPLOAD_SIZE = 10 * 2**20 # Discord's upload limit without boosts
+PROGRESS_INTERVAL = 2.0 # Seconds between progress updates of long running commands
+
+
+class AdminCog(commands.Cog):
+    """
+    Owner commands to manage the running bot
+    """
+
+    def __init__(self, bot: DustyBot):
+        self.bot = bot
+        self._log = logging.getLogger('AdminCog')
+        self._mtimes: dict[str, float] = bot.cog_state.pop(self.qualified_name, {}).get('mtimes', {})
+        if bot.config.COG_WATCH:
+            self.watch_cogs.change_interval(seconds=bot.config.COG_WATCH_INTERVAL) # pylint: disable=no-member
+            self.watch_cogs.start() # pylint: disable=no-member
+
+    async def cog_unload(self):
+        # The watcher may be the one reloading this cog, let it finish instead of cancelling it
+        self.watch_cogs.stop() # pylint: disable=no-member
+        self.bot.cog_state[self.qualified_name] = {'mtimes': self._mtimes}
+
+    async def cog_app_command_error(self, interaction: Interaction, error: app_commands.AppCommandError):
+        if isinstance(error, app_commands.CheckFailure):
+            await interaction.response.send_message('Only the bot owner can do this.', ephemeral=True)
+
+    @app_commands.command(name='reload')
+    @is_owner()
+    async def reload(self, interaction: Interaction, extension: Optional[str] = None):
+        """Reload cogs without reconnecting
+
+        Args:
+            extension (str): Extension to reload, defaults to every cog
+        """
+        log_app_command(self._log, interaction)
+        await interaction.response.defer(ephemeral=True)
+
+        try:
+            reloaded = await self.bot.reload_cogs(*([extension] if extension else []))
+            await interaction.followup.send(f'Reloaded {", ".join(reloaded)}.')
+        except LoadCogException as e:
+            self._log.error('Error reloading extension %s.', extension, exc_info=True)
+            await interaction.followup.send(f'{e}, the previous version is still running.')
+
+    @reload.autocomplete('extension')
+    async def reload_autocomplete(self, interaction: Interaction, current: str) -> list[app_commands.Choice[str]]: # pylint: disable=unused-argument
+        """Suggest the loaded extensions"""
+        return [
+            app_commands.Choice(name=ext, value=ext)
+            for ext in self.bot.extensions
+            if current in ext
+        ][:25]
+
+    profile = app_commands.Group(name='profile', description='Profile the event loop')
+
+    @profile.command(name='start')
+    @is_owner()
+    async def profile_start(self, interaction: Interaction):
+        """Log slow callbacks and time tasks, commands and loops"""
+        log_app_command(self._log, interaction)
+        self.bot.profiler.enable()
+        await interaction.response.send_message(
+            f'Profiling, logging callbacks slower than {self.bot.profiler.slow_callback:.3f} s.', ephemeral=True
+        )
+
+    @profile.command(name='stop')
+    @is_owner()
+    async def profile_stop(self, interaction: Interaction):
+        """Stop profiling and show the recorded timings"""
+        log_app_command(self._log, interaction)
+        self.bot.profiler.disable()
+        await interaction.response.send_message(f'```\n{self.bot.profiler.report()}\n```', ephemeral=True)
+        self.bot.profiler.reset()
+
+    @profile.command(name='report')
+    @is_owner()
+    async def profile_report(self, interaction: Interaction):
+        """Show the timings recorded since profiling started"""
+        log_app_command(self._log, interaction)
+        await interaction.response.send_message(f'```\n{self.bot.profiler.report()}\n```', ephemeral=True)
+
+    @profile.command(name='capture')
+    @is_owner()
+    async def profile_capture(self, interaction: Interaction, seconds: app_commands.Range[int, 1, 300] = 30):
+        """Sample the event loop into a flame graph profile
+
+        Args:
+            seconds (int): How long to sample for
+        """
+        log_app_command(self._log, interaction)
+        await interaction.response.defer(ephemeral=True)
+
+        try:
+            path, samples = await self.bot.profiler.capture(seconds)
+        except ProfileInProgressException as e:
+            await interaction.followup.send(f'{e}.')
+            return
+
+        if await asyncio.to_thread(os.path.getsize, path) > self._upload_limit(interaction):
+            top_frames = await asyncio.to_thread(self.bot.profiler.top_frames, path)
+            await interaction.followup.send(
+                f'Captured {samples} samples to {path}, too large to upload. Busiest frames:\n```\n{top_frames}\n```'
+            )
+            return
+        await interaction.followup.send(f'Captured {samples} samples to {path}.', file=File(path))
+
+    @app_commands.command(name='exportwp')
+    @is_owner()
+    async def export_weekly_posts(self, interaction: Interaction, file_format: Literal['csv', 'jsonl'] = 'jsonl'):
+        """Export every weekly post as a file
+
+        Args:
+            file_format (str): CSV or JSON lines
+        """
+        log_app_command(self._log, interaction)
+        await interaction.response.defer(ephemeral=True)
+
+        progress = self._progress_reporter(interaction, 'Exported')
+        fd, path = await asyncio.to_thread(tempfile.mkstemp, suffix=f'.{file_format}')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as fp:
+                exported = await export_posts(fp, file_format, self.bot.config.POST_TRANSFER_CHUNK_SIZE, progress)
+            if await asyncio.to_thread(os.path.getsize, path) > self._upload_limit(interaction):
+                await interaction.followup.send(f'The export of {exported} posts is too large to upload, '
+                                                'use `python cli.py export-posts` instead.')
+                return
+            await interaction.followup.send(
+                f'Exported {exported} posts.', file=File(path, filename=f'weekly_posts.{file_format}')
+            )
+        except DatabaseException:
+            self._log.error('Error exporting the weekly posts.', exc_info=True)
+            await interaction.followup.send('There was an error exporting the weekly posts.')
+        finally:
+            await asyncio.to_thread(os.remove, path)
+
+    @app_commands.command(name='importwp')
+    @is_owner()
+    async def import_weekly_posts(self, interaction: Interaction, file: Attachment):
+        """Add the weekly posts of a CSV or JSON lines file
+
+        Args:
+            file (Attachment): Posts exported with /exportwp or python cli.py export-posts
+        """
+        log_app_command(self._log, interaction)
+        await interaction.response.defer(ephemeral=True)
+
+        fd, path = await asyncio.to_thread(tempfile.mkstemp, suffix=os.path.splitext(file.filename)[1])
+        os.close(fd)
+        try:
+            await download(file.url, path, self.bot.config.MEDIA_CHUNK_SIZE)
+            fp = await asyncio.to_thread(open, path, encoding='utf-8', newline='')
+            with fp:
+                report = await import_posts(
+                    read_rows(fp, format_for(file.filename)),
+                    self.bot.config.POST_TRANSFER_CHUNK_SIZE,
+                    self._progress_reporter(interaction, 'Imported')
+                )
+        except (ClientError, OSError, UnicodeDecodeError):
+            self._log.error('Error reading the weekly posts file %s.', file.filename, exc_info=True)
+            await interaction.followup.send('There was an error reading your file.')
+            return
+        except DatabaseException:
+            self._log.error('Error importing the weekly posts of %s.', file.filename, exc_info=True)
+            await interaction.followup.send('There was an error importing the weekly posts, none were added.')
+            return
+        finally:
+            await asyncio.to_thread(os.remove, path)
+
+        self._log.info('Imported %d weekly posts and rejected %d.', report.imported, report.rejected)
+        lines = [f'Imported {report.imported} posts and rejected {report.rejected}.']
+        lines.extend(f'Line {line_num}: {error}' for line_num, error in report.errors[:10])
+        await interaction.followup.send('\n'.join(lines)[:2000])
+
+    @staticmethod
+    def _upload_limit(interaction: Interaction) -> int:
+        """Return the largest file the response can upload, boosted servers allow larger files"""
+        return interaction.guild.filesize_limit if interaction.guild is not None else MAX_UPLOAD_SIZE
+
+    def _progress_reporter(self, interaction: Interaction, verb: str):
+        """Return a progress callback editing the deferred response at most every progress interval"""
+        last_update = time.monotonic()
+
+        async def progress(count: int):
+            nonlocal last_update
+            if time.monotonic() - last_update < PROGRESS_INTERVAL:
+                return
+            last_update = time.monotonic()
+            try:
+                await interaction.edit_original_response(content=f'{verb} {count} posts...')
+            except HTTPException:
+                self._log.warning('Could not report the progress of %s.', interaction.command.name, exc_info=True)
+        return progress
+
+    @tasks.loop(seconds=1)
+    async def watch_cogs(self):
+        """Reload the extensions whose source file changed"""
+        changed = []
+        for ext, module in list(self.bot.extensions.items()):
+            try:
+                mtime = os.stat(module.__file__).st_mtime
+            except OSError:
+                continue
+            if self._mtimes.setdefault(ext, mtime) != mtime:
+                self._mtimes[ext] = mtime
+                changed.append(ext)
+
+        for ext in changed:
+            self._log.info('[watch_cogs] %s changed, reloading.', ext)
+            try:
+                await self.bot.reload_cogs(ext)
+            except LoadCogException:
+                self._log.error('[watch_cogs] Error reloading extension %s.', ext, exc_info=True)
+
+async def setup(bot: DustyBot):
+    await bot.add_cog(AdminCog(bot))
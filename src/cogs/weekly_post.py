@@ -1,114 +1,466 @@
 """Weekend posts task cog"""
 import asyncio
+import calendar
 import logging
+import os
 from datetime import datetime, timedelta
 
-from discord import Interaction, app_commands
+from typing import Optional, Union
+
+from aiohttp import ClientError
+from discord import Attachment, Interaction, app_commands
+from discord.app_commands import AppCommandChannel
+from discord.abc import Messageable
 from discord.ext import commands, tasks
+from sqlalchemy.sql import ColumnElement
 
 from src.bot import DustyBot
+from src.extensions import db, metrics
+from src.models.post_attachment import PostAttachment
+from src.models.post_delivery import PostDelivery
+from src.models.scheduler_lease import SchedulerLease
 from src.models.weekly_post import WeeklyPost
-from src.util.date_util import ceil_datetime, seconds_until
+from src.util.cron import parse_cron
+from src.util.date_util import seconds_until, utcnow
+from src.util.dispatcher import Delivery, DeliveryResult, PostDispatcher
 from src.util.logger import log_app_command
+from src.util.media import AttachmentCache, download, url_expiry
+from src.util.schedule import Schedule
+from src.util.transformers import TextChannelTransformer
+from src.exceptions.cron import InvalidCronException
 from src.exceptions.database import DatabaseException
 
+RETRY_DELAY = 60 # Seconds to wait before retrying after a database error
+PRUNE_INTERVAL = timedelta(hours=1) # Time between deletions of old delivery ledger entries
+LIST_LIMIT = 15 # Posts shown by /listwp
+
 
 class WeeklyPostCog(commands.Cog):
     """
-    Class to create tasks for sending scheduled posts
+    Class to create tasks for sending scheduled posts.
+
+    Every replica running the same shards handles commands, only the one
+    holding the scheduler lease sends the posts. Each run of a post is
+    claimed in the delivery ledger before it is sent, so a run is never
+    sent twice while the lease changes hands.
     """
 
     def __init__(self, bot: DustyBot):
         self.bot = bot
         self._log = logging.getLogger('WeeklyPostCog')
-        self.syncing_time = False
+
+        # Take over the schedule, lease and rate limits of the instance replaced by a reload
+        state = bot.cog_state.pop(self.qualified_name, {})
+        self._handed_off = bool(state)
+        self.schedule: Schedule = state.get('schedule') or Schedule()
+        self.lease_until: Optional[datetime] = state.get('lease_until')
+        self._last_post_id: int = state.get('last_post_id', 0)
+        self._pruned_at: Optional[datetime] = state.get('pruned_at')
+        self.dispatcher: PostDispatcher = state.get('dispatcher') or PostDispatcher(
+            concurrency=bot.config.DISPATCH_CONCURRENCY,
+            max_attempts=bot.config.DISPATCH_MAX_ATTEMPTS,
+            coalesce=bot.config.DISPATCH_COALESCE,
+            send_timeout=bot.config.DISPATCH_SEND_TIMEOUT
+        )
+        self.attachment_cache = AttachmentCache(bot.http, bot.config.MEDIA_URL_MARGIN)
+        self._schedule_changed = asyncio.Event()
+        # Set whenever the heartbeat takes or renews the lease, wakes a follower's send_posts
+        self._lease_renewed = asyncio.Event()
+        self.heartbeat.change_interval(seconds=bot.config.SCHEDULER_HEARTBEAT) # pylint: disable=no-member
+        self.heartbeat.start() # pylint: disable=no-member
         self.send_posts.start() # pylint: disable=no-member
 
-    @tasks.loop(minutes=30)
+    async def cog_unload(self):
+        """
+        Let the current iterations finish, then hand the schedule and lease to the next instance,
+        or release the lease to another replica when the bot shuts down
+        """
+        self.heartbeat.stop() # pylint: disable=no-member
+        self.send_posts.stop() # pylint: disable=no-member
+        self._schedule_changed.set()
+        self._lease_renewed.set()
+        loop_tasks = [self.heartbeat.get_task(), self.send_posts.get_task()] # pylint: disable=no-member
+        loop_tasks = [task for task in loop_tasks if task is not None]
+        if loop_tasks:
+            # Waited without raising, before_close cancels the heartbeat
+            await asyncio.wait(loop_tasks)
+
+        if self.bot.closing:
+            if self.is_leader:
+                await self.release_lease()
+            return
+
+        self.bot.cog_state[self.qualified_name] = {
+            'schedule': self.schedule,
+            'dispatcher': self.dispatcher,
+            'lease_until': self.lease_until,
+            'last_post_id': self._last_post_id,
+            'pruned_at': self._pruned_at,
+        }
+
+    async def before_close(self):
+        """Release the lease as soon as the bot starts closing, rather than once the loops are done"""
+        # Cancelled rather than stopped, stopping waits out the interval and renews the lease once more
+        self.heartbeat.cancel() # pylint: disable=no-member
+        if self.is_leader:
+            await self.release_lease()
+
+    @property
+    def lease_name(self) -> str:
+        """Return the scheduler lease of this process's shards, replicas of other shards elect their own"""
+        if self.bot.shard_ids is None:
+            return 'weekly_post'
+        shard_ids = ','.join(str(shard_id) for shard_id in sorted(self.bot.shard_ids))
+        return f'weekly_post:{self.bot.shard_count}:{shard_ids}'
+
+    @property
+    def is_leader(self) -> bool:
+        """Return whether this replica holds a valid scheduler lease"""
+        return self.lease_until is not None and utcnow() < self.lease_until
+
+    async def release_lease(self):
+        """Give up the scheduler lease"""
+        try:
+            await SchedulerLease.release(self.lease_name, self.bot.instance_id, utcnow())
+            self._log.info('Released the scheduler lease %s.', self.lease_name)
+        except DatabaseException:
+            self._log.error('There was an error releasing the scheduler lease.', exc_info=True)
+        self.lease_until = None
+
+    def schedule_post(self, post: Union[WeeklyPost, tuple]):
+        """Add a post, or a record of its id and next run, to the schedule and wake the task"""
+        self.schedule.add(post.id, post.next_run_at)
+        self._schedule_changed.set()
+
+    def owned_posts(self) -> list[ColumnElement]:
+        """Return the clauses matching posts of the guilds handled by this process"""
+        if self.bot.shard_ids is None:
+            return []
+
+        main_guild_id = self.bot.config.DISCORD_GUILD_ID
+        include_unassigned = bool(main_guild_id) and self.bot.owns_guild(int(main_guild_id))
+        return [WeeklyPost.in_shards(self.bot.shard_count, self.bot.shard_ids, include_unassigned)]
+
+    def channel_for(self, post: Union[WeeklyPost, tuple]) -> Optional[Messageable]:
+        """Return the channel to send a post to, posts without a channel go to the main channel"""
+        if post.channel_id is None:
+            return self.bot.main_channel
+        return self.bot.get_partial_messageable(post.channel_id, guild_id=post.guild_id)
+
+    async def load_schedule(self):
+        """Replace the schedule with every post of the guilds handled by this process"""
+        posts = await WeeklyPost.get_fire_times(*self.owned_posts())
+        self.schedule.clear()
+        for post in posts:
+            self.schedule_post(post)
+            self._last_post_id = max(self._last_post_id, post.id)
+        self._log.info('Scheduled %d posts.', len(self.schedule))
+
+    async def load_new_posts(self):
+        """
+        Schedule the posts created since the schedule was loaded, possibly by other replicas.
+
+        Ids are taken before their transaction commits, so a post committed after one with a higher id
+        is missed by the id check. The post running first is also scheduled when it runs before
+        anything scheduled, since every due post is sent once the schedule wakes up for it.
+        """
+        posts = await WeeklyPost.get_fire_times(WeeklyPost.id > self._last_post_id, *self.owned_posts())
+        for post in posts:
+            if post.id not in self.schedule:
+                self.schedule_post(post)
+            self._last_post_id = max(self._last_post_id, post.id)
+
+        earliest = await WeeklyPost.get_earliest(*self.owned_posts())
+        next_fire = self.schedule.next_fire_time()
+        if earliest is not None and (next_fire is None or earliest.next_run_at < next_fire):
+            self._log.info('[heartbeat] Scheduling post ID %d missed by the schedule.', earliest.id)
+            self.schedule_post(earliest)
+
+    @tasks.loop(seconds=5)
+    async def heartbeat(self):
+        """Renew the scheduler lease, or take it over once the leader's lease expired"""
+        was_leader = self.is_leader
+        now = utcnow()
+        ttl = timedelta(seconds=self.bot.config.SCHEDULER_LEASE_TTL)
+        try:
+            if not await SchedulerLease.acquire(self.lease_name, self.bot.instance_id, ttl, now):
+                if was_leader:
+                    self._log.warning('[heartbeat] Lost the scheduler lease %s.', self.lease_name)
+                self.lease_until = None
+                return
+
+            if was_leader:
+                await self.load_new_posts()
+            else:
+                self._log.info('[heartbeat] Took the scheduler lease %s.', self.lease_name)
+                await self.load_schedule()
+            # Only lead with an up to date schedule, otherwise the lease lapses and the schedule is reloaded
+            self.lease_until = now + ttl
+            self._lease_renewed.set()
+
+            if self._pruned_at is None or now - self._pruned_at >= PRUNE_INTERVAL:
+                await PostDelivery.prune(now - timedelta(days=self.bot.config.DELIVERY_RETENTION_DAYS))
+                self._pruned_at = now
+        except DatabaseException:
+            self._log.error('[heartbeat] There was an error renewing the scheduler lease.', exc_info=True)
+
+    @heartbeat.before_loop
+    async def before_heartbeat(self):
+        """Wait for the shards this process runs"""
+        await self.bot.wait_until_ready()
+
+    @tasks.loop()
     async def send_posts(self):
-        """Send posts from database on their scheduled day and time"""
-        self._log.info('[send_post] Executing send_posts task.')
-        now = datetime.now()
+        """Sleep until the next scheduled post is due, then send every due post"""
+        next_fire = self.schedule.next_fire_time()
+        delay = None if next_fire is None else seconds_until(next_fire)
+        self._log.debug('[send_posts] Sleeping until %s.', next_fire)
+
+        try:
+            await asyncio.wait_for(self._schedule_changed.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        self._schedule_changed.clear()
+
+        now = utcnow()
+        next_fire = self.schedule.next_fire_time()
+        if next_fire is None or next_fire > now:
+            # Woken up by a schedule change
+            return
+        if not self.is_leader:
+            # The leader sends the posts, keep them scheduled in case this replica takes over. Due posts
+            # would wake the loop right away, wait for the lease instead of spinning.
+            self._lease_renewed.clear()
+            try:
+                await asyncio.wait_for(self._lease_renewed.wait(), timeout=self.bot.config.SCHEDULER_HEARTBEAT)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        with metrics.send_posts_seconds.time():
+            await self._send_due_posts(now)
 
+    async def _send_due_posts(self, now: datetime):
+        """Send the posts due at now and advance them to their next run"""
         try:
-            posts_for_today = await WeeklyPost.get_by_day_of_week(now.weekday())
+            posts = await WeeklyPost.get_due(now, *self.owned_posts())
+            claim, claimed = await PostDelivery.claim_slots(
+                ((post.id, post.next_run_at) for post in posts), self.bot.instance_id
+            )
+            attachments = await PostAttachment.get_for_posts(claimed)
+            await self.attachment_cache.refresh(
+                [attachment for post_attachments in attachments.values() for attachment in post_attachments], now
+            )
         except DatabaseException:
-            self._log.error('There was an error getting the weekly posts.')
-            posts_for_today = []
+            self._log.error('[send_posts] There was an error getting the due weekly posts.', exc_info=True)
+            await asyncio.sleep(RETRY_DELAY)
+            return
 
-        self._log.info('[send_post] Got %d posts for weekday %d.', len(posts_for_today), now.weekday())
-        self._log.info('[send_post] Sending posts with hour %d and minute %d.', now.hour, now.minute)
+        if len(claimed) < len(posts):
+            self._log.warning('[send_posts] Skipping %d due posts already claimed by another replica.',
+                              len(posts) - len(claimed))
+        self._log.info('[send_posts] Sending %d due posts.', len(claimed))
+        results: list[DeliveryResult] = []
+        uploads: dict[int, list[PostAttachment]] = {}
+        try:
+            deliveries = []
+            for post in posts:
+                if post.id not in claimed:
+                    continue
+                channel = self.channel_for(post)
+                if channel is None:
+                    self._log.error('[send_posts] Post ID %d has no channel to be sent to.', post.id)
+                    results.append(DeliveryResult(post.id, False, 0))
+                    continue
+                content, embeds, uploads[post.id] = self.attachment_cache.message_parts(
+                    post.content, post.embeds, attachments.get(post.id, []), now
+                )
+                files = [(attachment.path, attachment.filename) for attachment in uploads[post.id]]
+                deliveries.append(Delivery(post.id, channel, content, {'embeds': embeds}, files, post.next_run_at))
+                metrics.send_posts_drift_seconds.observe((now - post.next_run_at).total_seconds())
+
+            results.extend(await self.dispatcher.dispatch(deliveries))
+        except Exception as e: # pylint: disable=broad-except
+            # Every claimed post still gets an outcome in the ledger and is advanced below
+            self._log.error('[send_posts] There was an error sending the due weekly posts.', exc_info=True)
+            recorded = {result.post_id for result in results}
+            results.extend(
+                DeliveryResult(post_id, False, 0, error=e) for post_id in claimed if post_id not in recorded
+            )
 
-        for post in posts_for_today:
-            self._log.info('[send_post] Got post ID %d with hour %d and minute %d.', post.id, post.hour, post.minute)
-            if post.hour == now.hour and post.minute == now.minute:
-                self._log.info('[send_post] Sending post ID %d.', post.id)
-                await self.bot.main_channel.send(post.content)
-                self._log.info('[send_post] Post ID %d successfully sent.', post.id)
+        for result in results:
+            metrics.posts_sent.inc(status='sent' if result.sent else 'failed')
+            if result.sent:
+                self._log.debug('[send_posts] Post ID %d successfully sent.', result.post_id)
+            else:
+                self._log.error('[send_posts] Error sending post ID %d.', result.post_id, exc_info=result.error)
+
+        try:
+            for result in results:
+                if result.sent and uploads.get(result.post_id):
+                    await self.attachment_cache.record_uploads(uploads[result.post_id], result.message)
+            await PostDelivery.mark(claim, (result.post_id for result in results if result.sent), 'sent')
+            await PostDelivery.mark(claim, (result.post_id for result in results if not result.sent), 'failed')
+        except DatabaseException:
+            self._log.error('[send_posts] There was an error recording the sent posts.', exc_info=True)
+
+        # Posts claimed by another replica are advanced too, in case it stopped before advancing them
+        next_runs = {post.id: WeeklyPost.next_run(post, now) for post in posts}
+        try:
+            await WeeklyPost.set_next_runs(next_runs)
+        except DatabaseException:
+            self._log.error('[send_posts] There was an error advancing the sent weekly posts.', exc_info=True)
+
+        # Posts the database did not return were deleted or already sent
+        self.schedule.pop_due(now)
+        for post_id, next_run_at in next_runs.items():
+            self.schedule.add(post_id, next_run_at)
 
     @send_posts.before_loop
     async def before_send_posts(self):
-        """Sleep until task is either at minute 0 or 30"""
+        """Wait until the bot is ready, the schedule is loaded once this replica takes the lease"""
         self._log.info('[before_send_posts] Start before_send_posts.')
         await self.bot.wait_until_ready()
 
-        now = datetime.now()
-        if now.minute in [0, 30]:
-            # Task is synced to half hour starting at 0
-            return
-
-        self.syncing_time = True
-        while self.syncing_time:
-            # Wait until next half hour
-            next_half_hour = ceil_datetime(now, timedelta(minutes=30))
-            delay = seconds_until(next_half_hour.hour, next_half_hour.minute)
-
-            self._log.info('[before_send_posts] Sleeping until hour %d and minute %d.',
-                           next_half_hour.hour, next_half_hour.minute)
-            await asyncio.sleep(delay)
-            self._log.info('[before_send_posts] End before_send_posts.')
-            self.syncing_time = False
+        if self._handed_off:
+            self._log.info('[before_send_posts] Resumed %d scheduled posts.', len(self.schedule))
 
     @app_commands.command(name='addwp')
+    @app_commands.guild_only()
     async def add_weekly_post(
         self,
         interaction: Interaction,
         content: str,
-        day_of_week: int,
-        hour: int,
-        minute: int
-    ): # pylint: disable=too-many-arguments
+        day_of_week: Optional[app_commands.Range[int, 0, 6]] = None,
+        hour: Optional[app_commands.Range[int, 0, 23]] = None,
+        minute: app_commands.Range[int, 0, 59] = 0,
+        channel: Optional[app_commands.Transform[AppCommandChannel, TextChannelTransformer]] = None,
+        attachment: Optional[Attachment] = None,
+        recurrence: Optional[str] = None
+    ): # pylint: disable=too-many-arguments,too-many-locals
         """Add a new weekly post
 
         Add a weekly post that will be sent on a
-        given day of week, hour, and minute where the minutes
-        are half hour intervals (30 minutes)
+        given day of week, hour, and minute, or
+        on the schedule of a cron expression
 
         Args:
             content (str): Content of post
             day_of_week (int): What day of the week to send post (MONDAY = 0,... , SUNDAY = 6)
             hour (int): What UTC hour of the day to send post
-            minute (int): What minute of the day to send post (0 or 30)
+            minute (int): What minute of the hour to send post
+            channel (TextChannel): Channel to send the post to, defaults to the current channel
+            attachment (Attachment): File to send with the post
+            recurrence (str): UTC cron schedule replacing the day and time, e.g. "0 9 * * mon-fri"
         """
         log_app_command(self._log, interaction)
-        self._log.info('Creating new WeeklyPost for weekday %d, hour %d, and minute %d.',
-                       day_of_week, hour, minute)
+        if recurrence is not None:
+            if day_of_week is not None or hour is not None:
+                await interaction.response.send_message(
+                    'Give either a recurrence or a day of week and hour, not both.', ephemeral=True
+                )
+                return
+            try:
+                next_run_at = parse_cron(recurrence).next_after(utcnow())
+            except InvalidCronException as e:
+                await interaction.response.send_message(f'{e}.', ephemeral=True)
+                return
+            self._log.info('Creating new WeeklyPost recurring at %s.', recurrence)
+        elif day_of_week is None or hour is None:
+            await interaction.response.send_message(
+                'Give a day of week and hour, or a recurrence.', ephemeral=True
+            )
+            return
+        else:
+            next_run_at = None
+            self._log.info('Creating new WeeklyPost for weekday %d, hour %d, and minute %d.',
+                           day_of_week, hour, minute)
         await interaction.response.defer()
 
+        if attachment is not None:
+            # Sent from its CDN URL while Discord refreshes it, the copy on disk is uploaded once it no longer does
+            path = os.path.join(self.bot.config.MEDIA_DIR, f'{attachment.id}-{attachment.filename}')
+            try:
+                size = await download(attachment.url, path, self.bot.config.MEDIA_CHUNK_SIZE)
+            except (ClientError, OSError):
+                self._log.error('Error saving attachment %s.', attachment.filename, exc_info=True)
+                await interaction.followup.send('There was an error saving your attachment.')
+                return
+
         try:
-            post = await WeeklyPost.create(
-                content=content,
-                day_of_week=day_of_week,
-                hour=hour,
-                minute=minute
-            )
+            async with db.transaction():
+                post = await WeeklyPost.create(
+                    guild_id=interaction.guild_id,
+                    channel_id=channel.id if channel else interaction.channel_id,
+                    content=content,
+                    day_of_week=day_of_week,
+                    hour=hour,
+                    minute=minute,
+                    recurrence=recurrence,
+                    next_run_at=next_run_at
+                )
+                if attachment is not None:
+                    await PostAttachment.create(
+                        post_id=post.id,
+                        filename=attachment.filename,
+                        path=path,
+                        content_type=attachment.content_type,
+                        size=size,
+                        url=attachment.url,
+                        expires_at=url_expiry(attachment.url)
+                    )
             self._log.info('Successfully created WeeklyPost with ID %d', post.id)
+            self.schedule_post(post)
             await interaction.followup.send('Your weekly post was successfully created!')
         except DatabaseException:
-            self._log.error('Error creating WeeklyPost for weekday %d, hour %d, and minute %d.',
-                            day_of_week, hour, minute)
+            self._log.error('Error creating WeeklyPost for weekday %s, hour %s, minute %d and recurrence %s.',
+                            day_of_week, hour, minute, recurrence, exc_info=True)
             await interaction.followup.send('There was an error creating your new post.')
 
+    @app_commands.command(name='listwp')
+    @app_commands.guild_only()
+    async def list_weekly_posts(
+        self,
+        interaction: Interaction,
+        channel: Optional[app_commands.Transform[AppCommandChannel, TextChannelTransformer]] = None
+    ):
+        """List the weekly posts of this server
+
+        List the next weekly posts to be sent,
+        earliest first
+
+        Args:
+            channel (TextChannel): Only list the posts of this channel
+        """
+        log_app_command(self._log, interaction)
+        try:
+            posts = await WeeklyPost.get_listed(
+                interaction.guild_id, channel.id if channel is not None else None, LIST_LIMIT + 1
+            )
+        except DatabaseException:
+            self._log.error('Error listing the WeeklyPosts of guild ID %d.', interaction.guild_id, exc_info=True)
+            await interaction.response.send_message('There was an error listing the weekly posts.', ephemeral=True)
+            return
+
+        if not posts:
+            await interaction.response.send_message('There are no weekly posts.', ephemeral=True)
+            return
+
+        lines = []
+        for post in posts[:LIST_LIMIT]:
+            if post.recurrence:
+                schedule = f'`{post.recurrence}`'
+            else:
+                schedule = f'{calendar.day_name[post.day_of_week]} {post.hour:02d}:{post.minute:02d} UTC'
+            preview = post.content.replace('\n', ' ')
+            if len(preview) > 40:
+                preview = preview[:39] + '…'
+            channel_name = f'<#{post.channel_id}>' if post.channel_id else 'main channel'
+            lines.append(f'`{post.id}` {channel_name} {schedule}, '
+                         f'next <t:{int(post.next_run_at.timestamp())}:R>: {preview}')
+        if len(posts) > LIST_LIMIT:
+            lines.append(f'… and more after the first {LIST_LIMIT}.')
+        await interaction.response.send_message('\n'.join(lines)[:2000], ephemeral=True)
+
 async def setup(bot: DustyBot):
     await bot.add_cog(WeeklyPostCog(bot))
-    
\ No newline at end of file
@@ -5,3 +5,8 @@ class MissingBotTokenException(DustyException):
     """Missing bot token in config exception"""
     def __init__(self):
         super().__init__('\'DISCORD_BOT_TOKEN\' must be set.')
+
+class MissingShardCountException(DustyException):
+    """Shard ids given without a shard count in config exception"""
+    def __init__(self):
+        super().__init__('\'DISCORD_SHARD_COUNT\' must be set when \'DISCORD_SHARD_IDS\' is.')
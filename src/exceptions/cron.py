@@ -0,0 +1,7 @@
+"""Cron Exceptions"""
+from .dusty_exception import DustyException
+
+class InvalidCronException(DustyException):
+    """Invalid cron expression"""
+    def __init__(self, expression: str, reason: str):
+        super().__init__(f'Invalid cron expression \'{expression}\': {reason}')
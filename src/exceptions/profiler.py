@@ -0,0 +1,7 @@
+"""Profiler Exceptions"""
+from .dusty_exception import DustyException
+
+class ProfileInProgressException(DustyException):
+    """A sampling profile is already being captured"""
+    def __init__(self):
+        super().__init__('A profile is already being captured')
@@ -1,4 +1,10 @@
 """Extensions"""
+from src.extensions.audit import AuditLog
+from src.extensions.metrics import Metrics
+from src.extensions.profiler import Profiler
 from src.extensions.sqlalchemy import SQLAlchemy
 
+audit = AuditLog()
 db = SQLAlchemy()
+metrics = Metrics()
+profiler = Profiler()
@@ -0,0 +1,127 @@
+"""Audit log extension"""
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Optional
+
+from src.exceptions.database import DatabaseException
+from src.util.date_util import utcnow
+
+if TYPE_CHECKING:
+    from discord import Interaction
+
+    from src.bot import DustyBot
+
+
+class AuditLog:
+    """
+    Write-behind log of app command invocations.
+
+    Invocations are appended to an in-memory buffer without touching the
+    database, a background task inserts the buffer in one statement once it
+    reaches the batch size or the flush interval passes. The buffer is
+    drained when the bot closes.
+    """
+
+    def __init__(self, bot: 'DustyBot' = None):
+        self.enabled = False
+        self.batch_size = 100
+        self.flush_interval = 5.0
+        self.max_buffer = 10000
+        self.dropped = 0
+        self._buffer: list[dict[str, Any]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._log = logging.getLogger('AuditLog')
+
+        if bot is not None:
+            self.init_bot(bot)
+
+    def init_bot(self, bot: 'DustyBot'):
+        """Read the buffer settings from the bot config"""
+        bot.audit = self
+        self.enabled = bot.config.AUDIT_ENABLED
+        self.batch_size = bot.config.AUDIT_BATCH_SIZE
+        self.flush_interval = bot.config.AUDIT_FLUSH_INTERVAL
+        self.max_buffer = bot.config.AUDIT_MAX_BUFFER
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def start(self):
+        """Start flushing the buffer in the background"""
+        if self.enabled and self._task is None:
+            self._wake = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Flush what is left and stop the background task"""
+        if self._task is None:
+            return
+        # Not cancelled, so a flush in progress does not lose its rows
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    def record(self, interaction: 'Interaction', command: str, status: str, error: Optional[Exception] = None):
+        """Buffer an invocation, never waits on the database"""
+        if not self.enabled:
+            return
+
+        now = utcnow()
+        self._append([{
+            'command': command,
+            'user_id': interaction.user.id,
+            'guild_id': interaction.guild_id,
+            'channel_id': interaction.channel_id,
+            'options': (interaction.data or {}).get('options'),
+            'status': status,
+            'error': repr(error) if error is not None else None,
+            'duration_ms': (now - interaction.created_at).total_seconds() * 1000,
+            'invoked_at': interaction.created_at,
+        }])
+        if self._wake is not None and len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self):
+        """Insert every buffered invocation in one statement, keeping them buffered if it fails"""
+        # Imported here since the models import the extensions
+        from src.models.command_audit import CommandAudit # pylint: disable=import-outside-toplevel
+
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        try:
+            await CommandAudit.create_many(rows)
+        except DatabaseException:
+            self._log.error('Error writing %d audited commands, retrying on the next flush.', len(rows), exc_info=True)
+            # Older rows go back in front of the ones recorded during the insert
+            self._buffer, rows = rows, self._buffer
+            self._append(rows)
+
+    async def _flush_loop(self):
+        """Flush whenever the batch fills up or the interval passes, until stopped"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception: # pylint: disable=broad-except
+                # The loop keeps running, or every later invocation would pile up in the buffer
+                self._log.error('Error flushing the audit buffer, flushing again on the next interval.', exc_info=True)
+            if self._stopping:
+                return
+
+    def _append(self, rows: list[dict[str, Any]]):
+        """Add rows to the buffer, dropping the oldest ones over the maximum"""
+        self._buffer.extend(rows)
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+            self._log.warning('Audit buffer full, dropped the %d oldest commands.', overflow)
@@ -0,0 +1,270 @@
+"""Metrics extension"""
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Optional, Union
+
+from sqlalchemy import event
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+    from src.bot import DustyBot
+
+LabelValues = tuple[str, ...]
+Samples = Union[float, dict[LabelValues, float]]
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    """Return the Prometheus label set for the label names and values"""
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+class Metric:
+    """
+    Base metric rendered in the Prometheus text format
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _label_values(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        """Return the lines of the metric in the Prometheus text format"""
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+class Counter(Metric):
+    """
+    Monotonically increasing count
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Increase the count"""
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+class Gauge(Metric):
+    """
+    Value read from a callback when the metrics are scraped
+    """
+    type = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Samples],
+        labelnames: tuple[str, ...] = ()
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        samples = self.callback()
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for key, value in samples.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets
+    """
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        """Record a value"""
+        key = self._label_values(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Record how long the block took in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, counts in self._counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                total += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {total}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {self._sums[key]}')
+            lines.append(f'{self.name}_count{labels} {total}')
+        return lines
+
+class Metrics:
+    """
+    Collects the bot metrics and serves them in the Prometheus text format
+    """
+
+    def __init__(self, bot: 'DustyBot' = None):
+        self.registry: list[Metric] = []
+        self.enabled = False
+        self.host: str = None
+        self.port: int = None
+        self._runner: Optional['web.AppRunner'] = None
+        self._log = logging.getLogger('Metrics')
+
+        self.db_query_seconds = self.register(Histogram(
+            'dusty_db_query_seconds', 'Database statement execution time.'
+        ))
+        self.send_posts_seconds = self.register(Histogram(
+            'dusty_send_posts_iteration_seconds', 'Time spent sending the due posts of a send_posts iteration.'
+        ))
+        self.send_posts_drift_seconds = self.register(Histogram(
+            'dusty_send_posts_drift_seconds', 'Delay between the scheduled and the actual send time of posts.'
+        ))
+        self.posts_sent = self.register(Counter(
+            'dusty_posts_sent_total', 'Scheduled posts sent.', ('status',)
+        ))
+        self.app_command_seconds = self.register(Histogram(
+            'dusty_app_command_seconds', 'Time from an app command interaction to its completion.',
+            ('command', 'status')
+        ))
+        self.task_seconds = self.register(Histogram(
+            'dusty_task_seconds', 'Wall time of tasks, loop iterations and app commands while profiling.',
+            ('kind', 'name')
+        ))
+
+        if bot is not None:
+            self.init_bot(bot)
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric to the registry"""
+        self.registry.append(metric)
+        return metric
+
+    def init_bot(self, bot: 'DustyBot'):
+        """Instrument the bot and its database engine"""
+        bot.metrics = self
+        self.enabled = bot.config.METRICS_ENABLED
+        self.host = bot.config.METRICS_HOST
+        self.port = bot.config.METRICS_PORT
+
+        engine = bot.db.engine.sync_engine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        self.register(Gauge(
+            'dusty_gateway_latency_seconds', 'Gateway heartbeat latency of each shard.',
+            lambda: {(str(shard_id),): latency for shard_id, latency in bot.latencies},
+            ('shard',)
+        ))
+        pool_gauges = {
+            'size': 'Connections the pool keeps open.',
+            'checked_in': 'Idle connections in the pool.',
+            'checked_out': 'Connections in use.',
+            'overflow': 'Connections opened over the pool size.',
+            'waiting': 'Callers waiting for a connection with every connection of the pool in use.',
+        }
+        for field, documentation in pool_gauges.items():
+            self.register(Gauge(
+                f'dusty_db_pool_{field}', documentation,
+                lambda field=field: getattr(bot.db.pool_stats(), field)
+            ))
+        self.register(Gauge(
+            'dusty_db_pool_connect_seconds_avg', 'Average time to open a database connection.',
+            lambda: bot.db.pool_stats().connect_time_avg_ms / 1000
+        ))
+        for field in ('size', 'hits', 'misses', 'evictions', 'invalidations'):
+            self.register(Gauge(
+                f'dusty_model_cache_{field}', f'Model cache {field}.',
+                lambda field=field: {
+                    (model.__name__,): getattr(stats, field) for model, stats in self._model_cache_stats()
+                },
+                ('model',)
+            ))
+
+    async def start(self):
+        """Serve the metrics over HTTP"""
+        if not self.enabled:
+            return
+
+        # Imported here so migrations and tools importing the extensions do not load aiohttp
+        from aiohttp import web # pylint: disable=import-outside-toplevel
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._log.info('Serving metrics on http://%s:%d/metrics.', self.host, self.port)
+
+    async def stop(self):
+        """Stop serving the metrics"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text format"""
+        lines = []
+        for metric in self.registry:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def _handle_metrics(self, request: 'web.Request') -> 'web.Response': # pylint: disable=unused-argument
+        from aiohttp import web # pylint: disable=import-outside-toplevel
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+    @staticmethod
+    def _model_cache_stats() -> list:
+        """Return the cache counters of every cached model"""
+        # Imported here since the models import the extensions
+        from src.models.mixins import DustyModel # pylint: disable=import-outside-toplevel
+        return [
+            (model, model.cache_stats())
+            for model in DustyModel.__subclasses__()
+            if model.cache_stats() is not None
+        ]
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany): # pylint: disable=unused-argument,too-many-arguments
+        # Kept on the statement's own context, a statement that raises never reaches after_cursor_execute
+        context._query_start = time.perf_counter() # pylint: disable=protected-access
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany): # pylint: disable=unused-argument,too-many-arguments
+        self.db_query_seconds.observe(time.perf_counter() - context._query_start) # pylint: disable=protected-access
@@ -0,0 +1,222 @@
+"""Profiler extension"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Optional
+
+from src.exceptions.profiler import ProfileInProgressException
+from src.util.date_util import utcnow
+
+if TYPE_CHECKING:
+    from discord.ext.commands import Cog
+    from discord.ext.tasks import Loop
+
+    from src.bot import DustyBot
+
+
+def fold_stack(frame: Optional[FrameType]) -> str:
+    """Return the stack of the frame, outermost call first, in the folded format of flame graph tools"""
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(calls))
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter:
+    """Count the stacks of the thread sampled every interval for the given seconds"""
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id) # pylint: disable=protected-access
+        if frame is not None:
+            stacks[fold_stack(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return stacks
+
+class Profiler:
+    """
+    Profiling mode of the event loop.
+
+    While enabled, the loop runs in asyncio debug mode and logs callbacks
+    blocking it for longer than the slow callback threshold, and the wall
+    time of tasks, app commands and cog loop iterations is recorded. Nothing
+    is installed while disabled. Sampling profiles of the loop thread can be
+    captured whether it is enabled or not.
+    """
+
+    def __init__(self, bot: 'DustyBot' = None):
+        self.bot: 'DustyBot' = None
+        self.enabled = False
+        self.slow_callback = 0.1
+        self.sample_interval = 0.005
+        self.directory = 'profiles'
+        # Name to count, total and maximum seconds
+        self.timings: dict[str, list[float]] = {}
+        self._loops: list[tuple['Cog', 'Loop', Callable[..., Coroutine]]] = []
+        self._task_factory = None
+        self._sampling = False
+        self._log = logging.getLogger('Profiler')
+
+        if bot is not None:
+            self.init_bot(bot)
+
+    def init_bot(self, bot: 'DustyBot'):
+        """Read the profiling settings from the bot config"""
+        bot.profiler = self
+        self.bot = bot
+        self.enabled = False
+        self.slow_callback = bot.config.PROFILING_SLOW_CALLBACK
+        self.sample_interval = bot.config.PROFILING_SAMPLE_INTERVAL
+        self.directory = bot.config.PROFILING_DIR
+
+    async def start(self):
+        """Enable profiling if the config asks for it"""
+        if self.bot.config.PROFILING_ENABLED:
+            self.enable()
+
+    def enable(self):
+        """Run the loop in debug mode and time tasks, app commands and cog loops"""
+        if self.enabled:
+            return
+
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow_callback
+        self._task_factory = loop.get_task_factory()
+        loop.set_task_factory(self._create_task)
+        self.enabled = True
+        for cog in self.bot.cogs.values():
+            self.instrument(cog)
+        self._log.info('Profiling enabled, logging callbacks slower than %.3f s.', self.slow_callback)
+
+    def disable(self):
+        """Restore the loop and the cog loops"""
+        if not self.enabled:
+            return
+
+        loop = asyncio.get_running_loop()
+        loop.set_debug(False)
+        loop.set_task_factory(self._task_factory)
+        self._task_factory = None
+        for _, cog_loop, coro in self._loops:
+            cog_loop.coro = coro
+        self._loops.clear()
+        self.enabled = False
+        self._log.info('Profiling disabled.')
+
+    def instrument(self, cog: 'Cog'):
+        """Time the iterations of the loops of the cog"""
+        # Imported here so tools importing the extensions do not load discord.py
+        from discord.ext.tasks import Loop # pylint: disable=import-outside-toplevel
+
+        if not self.enabled:
+            return
+        # Forget the loops of the cogs that were unloaded
+        cogs = list(self.bot.cogs.values())
+        self._loops = [entry for entry in self._loops if any(entry[0] is loaded for loaded in cogs)]
+        for name, attribute in inspect.getmembers(type(cog)):
+            if isinstance(attribute, Loop):
+                # Binds the loop to the cog, the way accessing it from a method does
+                cog_loop = getattr(cog, name)
+                self._loops.append((cog, cog_loop, cog_loop.coro))
+                cog_loop.coro = self._timed(f'loop:{cog.qualified_name}.{name}', cog_loop.coro)
+
+    def record(self, name: str, seconds: float):
+        """Add a wall time to the timings and the task metrics"""
+        timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+        kind, _, label = name.partition(':')
+        self.bot.metrics.task_seconds.observe(seconds, kind=kind, name=label)
+
+    def report(self, limit: int = 15) -> str:
+        """Return the timings with the most total wall time"""
+        lines = [f'{"name":<48} {"count":>7} {"total s":>9} {"mean ms":>9} {"max ms":>9}']
+        timings = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (count, total, maximum) in timings[:limit]:
+            lines.append(f'{name[:48]:<48} {count:>7} {total:>9.2f} {total / count * 1000:>9.1f} {maximum * 1000:>9.1f}')
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Forget the recorded timings"""
+        self.timings.clear()
+
+    async def capture(self, seconds: float) -> tuple[str, int]:
+        """
+        Sample the stacks of the loop thread for the given seconds into a
+        folded stacks file, return its path and the number of samples
+        """
+        if self._sampling:
+            raise ProfileInProgressException()
+
+        self._sampling = True
+        try:
+            stacks = await asyncio.to_thread(
+                sample_stacks, threading.get_ident(), seconds, self.sample_interval
+            )
+        finally:
+            self._sampling = False
+
+        path = os.path.join(self.directory, f'profile-{utcnow():%Y%m%dT%H%M%S}.folded')
+        await asyncio.to_thread(self._write_stacks, path, stacks)
+        samples = sum(stacks.values())
+        self._log.info('Captured %d samples over %.0f s to %s.', samples, seconds, path)
+        return path, samples
+
+    @staticmethod
+    def top_frames(path: str, limit: int = 10) -> str:
+        """Return the innermost frames of a captured profile with the most samples, and their share"""
+        frames = Counter()
+        with open(path, encoding='utf-8') as fp:
+            for line in fp:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                frames[stack.rpartition(';')[2]] += int(count)
+        total = sum(frames.values()) or 1
+        return '\n'.join(
+            f'{count:>7} {count / total:>6.1%} {frame[:80]}' for frame, count in frames.most_common(limit)
+        )
+
+    @staticmethod
+    def _write_stacks(path: str, stacks: Counter):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fp:
+            for stack, count in stacks.most_common():
+                fp.write(f'{stack} {count}\n')
+
+    def _create_task(self, loop: asyncio.AbstractEventLoop, coro: Coroutine, **kwargs: Any) -> asyncio.Task:
+        """Task factory recording how long each task took to complete"""
+        if self._task_factory is not None:
+            task = self._task_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        start = time.perf_counter()
+        task.add_done_callback(functools.partial(self._task_done, start))
+        return task
+
+    def _task_done(self, start: float, task: asyncio.Task):
+        # The loop names the task after the factory returns it
+        name = task.get_name()
+        if name.startswith('Task-'):
+            name = getattr(task.get_coro(), '__qualname__', name)
+        self.record(f'task:{name}', time.perf_counter() - start)
+
+    def _timed(self, name: str, coro: Callable[..., Coroutine]) -> Callable[..., Coroutine]:
+        """Wrap the coroutine function to record how long each call took"""
+        @functools.wraps(coro)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await coro(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+        return wrapper
@@ -1,10 +1,75 @@
 """SQLAlchemy extension"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from sqlmodel import SQLModel
 
-from src.bot import DustyBot
+from src.config import Config
+from src.exceptions.database import DatabaseException
+
+if TYPE_CHECKING:
+    from src.bot import DustyBot
+
+
+def parse_pragmas(value: str) -> dict[str, str]:
+    """Parse a comma separated list of SQLite pragmas such as journal_mode=wal,synchronous=normal"""
+    pragmas = {}
+    for part in value.split(','):
+        name, _, setting = part.strip().partition('=')
+        if name and setting:
+            pragmas[name.strip()] = setting.strip()
+    return pragmas
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that counts the callers waiting on a connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+
+    def connect(self):
+        # Only a checkout finding every connection, overflow included, in use waits for one
+        if self._max_overflow < 0 or self.checkedout() < self.size() + self._max_overflow:
+            return super().connect()
+
+        self.waiting += 1
+        try:
+            return super().connect()
+        finally:
+            self.waiting -= 1
+
+@dataclass
+class _SessionScope:
+    """Session shared by the database calls of one task"""
+    session: AsyncSession
+    task: Optional[asyncio.Task]
+    in_transaction: bool = False
+
+_current_scope: ContextVar[Optional[_SessionScope]] = ContextVar('db_session_scope', default=None)
+
+@dataclass
+class PoolStats:
+    """Snapshot of the connection pool usage"""
+    size: int = 0
+    checked_in: int = 0
+    checked_out: int = 0
+    overflow: int = 0
+    waiting: int = 0
+    connects: int = 0
+    connect_time_avg_ms: float = 0.0
+    connect_time_max_ms: float = 0.0
 
 class SQLAlchemy:
     """
@@ -12,34 +77,189 @@ class SQLAlchemy:
     Handles setting up the engine, connection, and session for each database request
     """
 
-    def __init__(self, bot: DustyBot = None):
+    def __init__(self, bot: 'DustyBot' = None):
         self.Model = SQLModel
         self.engine: AsyncEngine = None
-        self._session: AsyncSession = None
+        self._session: sessionmaker = None
+        self._warmup: int = 0
+        self._pragmas: dict[str, str] = {}
+        self._connects: int = 0
+        self._connect_time: float = 0.0
+        self._connect_time_max: float = 0.0
 
         if bot is not None:
             self.init_bot(bot)
 
-    def init_bot(self, bot: DustyBot):
+    def init_bot(self, bot: 'DustyBot'):
         """Initialize the connection engine using the bot config"""
         bot.db = self
+        self.init_engine(bot.config)
+
+    def init_engine(self, config: Config):
+        """Initialize the connection engine without a bot, for migrations and tools"""
         self.engine = create_async_engine(
-            url=bot.config.SQLALCHEMY_DATABASE_URI,
+            url=config.SQLALCHEMY_DATABASE_URI,
             future=True,
             echo=False,
-            poolclass=NullPool
+            **self._engine_options(config)
+        )
+        self._warmup = config.SQLALCHEMY_POOL_WARMUP
+        event.listen(self.engine.sync_engine, 'do_connect', self._timed_connect)
+        if self.engine.dialect.name == 'sqlite':
+            self._pragmas = parse_pragmas(config.SQLITE_PRAGMAS)
+            event.listen(self.engine.sync_engine, 'connect', self._set_pragmas)
+        self._session = self._make_session_factory(self.engine)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Share one session across the database calls of the current task.
+        The outermost block owns the session and closes it on exit,
+        nested blocks in the same task reuse it.
+        """
+        scope = self._scope()
+        if scope is not None:
+            yield scope.session
+            return
+
+        session = self._session()
+        token = _current_scope.set(_SessionScope(session, asyncio.current_task()))
+        try:
+            yield session
+        except SQLAlchemyError as e:
+            await session.rollback()
+            raise DatabaseException() from e
+        finally:
+            _current_scope.reset(token)
+            await session.close()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[AsyncSession]:
+        """
+        Run the block in one transaction of the task's session.
+        The outermost transaction commits on success and rolls back on error,
+        nested transactions join it.
+        """
+        async with self.session() as session:
+            scope = self._scope()
+            if scope.in_transaction:
+                yield session
+                return
+
+            scope.in_transaction = True
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                scope.in_transaction = False
+
+    def in_session(self) -> bool:
+        """Return whether the current task is inside a session block, whose owner ends the unit of work"""
+        return self._scope() is not None
+
+    async def commit(self):
+        """
+        Commit the task's session, or only flush it when an outer
+        transaction will commit it
+        """
+        scope = self._scope()
+        if scope is None:
+            return
+        if scope.in_transaction:
+            await scope.session.flush()
+        else:
+            await scope.session.commit()
+
+    async def warm_up(self):
+        """Open pool connections ahead of the first query"""
+        pool = self.engine.pool
+        if not isinstance(pool, InstrumentedPool):
+            return
+
+        count = min(self._warmup, pool.size())
+        if count <= 0:
+            return
+
+        connections = await asyncio.gather(*(self.engine.connect() for _ in range(count)))
+        for connection in connections:
+            await connection.close()
+
+    def pool_stats(self) -> PoolStats:
+        """Return the current pool usage and connect latency"""
+        stats = PoolStats(
+            connects=self._connects,
+            connect_time_max_ms=self._connect_time_max * 1000,
         )
-        self._session = self._make_scoped_session(self.engine)
+        if self._connects:
+            stats.connect_time_avg_ms = self._connect_time / self._connects * 1000
+
+        pool = self.engine.pool if self.engine is not None else None
+        if isinstance(pool, InstrumentedPool):
+            stats.size = pool.size()
+            stats.checked_in = pool.checkedin()
+            stats.checked_out = pool.checkedout()
+            stats.overflow = max(pool.overflow(), 0)
+            stats.waiting = pool.waiting
+        return stats
+
+    def _engine_options(self, config: Config) -> dict:
+        """Return the pool and driver options for the configured database"""
+        url = make_url(config.SQLALCHEMY_DATABASE_URI)
+        if url.get_backend_name() == 'sqlite':
+            if url.database in (None, '', ':memory:'):
+                # Every connection to an in-memory database opens a new empty one
+                return {'poolclass': StaticPool}
+            # A local file needs neither recycling nor pings, keep the connections and their page cache open
+            return {
+                'poolclass': InstrumentedPool,
+                'pool_size': config.SQLALCHEMY_POOL_SIZE,
+                'max_overflow': config.SQLALCHEMY_MAX_OVERFLOW,
+                'pool_timeout': config.SQLALCHEMY_POOL_TIMEOUT,
+            }
+
+        options = {
+            'poolclass': InstrumentedPool,
+            'pool_size': config.SQLALCHEMY_POOL_SIZE,
+            'max_overflow': config.SQLALCHEMY_MAX_OVERFLOW,
+            'pool_timeout': config.SQLALCHEMY_POOL_TIMEOUT,
+            'pool_recycle': config.SQLALCHEMY_POOL_RECYCLE,
+            'pool_pre_ping': config.SQLALCHEMY_POOL_PRE_PING,
+        }
+        if url.get_driver_name() == 'asyncpg':
+            options['connect_args'] = {
+                'prepared_statement_cache_size': config.SQLALCHEMY_STATEMENT_CACHE_SIZE,
+            }
+        return options
+
+    def _timed_connect(self, dialect, conn_rec, cargs, cparams): # pylint: disable=unused-argument
+        """Open a new DBAPI connection and record how long it took"""
+        start = time.perf_counter()
+        connection = dialect.connect(*cargs, **cparams)
+        elapsed = time.perf_counter() - start
+
+        self._connects += 1
+        self._connect_time += elapsed
+        self._connect_time_max = max(self._connect_time_max, elapsed)
+        return connection
 
-    async def get_session(self) -> AsyncSession:
-        """Get session instance"""
-        async with self._session() as session:
-            return session
+    def _set_pragmas(self, dbapi_connection, connection_record): # pylint: disable=unused-argument
+        """Apply the configured pragmas to a new SQLite connection"""
+        cursor = dbapi_connection.cursor()
+        for name, value in self._pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
 
-    def _make_scoped_session(self, engine: AsyncEngine) -> scoped_session:
-        """Create and return a Async Session scoped session"""
-        factory = self._make_session_factory(engine)
-        return scoped_session(factory)
+    @staticmethod
+    def _scope() -> Optional[_SessionScope]:
+        """Return the session scope opened by the current task, if any"""
+        scope = _current_scope.get()
+        # Tasks inherit the context they are created in, don't share their parent's session
+        if scope is None or scope.task is not asyncio.current_task():
+            return None
+        return scope
 
     def _make_session_factory(self, engine: AsyncEngine) -> sessionmaker:
         """Create and return a Async session maker"""
@@ -0,0 +1,66 @@
+"""Bot state model"""
+import uuid
+from typing import Optional, Type, TypeVar
+
+from sqlalchemy import Column, String, delete, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+from sqlmodel import Field
+
+from src.extensions import db
+from src.models.mixins import DustyModel
+
+T = TypeVar('T', bound='BotState')
+
+class BotState(DustyModel, table=True):
+    """
+    Key value state the bot keeps across restarts
+    """
+    __tablename__ = 'bot_state'
+
+    key: str = Field(sa_column=Column(String, nullable=False, unique=True))
+    value: str
+
+    @classmethod
+    async def get_value(cls: Type[T], key: str) -> Optional[str]:
+        """Return the value stored for the key"""
+        async with db.session() as session:
+            result = await session.execute(select(cls.value).filter_by(key=key))
+            return result.scalar_one_or_none()
+
+    @classmethod
+    async def set_value(cls: Type[T], key: str, value: str):
+        """Store the value for the key"""
+        async with db.transaction() as session:
+            result = await session.execute(select(cls).filter_by(key=key))
+            state = result.scalars().first()
+            if state is None:
+                await cls.create(key=key, value=value)
+            else:
+                await state.update(value=value)
+
+    @classmethod
+    async def pop_values(cls: Type[T], prefix: str) -> dict[str, str]:
+        """Delete the keys starting with the prefix and return their values"""
+        async with db.transaction() as session:
+            result = await session.execute(select(cls.key, cls.value).where(cls.key.startswith(prefix)))
+            values = dict(result.all())
+            await session.execute(delete(cls.__table__).where(cls.key.startswith(prefix)))
+        return values
+
+    @classmethod
+    async def touch(cls: Type[T], key: str) -> str:
+        """Store a new random value for the key in the task's session and return it, the caller commits"""
+        value = uuid.uuid4().hex
+        table = cls.__table__
+        async with db.session() as session:
+            connection = await session.connection()
+            dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+            stmt = dialect.insert(table).values(key=key, value=value)
+            # A single statement, unlike set_value it never fails the caller's transaction on a race
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={'value': stmt.excluded.value, 'updated_at': func.now()}
+            )
+            await session.execute(stmt)
+        return value
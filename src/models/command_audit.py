@@ -0,0 +1,27 @@
+"""Command audit model"""
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import JSON, BigInteger, Column
+from sqlmodel import Field
+
+from src.models.mixins import DustyModel
+from src.models.types import UTCDateTime
+
+
+class CommandAudit(DustyModel, table=True):
+    """
+    App command invocation, written in batches by the audit log extension
+    """
+    __tablename__ = 'command_audit'
+
+    command: str = Field(index=True)
+    user_id: int = Field(sa_column=Column(BigInteger, nullable=False, index=True))
+    guild_id: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    channel_id: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    # Options as sent by Discord
+    options: Optional[list[dict[str, Any]]] = Field(default=None, sa_column=Column(JSON))
+    status: str
+    error: Optional[str] = Field(default=None)
+    duration_ms: float
+    invoked_at: datetime = Field(sa_column=Column(UTCDateTime(), nullable=False, index=True))
@@ -1,14 +1,27 @@
 """Database mixins"""
 from __future__ import annotations
 
+import functools
+import json
+from collections import namedtuple
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, Type, TypeVar
+from typing import Any, AsyncIterator, Iterable, Optional, Sequence, Type, TypeVar, Union
 
+import asyncpg
 from pydantic import BaseModel
-from sqlalchemy import Column, DateTime, func
+from sqlalchemy import JSON, Column, delete, func, insert, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.sql import ColumnElement
 from sqlmodel import Field
 
+from src.exceptions.database import DatabaseException
 from src.extensions import db
+from src.models.types import UTCDateTime
+from src.util.cache import CacheStats, TTLCache
 
 
 class TimeStampMixin(BaseModel):
@@ -17,7 +30,7 @@ class TimeStampMixin(BaseModel):
     """
     created_at: Optional[datetime] = Field(
         sa_column=Column(
-            DateTime(timezone=True),
+            UTCDateTime(),
             server_default=func.now(),
             nullable=False,
         )
@@ -25,7 +38,7 @@ class TimeStampMixin(BaseModel):
 
     updated_at: Optional[datetime] = Field(
         sa_column=Column(
-            DateTime(timezone=True),
+            UTCDateTime(),
             server_default=func.now(),
             onupdate=func.now(),
         )
@@ -33,17 +46,274 @@ class TimeStampMixin(BaseModel):
 
 _T = TypeVar('_T')
 
+Where = Union[dict[str, Any], ColumnElement, Iterable[ColumnElement]]
+
+# Postgres accepts at most 32767 bind parameters per statement
+_MAX_PARAMS = 32767
+# and SQLite at most 32766 since 3.32
+_SQLITE_MAX_PARAMS = 32766
+# Bot state key of a cached model's version, changed by every write to the model
+CACHE_VERSION_KEY = 'cache_version:'
+# Session info key of the cached tables the session wrote to
+_UNCOMMITTED_WRITES = 'uncommitted_cache_writes'
+
+def _commits(commit: bool) -> bool:
+    """
+    Return whether a write commits. Without an enclosing session block
+    nothing else would commit it, the write's own session discards it on close.
+    """
+    return commit or not db.in_session()
+
 class CRUDMixin(BaseModel):
     """
     Mixin to provide CRUD operations to models
     """
 
+    # Models opt into read-through caching by setting a TTLCache
+    __cache__: Optional[TTLCache] = None
+
+    @classmethod
+    @asynccontextmanager
+    async def _write(cls, commit: bool) -> AsyncIterator[AsyncSession]:
+        """
+        Session of a write to the model. The write changes the cache version in its
+        transaction, so every replica drops its cached reads once it checks the version.
+        """
+        commit = _commits(commit)
+        async with db.session() as session:
+            yield session
+            if cls.__cache__ is not None:
+                cls.__cache__.clear()
+                # Until the session ends its reads of the model may see the write before it commits
+                session.info.setdefault(_UNCOMMITTED_WRITES, set()).add(cls.__tablename__)
+                # Imported here since the state model is built on the mixins
+                from src.models.bot_state import BotState # pylint: disable=import-outside-toplevel
+                await BotState.touch(f'{CACHE_VERSION_KEY}{cls.__tablename__}')
+            if commit:
+                await db.commit()
+        if cls.__cache__ is not None:
+            # Reads between the first clear and the commit may have cached the rows before the write
+            cls.__cache__.clear()
+
+    @classmethod
+    async def _read_cache(cls) -> Optional[TTLCache]:
+        """
+        Return the model cache, emptied first if any replica wrote to the model since its version was checked.
+        None when the model is not cached, or the task's session wrote to it and reads bypass the cache.
+        """
+        cache = cls.__cache__
+        if cache is None:
+            return None
+        if db.in_session():
+            async with db.session() as session:
+                if cls.__tablename__ in session.info.get(_UNCOMMITTED_WRITES, ()):
+                    return None
+        if cache.needs_check():
+            from src.models.bot_state import BotState # pylint: disable=import-outside-toplevel
+            cache.check(await BotState.get_value(f'{CACHE_VERSION_KEY}{cls.__tablename__}'))
+        return cache
+
+    @classmethod
+    def _prepare_values(cls, values: dict[str, Any]) -> dict[str, Any]:
+        """Fill in values derived from the others before a row is created"""
+        return values
+
     @classmethod
     async def create(cls: Type[_T], commit: bool=True,**kwargs) -> _T:
         """Create model"""
-        instance = cls(**kwargs)
+        instance = cls(**cls._prepare_values(kwargs))
         return await instance.save(commit=commit)
 
+    @classmethod
+    async def create_many(
+        cls,
+        rows: Iterable[dict[str, Any]],
+        returning: bool=False,
+        commit: bool=True
+    ) -> Optional[list[int]]:
+        """Insert rows in a single executemany statement
+
+        Databases without RETURNING, like SQLite, insert the rows one at a time to return their ids.
+
+        Args:
+            rows (Iterable[dict]): Column values of each row, every row must set the same columns
+            returning (bool): Return the ids of the new rows, in the order of the given rows
+            commit (bool): Commit the session after inserting, always outside a session block
+        """
+        rows = [cls._prepare_values(dict(row)) for row in rows]
+        table = cls.__table__
+        ids = [] if returning else None
+
+        async with cls._write(commit) as session:
+            if not returning:
+                if rows:
+                    await session.execute(insert(table), rows)
+            elif not await cls._full_returning(session):
+                for row in rows:
+                    result = await session.execute(insert(table).values(row))
+                    ids.append(result.inserted_primary_key[0])
+            else:
+                # RETURNING needs a multi-row VALUES clause, split it under the bind parameter limit
+                chunk_size = max(_MAX_PARAMS // max(len(table.columns), 1), 1)
+                for i in range(0, len(rows), chunk_size):
+                    stmt = insert(table).values(rows[i:i + chunk_size]).returning(table.c.id)
+                    result = await session.execute(stmt)
+                    ids.extend(result.scalars().all())
+        return ids
+
+    @classmethod
+    async def copy_many(cls, rows: list[dict[str, Any]], columns: Sequence[str], commit: bool=True):
+        """Insert rows with the COPY protocol on Postgres, or in one executemany statement elsewhere
+
+        Unlike create_many the values are inserted as given, they are not prepared.
+
+        Args:
+            rows (list[dict]): Values of the columns of each row
+            columns (Sequence[str]): Columns to insert, the others get their default
+            commit (bool): Commit the session after inserting, always outside a session block
+        """
+        table = cls.__table__
+        async with cls._write(commit) as session:
+            connection = await session.connection()
+            if connection.dialect.driver == 'asyncpg':
+                # COPY skips the SQLAlchemy types, JSON columns are sent as text
+                encoders = [
+                    json.dumps if isinstance(table.c[column].type, JSON) else None
+                    for column in columns
+                ]
+                records = [
+                    tuple(
+                        encode(row.get(column)) if encode and row.get(column) is not None else row.get(column)
+                        for column, encode in zip(columns, encoders)
+                    )
+                    for row in rows
+                ]
+                # The driver only begins the session's transaction on the first statement,
+                # a COPY on the raw connection before it would commit on its own
+                await connection.execute(select(1))
+                raw_connection = await connection.get_raw_connection()
+                try:
+                    await raw_connection.driver_connection.copy_records_to_table(
+                        table.name, records=records, columns=list(columns)
+                    )
+                except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    raise DatabaseException() from e
+            elif rows:
+                await session.execute(insert(table), [{column: row.get(column) for column in columns} for row in rows])
+
+    @classmethod
+    async def stream_rows(
+        cls,
+        columns: Sequence[str],
+        *where: ColumnElement,
+        chunk_size: int = 1000
+    ) -> AsyncIterator[list[Row]]:
+        """Yield the columns of the rows matching the clauses in id order, a chunk at a time, from a server side cursor"""
+        table = cls.__table__
+        stmt = select(*(table.c[column] for column in columns)).where(*where).order_by(table.c.id)
+        async with db.session() as session:
+            result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+            async for chunk in result.partitions(chunk_size):
+                yield chunk
+
+    @classmethod
+    async def update_many(
+        cls,
+        where: Where,
+        values: dict[str, Any],
+        returning: bool=False,
+        commit: bool=True
+    ) -> Union[int, list[int]]:
+        """Update every row matching where in a single statement
+
+        Databases without RETURNING, like SQLite, select the ids of the matching rows
+        first in the same session to return them, then update those rows by id.
+
+        Args:
+            where (dict | ColumnElement | Iterable[ColumnElement]): Column values to match or filter clauses
+            values (dict): Column values to set
+            returning (bool): Return the ids of the updated rows instead of the row count
+            commit (bool): Commit the session after updating, always outside a session block
+        """
+        table = cls.__table__
+        clauses = cls._where_clauses(where)
+        async with cls._write(commit) as session:
+            if returning and not await cls._full_returning(session):
+                ids = await cls._select_ids(session, clauses)
+                for chunk in cls._id_chunks(ids, _SQLITE_MAX_PARAMS - len(values)):
+                    await session.execute(update(table).where(table.c.id.in_(chunk)).values(**values))
+                return ids
+
+            stmt = update(table).where(*clauses).values(**values)
+            if returning:
+                stmt = stmt.returning(table.c.id)
+            result = await session.execute(stmt)
+            updated = result.scalars().all() if returning else result.rowcount
+        return updated
+
+    @classmethod
+    async def delete_where(
+        cls,
+        where: Where,
+        returning: bool=False,
+        commit: bool=True
+    ) -> Union[int, list[int]]:
+        """Delete every row matching where in a single statement
+
+        Databases without RETURNING, like SQLite, select the ids of the matching rows
+        first in the same session to return them, then delete those rows by id.
+
+        Args:
+            where (dict | ColumnElement | Iterable[ColumnElement]): Column values to match or filter clauses
+            returning (bool): Return the ids of the deleted rows instead of the row count
+            commit (bool): Commit the session after deleting, always outside a session block
+        """
+        table = cls.__table__
+        clauses = cls._where_clauses(where)
+        async with cls._write(commit) as session:
+            if returning and not await cls._full_returning(session):
+                ids = await cls._select_ids(session, clauses)
+                for chunk in cls._id_chunks(ids, _SQLITE_MAX_PARAMS):
+                    await session.execute(delete(table).where(table.c.id.in_(chunk)))
+                return ids
+
+            stmt = delete(table).where(*clauses)
+            if returning:
+                stmt = stmt.returning(table.c.id)
+            result = await session.execute(stmt)
+            deleted = result.scalars().all() if returning else result.rowcount
+        return deleted
+
+    @staticmethod
+    async def _full_returning(session: AsyncSession) -> bool:
+        """
+        Return whether the database returns the rows of inserts, updates and deletes.
+        SQLAlchemy 1.4 supports RETURNING on Postgres, not on SQLite.
+        """
+        connection = await session.connection()
+        return connection.dialect.full_returning
+
+    @classmethod
+    async def _select_ids(cls, session: AsyncSession, clauses: list[ColumnElement]) -> list[int]:
+        """Return the ids of the rows matching the clauses, the rows a write without RETURNING then targets"""
+        result = await session.execute(select(cls.__table__.c.id).where(*clauses).order_by(cls.__table__.c.id))
+        return result.scalars().all()
+
+    @staticmethod
+    def _id_chunks(ids: list[int], size: int) -> Iterable[list[int]]:
+        """Split ids into lists of at most size ids, to stay under the bind parameter limit"""
+        for i in range(0, len(ids), size):
+            yield ids[i:i + size]
+
+    @classmethod
+    def _where_clauses(cls, where: Where) -> list[ColumnElement]:
+        """Return the filter clauses for a dict of column values or clauses"""
+        if isinstance(where, dict):
+            return [cls.__table__.c[column] == value for column, value in where.items()]
+        if isinstance(where, ColumnElement):
+            return [where]
+        return list(where)
+
     async def update(self, commit: bool=True, **kwargs):
         """Update model"""
         kwargs.pop('id', None)
@@ -53,18 +323,41 @@ class CRUDMixin(BaseModel):
 
     async def save(self, commit: bool=True):
         """Save model"""
-        session = await db.get_session()
-        session.add(self)
-        if commit:
-            await session.commit()
+        async with self._write(commit) as session:
+            session.add(self)
         return self
 
     async def delete(self, commit: bool=True):
         """Delete model"""
-        session = await db.get_session()
-        session.delete(self)
-        return commit and await session.commit()
-        
+        async with self._write(commit) as session:
+            await session.delete(self)
+
+def cached_query(func):
+    """
+    Cache the result of a model query classmethod in the model cache,
+    keyed by the query name and its arguments
+    """
+    @functools.wraps(func)
+    async def wrapper(cls, *args):
+        cache = await cls._read_cache()
+        if cache is None:
+            return await func(cls, *args)
+
+        key = (func.__name__, *args)
+        found, cached = cache.get(key)
+        if found:
+            return await cls._from_cache(cached)
+
+        result = await func(cls, *args)
+        cache.set(key, cls._snapshot(result))
+        return result
+    return wrapper
+
+@functools.lru_cache(maxsize=None)
+def _record_type(name: str, columns: tuple[str, ...]) -> type:
+    """Return the record class of the columns, each projection creates its class once"""
+    return namedtuple(name, columns)
+
 T = TypeVar('T', bound='DustyModel')
 
 class DustyModel(db.Model, CRUDMixin, TimeStampMixin):
@@ -79,6 +372,81 @@ class DustyModel(db.Model, CRUDMixin, TimeStampMixin):
     @classmethod
     async def get(cls: Type[T], id: int) -> T:
         """Return object by id"""
-        session = await db.get_session()
-        model = await session.get(cls, id)
+        cache = await cls._read_cache()
+        if cache is not None:
+            found, model = cache.get(('get', id))
+            if found:
+                return await cls._from_cache(model)
+
+        async with db.session() as session:
+            model = await session.get(cls, id)
+        if cache is not None and model is not None:
+            cache.set(('get', id), cls._snapshot(model))
         return model
+
+    @classmethod
+    @cached_query
+    async def get_all(cls: Type[T]) -> list[T]:
+        """Return every object"""
+        async with db.session() as session:
+            result = await session.execute(select(cls))
+            return result.scalars().all()
+
+    @classmethod
+    def cache_stats(cls) -> Optional[CacheStats]:
+        """Return the model cache counters, or None if the model is not cached"""
+        return cls.__cache__.stats() if cls.__cache__ is not None else None
+
+    @classmethod
+    def _snapshot(cls, result):
+        """
+        Return detached copies of loaded instances to store in the cache,
+        so callers never share or mutate the cached instances. Records are read-only and stored as they are.
+        """
+        if isinstance(result, list):
+            return [cls._snapshot(model) for model in result]
+        if not isinstance(result, cls):
+            return result
+
+        snapshot = cls(**{column.key: getattr(result, column.key) for column in cls.__table__.columns})
+        make_transient_to_detached(snapshot)
+        return snapshot
+
+    @classmethod
+    async def _from_cache(cls, cached):
+        """Return copies of cached instances merged into the current session without loading them"""
+        if isinstance(cached, list):
+            return [await cls._from_cache(model) for model in cached]
+        if not isinstance(cached, cls):
+            return cached
+        async with db.session() as session:
+            return await session.merge(cached, load=False)
+
+    @classmethod
+    async def project(
+        cls,
+        columns: Sequence[str],
+        *where: ColumnElement,
+        order_by: Union[ColumnElement, Sequence[ColumnElement], None] = None,
+        limit: Optional[int] = None
+    ) -> list[tuple]:
+        """Return the columns of the rows matching the clauses as read-only named tuples
+
+        Unlike model instances the records are neither validated nor tracked by the session.
+
+        Args:
+            columns (Sequence[str]): Columns to select, the fields of the records
+            order_by (ColumnElement | Sequence[ColumnElement]): Order of the records, by id by default
+            limit (int): Maximum number of records
+        """
+        table = cls.__table__
+        record = _record_type(f'{cls.__name__}Record', tuple(columns))
+        if order_by is None:
+            order_by = [table.c.id]
+        elif not isinstance(order_by, (list, tuple)):
+            order_by = [order_by]
+        stmt = select(*(table.c[column] for column in columns)).where(*where).order_by(*order_by).limit(limit)
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            # Fetched at once, iterating the result fetches row by row and aiosqlite pops each from a list
+            return [record._make(row) for row in result.all()]
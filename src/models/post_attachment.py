@@ -0,0 +1,56 @@
+"""Post attachment model"""
+from datetime import datetime
+from typing import Iterable, Optional, Type, TypeVar
+
+from sqlalchemy import Column, ForeignKey, Integer
+from sqlalchemy.future import select
+from sqlmodel import Field
+
+from src.extensions import db
+from src.models.mixins import DustyModel
+from src.models.types import UTCDateTime
+
+T = TypeVar('T', bound='PostAttachment')
+
+class PostAttachment(DustyModel, table=True):
+    """
+    File sent with a weekly post.
+
+    The CDN URL of the file is reused for every send while Discord refreshes
+    it, the copy kept on disk is uploaded once it no longer does.
+    """
+    __tablename__ = 'post_attachment'
+
+    post_id: int = Field(
+        sa_column=Column(Integer, ForeignKey('weekly_post.id', ondelete='CASCADE'), nullable=False, index=True)
+    )
+    filename: str
+    path: str
+    content_type: Optional[str] = Field(default=None)
+    size: int = Field(default=0)
+    url: Optional[str] = Field(default=None)
+    expires_at: Optional[datetime] = Field(default=None, sa_column=Column(UTCDateTime()))
+
+    @property
+    def is_image(self) -> bool:
+        """Return whether Discord can show the file in an embed"""
+        return (self.content_type or '').startswith('image/')
+
+    def has_url(self, now: datetime) -> bool:
+        """Return whether the cached CDN URL can still be used at now"""
+        return self.url is not None and (self.expires_at is None or self.expires_at > now)
+
+    @classmethod
+    async def get_for_posts(cls: Type[T], post_ids: Iterable[int]) -> dict[int, list[T]]:
+        """Return the attachments of each post, in the order they were added"""
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+
+        async with db.session() as session:
+            stmt = select(cls).where(cls.post_id.in_(post_ids)).order_by(cls.id)
+            result = await session.execute(stmt)
+            attachments: dict[int, list[T]] = {}
+            for attachment in result.scalars().all():
+                attachments.setdefault(attachment.post_id, []).append(attachment)
+            return attachments
@@ -0,0 +1,63 @@
+"""Post delivery model"""
+from datetime import datetime
+from typing import Iterable, Type, TypeVar
+from uuid import uuid4
+
+from sqlalchemy import Column, ForeignKey, Integer, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+from sqlmodel import Field
+
+from src.extensions import db
+from src.models.mixins import DustyModel
+from src.models.types import UTCDateTime
+
+T = TypeVar('T', bound='PostDelivery')
+
+class PostDelivery(DustyModel, table=True):
+    """
+    Ledger of the scheduled runs of posts that were sent.
+
+    A run is claimed by inserting its post and slot, the unique constraint
+    lets only one replica claim it so it is sent at most once.
+    """
+    __tablename__ = 'post_delivery'
+    __table_args__ = (UniqueConstraint('post_id', 'slot'),)
+
+    post_id: int = Field(
+        sa_column=Column(Integer, ForeignKey('weekly_post.id', ondelete='CASCADE'), nullable=False)
+    )
+    slot: datetime = Field(sa_column=Column(UTCDateTime(), nullable=False, index=True))
+    claim: str = Field(index=True)
+    holder: str
+    status: str = Field(default='claimed')
+
+    @classmethod
+    async def claim_slots(cls: Type[T], slots: Iterable[tuple[int, datetime]], holder: str) -> tuple[str, set[int]]:
+        """Claim the runs no one claimed yet, return the claim and the posts it got"""
+        claim = uuid4().hex
+        rows = [
+            {'post_id': post_id, 'slot': slot, 'claim': claim, 'holder': holder, 'status': 'claimed'}
+            for post_id, slot in slots
+        ]
+        if not rows:
+            return claim, set()
+
+        dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+        async with db.transaction() as session:
+            stmt = dialect.insert(cls.__table__).on_conflict_do_nothing(index_elements=['post_id', 'slot'])
+            await session.execute(stmt, rows)
+            result = await session.execute(select(cls.post_id).filter_by(claim=claim))
+            return claim, set(result.scalars().all())
+
+    @classmethod
+    async def mark(cls: Type[T], claim: str, post_ids: Iterable[int], status: str):
+        """Set the status of the claimed runs of the posts"""
+        post_ids = list(post_ids)
+        if post_ids:
+            await cls.update_many([cls.claim == claim, cls.post_id.in_(post_ids)], {'status': status})
+
+    @classmethod
+    async def prune(cls: Type[T], before: datetime) -> int:
+        """Delete the runs scheduled before the given time"""
+        return await cls.delete_where(cls.slot < before)
@@ -0,0 +1,56 @@
+"""Scheduler lease model"""
+from datetime import datetime, timedelta
+from typing import Type, TypeVar
+
+from sqlalchemy import Column, String, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlmodel import Field
+
+from src.exceptions.database import DatabaseException
+from src.extensions import db
+from src.models.mixins import DustyModel
+from src.models.types import UTCDateTime
+
+T = TypeVar('T', bound='SchedulerLease')
+
+class SchedulerLease(DustyModel, table=True):
+    """
+    Lease electing the replica that runs a scheduler.
+
+    The holder renews the lease before it expires, any other replica can
+    take it over once it has expired or was released.
+    """
+    __tablename__ = 'scheduler_lease'
+
+    name: str = Field(sa_column=Column(String, nullable=False, unique=True))
+    holder: str
+    expires_at: datetime = Field(sa_column=Column(UTCDateTime(), nullable=False))
+
+    @classmethod
+    async def acquire(cls: Type[T], name: str, holder: str, ttl: timedelta, now: datetime) -> bool:
+        """Take or renew the lease, return False while another holder's lease is valid"""
+        renewed = await cls.update_many(
+            [cls.name == name, or_(cls.holder == holder, cls.expires_at <= now)],
+            {'holder': holder, 'expires_at': now + ttl}
+        )
+        if renewed:
+            return True
+
+        try:
+            async with db.transaction() as session:
+                result = await session.execute(select(cls.id).filter_by(name=name))
+                if result.first() is not None:
+                    return False
+                await cls.create(name=name, holder=holder, expires_at=now + ttl)
+        except DatabaseException as e:
+            if isinstance(e.__cause__, IntegrityError):
+                # Another replica created the lease first
+                return False
+            raise
+        return True
+
+    @classmethod
+    async def release(cls: Type[T], name: str, holder: str, now: datetime):
+        """Expire the lease if it is held by the holder, so another replica takes over right away"""
+        await cls.update_many({'name': name, 'holder': holder}, {'expires_at': now})
@@ -1,28 +1,125 @@
 """Weekly post model"""
-from typing import Type, TypeVar
+from datetime import datetime
+from typing import Any, Optional
 
-from sqlalchemy.future import select
+from sqlalchemy import JSON, BigInteger, Column, bindparam, or_, update
+from sqlalchemy.sql import ColumnElement
 from sqlmodel import Field
 
-from src.extensions import db
-from src.models.mixins import DustyModel
+from src.models.mixins import DustyModel, cached_query
+from src.models.types import UTCDateTime
+from src.util.cache import TTLCache
+from src.util.cron import parse_cron
+from src.util.date_util import next_weekly_occurrence, utcnow
 
-T = TypeVar('T', bound='WeeklyPost')
+# Columns the scheduler reads, loaded as records instead of whole posts
+SCHEDULE_COLUMNS = ('id', 'next_run_at')
+DUE_COLUMNS = (
+    'id', 'guild_id', 'channel_id', 'content', 'embeds', 'day_of_week', 'hour', 'minute', 'recurrence', 'next_run_at'
+)
+LIST_COLUMNS = ('id', 'channel_id', 'content', 'day_of_week', 'hour', 'minute', 'recurrence', 'next_run_at')
 
 class WeeklyPost(DustyModel, table=True):
     """
-    Post to be sent weekly
+    Post to be sent weekly, or on the schedule of its cron recurrence
     """
     __tablename__ = 'weekly_post'
+    # Replicas see each other's writes once they check the cache version, at most 5 seconds later
+    __cache__ = TTLCache(maxsize=1024, ttl=600, check_interval=5)
 
+    guild_id: Optional[int] = Field(default=None, sa_column=Column(BigInteger, index=True))
+    channel_id: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
     content: str
-    day_of_week: int
-    hour: int
+    # Embeds sent with the content, as Discord embed objects
+    embeds: Optional[list[dict[str, Any]]] = Field(default=None, sa_column=Column(JSON))
+    day_of_week: Optional[int] = Field(default=None)
+    hour: Optional[int] = Field(default=None)
     minute: int = Field(default=0)
+    # Cron expression replacing the weekly day, hour and minute, e.g. "0 9 * * mon-fri"
+    recurrence: Optional[str] = Field(default=None)
+    next_run_at: Optional[datetime] = Field(
+        sa_column=Column(
+            UTCDateTime(),
+            nullable=False,
+            index=True,
+        )
+    )
 
     @classmethod
-    async def get_by_day_of_week(cls: Type[T], day_of_week: int) -> list[T]:
-        session = await db.get_session()
-        stmt = select(cls).filter_by(day_of_week=day_of_week)
-        result = await session.execute(stmt)
-        return result.scalars().all()
+    def _prepare_values(cls, values: dict[str, Any]) -> dict[str, Any]:
+        """Schedule new posts at their next occurrence"""
+        if values.get('next_run_at') is None:
+            if values.get('recurrence'):
+                values['next_run_at'] = parse_cron(values['recurrence']).next_after(utcnow())
+            else:
+                values['next_run_at'] = next_weekly_occurrence(
+                    utcnow(),
+                    values['day_of_week'],
+                    values['hour'],
+                    values.get('minute', 0)
+                )
+        return values
+
+    @staticmethod
+    def next_run(post: Any, now: datetime) -> datetime:
+        """Return the first time after now a post, or a record with its schedule columns, should be sent"""
+        if post.recurrence:
+            return parse_cron(post.recurrence).next_after(now)
+        return next_weekly_occurrence(now, post.day_of_week, post.hour, post.minute)
+
+    @classmethod
+    def in_shards(
+        cls,
+        shard_count: int,
+        shard_ids: list[int],
+        include_unassigned: bool = False
+    ) -> ColumnElement:
+        """Return a clause matching posts of guilds handled by the given shards
+
+        Args:
+            shard_count (int): Total number of shards of the bot
+            shard_ids (list[int]): Shards run by this process
+            include_unassigned (bool): Also match posts without a guild, sent to the main channel
+        """
+        shard_id = cls.guild_id.op('>>', return_type=BigInteger)(22) % shard_count
+        clause = shard_id.in_(shard_ids)
+        if include_unassigned:
+            clause = or_(clause, cls.guild_id.is_(None))
+        return clause
+
+    @classmethod
+    async def get_fire_times(cls, *where: ColumnElement) -> list[tuple]:
+        """Return id and next run records of the posts matching the clauses, earliest first then by id"""
+        return await cls.project(SCHEDULE_COLUMNS, *where, order_by=(cls.next_run_at, cls.id))
+
+    @classmethod
+    async def get_earliest(cls, *where: ColumnElement) -> Optional[tuple]:
+        """Return the id and next run record of the post matching the clauses that runs first, or None"""
+        posts = await cls.project(SCHEDULE_COLUMNS, *where, order_by=(cls.next_run_at, cls.id), limit=1)
+        return posts[0] if posts else None
+
+    @classmethod
+    async def get_due(cls, now: datetime, *where: ColumnElement) -> list[tuple]:
+        """Return records of the posts matching the clauses due at or before now, earliest first then by id"""
+        return await cls.project(DUE_COLUMNS, cls.next_run_at <= now, *where, order_by=(cls.next_run_at, cls.id))
+
+    @classmethod
+    @cached_query
+    async def get_listed(cls, guild_id: int, channel_id: Optional[int], limit: int) -> list[tuple]:
+        """Return the records listing the posts of a guild, or of one of its channels, earliest first then by id"""
+        where = [cls.guild_id == guild_id]
+        if channel_id is not None:
+            where.append(cls.channel_id == channel_id)
+        return await cls.project(LIST_COLUMNS, *where, order_by=(cls.next_run_at, cls.id), limit=limit)
+
+    @classmethod
+    async def set_next_runs(cls, next_runs: dict[int, datetime], commit: bool = True):
+        """Update the next run of each post in one executemany statement"""
+        if not next_runs:
+            return
+        table = cls.__table__
+        stmt = update(table).where(table.c.id == bindparam('post_id')).values(next_run_at=bindparam('run_at'))
+        async with cls._write(commit) as session:
+            await session.execute(stmt, [
+                {'post_id': post_id, 'run_at': next_run_at} for post_id, next_run_at in next_runs.items()
+            ])
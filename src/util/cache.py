@@ -0,0 +1,88 @@
+"""Cache util"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+
+@dataclass
+class CacheStats:
+    """Cache counters for monitoring"""
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+class TTLCache:
+    """
+    Bounded least recently used cache whose entries expire after a time to live.
+
+    The entries hold for one version of the data. The version is checked again
+    once check_interval seconds have passed, a different version drops every entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, check_interval: float = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version: Optional[str] = None
+        self._checked_at: Optional[float] = None
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._stats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def needs_check(self) -> bool:
+        """Return whether the version should be checked before reading"""
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def check(self, version: Optional[str]):
+        """Drop every entry if the version changed since the last check"""
+        if version != self.version:
+            self.clear()
+            self.version = version
+        self._checked_at = time.monotonic()
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """Return whether the key was found and its value"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats.misses += 1
+            return False, None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._stats.evictions += 1
+            self._stats.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self._stats.hits += 1
+        return True, value
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._stats.evictions += 1
+
+    def clear(self):
+        """Drop every entry, the version is checked again on the next read"""
+        self._stats.invalidations += len(self._entries)
+        self._entries.clear()
+        self._checked_at = None
+
+    def stats(self) -> CacheStats:
+        """Return a snapshot of the cache counters"""
+        return CacheStats(
+            size=len(self._entries),
+            hits=self._stats.hits,
+            misses=self._stats.misses,
+            evictions=self._stats.evictions,
+            invalidations=self._stats.invalidations,
+        )
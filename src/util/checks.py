@@ -0,0 +1,9 @@
+"""App command checks"""
+from discord import Interaction, app_commands
+
+
+def is_owner():
+    """Only allow the bot owner to run the command"""
+    async def predicate(interaction: Interaction) -> bool:
+        return await interaction.client.is_owner(interaction.user)
+    return app_commands.check(predicate)
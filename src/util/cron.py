@@ -0,0 +1,159 @@
+"""Cron expression util"""
+import calendar
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+
+from src.exceptions.cron import InvalidCronException
+
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+DAY_NAMES = {name: i for i, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))}
+
+# Years searched for a match, February 29th can be 8 years apart
+MAX_YEARS = 9
+
+
+def _lowest_bit_from(mask: int, start: int) -> Optional[int]:
+    """Return the lowest set bit of the mask at or above start"""
+    mask >>= start
+    if not mask:
+        return None
+    return start + (mask & -mask).bit_length() - 1
+
+def _parse_field(field: str, low: int, high: int, names: dict[str, int] = None) -> int:
+    """Parse a cron field such as "*/15", "1-5" or "mon,wed" into a bitmask of its values"""
+    def value(text: str) -> int:
+        number = names.get(text.lower()) if names else None
+        if number is None:
+            if not text.isdigit():
+                raise ValueError(f'"{text}" is not a number')
+            number = int(text)
+        return number
+
+    mask = 0
+    for part in field.split(','):
+        spec, _, step = part.partition('/')
+        step = int(step) if step.isdigit() else None
+        if step == 0 or (step is None and part.count('/')):
+            raise ValueError(f'"{part}" has an invalid step')
+
+        if spec == '*':
+            start, end = low, high
+        else:
+            start, _, end = spec.partition('-')
+            start = value(start)
+            end = value(end) if end else (high if step else start)
+        if not low <= start <= end <= high:
+            raise ValueError(f'"{part}" is outside {low}-{high}')
+        for i in range(start, end + 1, step or 1):
+            mask |= 1 << i
+    return mask
+
+class CronExpression:
+    """
+    Cron expression compiled into bitmasks.
+
+    Every field is a bitmask of the values it allows, so each step of
+    finding the next fire time is a couple of bit operations. The day of
+    month and day of week fields match either one when both are
+    restricted, like in cron. Times are evaluated in UTC.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = MACROS.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise InvalidCronException(expression, 'expected minute, hour, day of month, month and day of week')
+
+        try:
+            self.minutes = _parse_field(fields[0], 0, 59)
+            self.hours = _parse_field(fields[1], 0, 23)
+            self.days = _parse_field(fields[2], 1, 31)
+            self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+            weekdays = _parse_field(fields[4], 0, 7, DAY_NAMES)
+        except ValueError as e:
+            raise InvalidCronException(expression, str(e)) from e
+
+        # Sunday is both 0 and 7, stored as Monday = 0 like datetime.weekday
+        sunday_first = (weekdays | weekdays >> 7) & 0x7f
+        self.weekdays = (sunday_first >> 1) | ((sunday_first & 1) << 6)
+        # Only a bare * leaves a day field unrestricted, a stepped * such as */2 restricts it
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        # Days of a 31 day month matching the weekdays, for each weekday the month can start on
+        self._weekday_days = [
+            sum(1 << day for day in range(1, 32) if self.weekdays >> ((first + day - 1) % 7) & 1)
+            for first in range(7)
+        ]
+
+        if self.any_weekday:
+            longest = max(calendar.monthrange(2000, month)[1] for month in range(1, 13) if self.months >> month & 1)
+            if _lowest_bit_from(self.days, 1) > longest:
+                raise InvalidCronException(expression, 'the days never occur in the months')
+
+    def __repr__(self) -> str:
+        return f'CronExpression({self.expression!r})'
+
+    def days_in(self, year: int, month: int) -> int:
+        """Return the bitmask of the days of the month matching the expression"""
+        first_weekday, length = calendar.monthrange(year, month)
+        weekday_days = self._weekday_days[first_weekday]
+        if self.any_weekday:
+            days = self.days
+        elif self.any_day:
+            days = weekday_days
+        else:
+            days = self.days | weekday_days
+        return days & ((1 << (length + 1)) - 2)
+
+    def next_after(self, now: datetime) -> datetime:
+        """Return the first time after now matching the expression"""
+        start = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        year, month, day, hour, minute = start.year, start.month, start.day, start.hour, start.minute
+        while year < start.year + MAX_YEARS:
+            next_month = _lowest_bit_from(self.months, month)
+            if next_month is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+
+            next_day = _lowest_bit_from(self.days_in(year, month), day)
+            if next_day is None:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                continue
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+
+            next_hour = _lowest_bit_from(self.hours, hour)
+            if next_hour is None:
+                day, hour, minute = day + 1, 0, 0
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+
+            next_minute = _lowest_bit_from(self.minutes, minute)
+            if next_minute is None:
+                hour, minute = hour + 1, 0
+                if hour > 23:
+                    day, hour = day + 1, 0
+                continue
+            return start.replace(year=year, month=month, day=day, hour=hour, minute=next_minute)
+
+        raise InvalidCronException(self.expression, f'no match within {MAX_YEARS} years')
+
+@lru_cache(maxsize=1024)
+def parse_cron(expression: str) -> CronExpression:
+    """Compile the cron expression, each expression is compiled once"""
+    return CronExpression(expression)
@@ -1,17 +1,21 @@
 """Datetime util"""
-from datetime import datetime, time, timedelta
+from datetime import datetime, timedelta, timezone
 
 
-def seconds_until(hours: int, minute: int) -> int:
-    """Return seconds until given hour and minute"""
-    given_time = time(hour=hours, minute=minute)
-    now = datetime.now()
-    future_exec = datetime.combine(now, given_time)
-    if (future_exec - now).days < 0:
-        # If we are past the execution, it will take place tomorrow
-        future_exec = datetime.combine(now + timedelta(days=1), given_time) # days always >= 0
-    return (future_exec - now).total_seconds()
+def utcnow() -> datetime:
+    """Return the current timezone aware UTC datetime"""
+    return datetime.now(timezone.utc)
 
-def ceil_datetime(dt: datetime, delta: timedelta) -> datetime:
-    """Return datetime rounded up to the nearest given delta"""
-    return dt + (datetime.min - dt) % delta
+def seconds_until(dt: datetime, now: datetime = None) -> float:
+    """Return seconds until the given datetime, or 0 if it already passed"""
+    now = now or utcnow()
+    return max((dt - now).total_seconds(), 0)
+
+def next_weekly_occurrence(now: datetime, day_of_week: int, hour: int, minute: int) -> datetime:
+    """Return the first datetime after now that falls on the given weekday, hour and minute"""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    candidate += timedelta(days=(day_of_week - now.weekday()) % 7)
+    if candidate <= now:
+        # Already passed this week, it will take place next week
+        candidate += timedelta(weeks=1)
+    return candidate
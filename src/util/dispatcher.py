@@ -0,0 +1,254 @@
+"""Post dispatcher"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Any, Optional
+
+from aiohttp import ClientError
+from discord import Embed, File, HTTPException, Message
+from discord.abc import Messageable
+
+# Discord message limits
+MAX_CONTENT_LENGTH = 2000
+MAX_EMBEDS = 10
+MAX_EMBEDS_LENGTH = 6000 # Characters across every embed of a message
+
+PACK_SEPARATOR = '\n\n'
+
+
+@dataclass
+class Delivery:
+    """Message to send to a channel for a post"""
+    post_id: int
+    channel: Messageable
+    content: Optional[str] = None
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    # Paths and filenames of the files to upload, opened again on every attempt since sending closes them
+    files: list[tuple[str, str]] = field(default_factory=list)
+    # Scheduled time of the post, only deliveries of the same slot are packed together
+    slot: Optional[datetime] = None
+
+@dataclass
+class DeliveryResult:
+    """Outcome of a delivery"""
+    post_id: int
+    sent: bool
+    attempts: int
+    message: Optional[Message] = None
+    error: Optional[Exception] = None
+
+def _embeds(delivery: Delivery) -> list[Embed]:
+    return delivery.kwargs.get('embeds') or []
+
+def can_pack(first: Delivery, second: Delivery) -> bool:
+    """Return whether two deliveries to a channel fit in one message"""
+    if first.slot is None or first.slot != second.slot or first.files or second.files:
+        return False
+    # Other send options cannot be combined
+    if set(first.kwargs) - {'embeds'} or set(second.kwargs) - {'embeds'}:
+        return False
+
+    contents = [content for content in (first.content, second.content) if content]
+    embeds = _embeds(first) + _embeds(second)
+    return (
+        len(PACK_SEPARATOR.join(contents)) <= MAX_CONTENT_LENGTH
+        and len(embeds) <= MAX_EMBEDS
+        and sum(len(embed) for embed in embeds) <= MAX_EMBEDS_LENGTH
+    )
+
+def pack(deliveries: list[tuple[int, Delivery]]) -> list[tuple[list[int], Delivery]]:
+    """
+    Merge consecutive deliveries of a channel that fit in one message, keeping their order.
+    Returns each message with the indexes of the deliveries it carries.
+    """
+    packed: list[tuple[list[int], Delivery]] = []
+    for index, delivery in deliveries:
+        if packed and can_pack(packed[-1][1], delivery):
+            indexes, merged = packed[-1]
+            contents = [content for content in (merged.content, delivery.content) if content]
+            embeds = _embeds(merged) + _embeds(delivery)
+            merged = Delivery(
+                merged.post_id,
+                merged.channel,
+                PACK_SEPARATOR.join(contents) or None,
+                {'embeds': embeds} if embeds else {},
+                slot=merged.slot
+            )
+            packed[-1] = (indexes + [index], merged)
+        else:
+            packed.append(([index], delivery))
+    return packed
+
+class RateLimitBucket:
+    """
+    Token bucket allowing `rate` sends every `per` seconds
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a send is allowed and take its token"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._tokens = min(self.rate, self._tokens + (now - self._updated_at) * self.rate / self.per)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+    def block(self, seconds: float):
+        """Hold every send for the given seconds, after Discord reported a rate limit"""
+        self._tokens = 0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+class PostDispatcher:
+    """
+    Sends deliveries with a bounded pool of workers.
+
+    Deliveries to the same channel are sent in order by a single worker and
+    throttled by that channel's bucket, different channels are sent concurrently.
+    Rate limited and server errors are retried with jittered exponential backoff,
+    other errors and sends taking longer than the send timeout fail the delivery.
+    With coalescing, consecutive deliveries of a channel and slot that fit in
+    one message are sent together and share its result.
+    """
+
+    # Discord allows 5 messages every 5 seconds per channel and 50 requests per second globally
+    CHANNEL_RATE = (5, 5.0)
+    GLOBAL_RATE = (50, 1.0)
+
+    def __init__(
+        self,
+        concurrency: int = 5,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        coalesce: bool = False,
+        send_timeout: float = 30.0
+    ): # pylint: disable=too-many-arguments
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.send_timeout = send_timeout
+        self.coalesce = coalesce
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._global_bucket = RateLimitBucket(*self.GLOBAL_RATE)
+        self._buckets: dict[int, RateLimitBucket] = {}
+        self._log = logging.getLogger('PostDispatcher')
+
+    async def dispatch(self, deliveries: list[Delivery]) -> list[DeliveryResult]:
+        """Send every delivery and return their results in the same order"""
+        lanes: dict[int, list[tuple[int, Delivery]]] = {}
+        for index, delivery in enumerate(deliveries):
+            lanes.setdefault(delivery.channel.id, []).append((index, delivery))
+
+        queue: asyncio.Queue = asyncio.Queue()
+        messages = 0
+        for lane in lanes.values():
+            packed = pack(lane) if self.coalesce else [([index], delivery) for index, delivery in lane]
+            messages += len(packed)
+            queue.put_nowait(packed)
+        if messages < len(deliveries):
+            self._log.debug('Packed %d deliveries into %d messages.', len(deliveries), messages)
+
+        results: dict[int, DeliveryResult] = {}
+        workers = [
+            asyncio.create_task(self._worker(queue, results))
+            for _ in range(min(self.concurrency, len(lanes)))
+        ]
+        # A failed worker does not stop the others, the deliveries it did not send are failed with its error
+        error = None
+        for outcome in await asyncio.gather(*workers, return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                self._log.error('A dispatch worker failed.', exc_info=outcome)
+                error = outcome
+
+        # Packed deliveries share the result of their message
+        return [
+            replace(results[index], post_id=delivery.post_id) if index in results
+            else DeliveryResult(delivery.post_id, False, 0, error=error)
+            for index, delivery in enumerate(deliveries)
+        ]
+
+    async def _worker(self, queue: asyncio.Queue, results: dict[int, DeliveryResult]):
+        """Send the lanes of deliveries taken from the queue until it is empty"""
+        while not queue.empty():
+            lane = queue.get_nowait()
+            for indexes, delivery in lane:
+                result = await self._deliver(delivery)
+                for index in indexes:
+                    results[index] = result
+
+    async def _deliver(self, delivery: Delivery) -> DeliveryResult:
+        """Send a delivery, retrying rate limited and server errors"""
+        bucket = self._buckets.setdefault(delivery.channel.id, RateLimitBucket(*self.CHANNEL_RATE))
+        attempt = 0
+        while True:
+            attempt += 1
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            files: list[File] = []
+            try:
+                for path, filename in delivery.files:
+                    files.append(File(path, filename=filename))
+            except OSError as e:
+                for file in files:
+                    file.close()
+                self._log.error('Could not open the files of post ID %d.', delivery.post_id)
+                return DeliveryResult(delivery.post_id, False, attempt, error=e)
+            try:
+                message = await asyncio.wait_for(
+                    delivery.channel.send(delivery.content, files=files, **delivery.kwargs),
+                    timeout=self.send_timeout
+                )
+                return DeliveryResult(delivery.post_id, True, attempt, message=message)
+            except (ClientError, asyncio.TimeoutError) as e:
+                # Not retried, the message may have been sent before the connection failed
+                self._log.error('Failed to send post ID %d: %r', delivery.post_id, e)
+                return DeliveryResult(delivery.post_id, False, attempt, error=e)
+            except HTTPException as e:
+                if not self._should_retry(e) or attempt >= self.max_attempts:
+                    self._log.error('Failed to send post ID %d after %d attempts.', delivery.post_id, attempt)
+                    return DeliveryResult(delivery.post_id, False, attempt, error=e)
+
+                delay = self._backoff(attempt, e)
+                if e.status == 429:
+                    bucket.block(delay)
+                self._log.warning('Retrying post ID %d in %.2f seconds after status %d.',
+                                  delivery.post_id, delay, e.status)
+                await asyncio.sleep(delay)
+            except Exception as e: # pylint: disable=broad-except
+                self._log.exception('Error sending post ID %d.', delivery.post_id)
+                return DeliveryResult(delivery.post_id, False, attempt, error=e)
+            finally:
+                # Sending closes the files, except when it fails before reading them
+                for file in files:
+                    file.close()
+
+    @staticmethod
+    def _should_retry(error: HTTPException) -> bool:
+        """Return whether the error is a rate limit or a server error"""
+        return error.status == 429 or error.status >= 500
+
+    def _backoff(self, attempt: int, error: HTTPException) -> float:
+        """Return the jittered exponential delay before the next attempt"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        retry_after = getattr(error.response, 'headers', {}).get('Retry-After')
+        if retry_after is not None:
+            delay = max(delay, float(retry_after))
+        return delay
@@ -1,11 +1,179 @@
 """Logger util"""
-from logging import Logger
+import json
+import logging
+import queue
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging import Formatter, Logger, LogRecord
+from logging.handlers import QueueHandler, QueueListener
+from typing import TYPE_CHECKING, Optional
 
-from discord import Interaction
+if TYPE_CHECKING:
+    from discord import Interaction
 
+    from src.config import Config
 
-def log_app_command(log: Logger, interaction: Interaction):
+TEXT_FORMAT = '%(name)s [%(asctime)s] [%(levelname)s] %(message)s'
+TEXT_DATE_FORMAT = '%x %X %z'
+
+
+def log_app_command(log: Logger, interaction: 'Interaction'):
     """Log who enter the given application command"""
     user = interaction.user.name
     command = interaction.command.name
     log.info('User %s excuted command %s.', user, command)
+
+@contextmanager
+def log_duration(log: Logger, phase: str):
+    """Log how long the block took"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        log.info('%s took %.1f ms.', phase, (time.perf_counter() - start) * 1000)
+
+def parse_logger_settings(value: str) -> dict[str, str]:
+    """Parse a comma separated list of logger=setting pairs such as *=50/1,discord.gateway=5/1"""
+    settings = {}
+    for part in value.split(','):
+        name, _, setting = part.strip().partition('=')
+        if setting:
+            settings[name.strip()] = setting.strip()
+    return settings
+
+def setting_for(settings: dict[str, str], name: str) -> Optional[str]:
+    """Return the setting of the logger, its closest configured parent, or the "*" default"""
+    while name:
+        if name in settings:
+            return settings[name]
+        name = name.rpartition('.')[0]
+    return settings.get('*')
+
+def _annotate(record: LogRecord, note: str):
+    """Append a note to the message of the record"""
+    record.msg = f'{record.getMessage()} ({note})'
+    record.args = None
+
+class JsonFormatter(Formatter):
+    """
+    Formats records as one JSON object per line
+    """
+
+    def format(self, record: LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Samples and rate limits records per logger.
+
+    Records below WARNING are kept with the sampling rate of their logger.
+    Every record then takes a token from its logger's bucket, records are
+    dropped while the bucket is empty and the next record kept reports how
+    many were suppressed.
+    """
+
+    def __init__(self, rate_limits: dict[str, str], sampling: dict[str, str]):
+        super().__init__()
+        self.rate_limits = rate_limits
+        self.sampling = sampling
+        self._buckets: dict[str, list[float]] = {}
+        self._suppressed: dict[str, int] = {}
+
+    def filter(self, record: LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = setting_for(self.sampling, record.name)
+            if rate is not None and random.random() >= float(rate):
+                return False
+
+        if not self._take_token(record.name):
+            self._suppressed[record.name] = self._suppressed.get(record.name, 0) + 1
+            return False
+
+        suppressed = self._suppressed.pop(record.name, 0)
+        if suppressed:
+            _annotate(record, f'{suppressed} records suppressed')
+        return True
+
+    def _take_token(self, name: str) -> bool:
+        """Take a token from the bucket of the logger, return False if it is empty"""
+        limit = setting_for(self.rate_limits, name)
+        if limit is None:
+            return True
+
+        rate, _, per = limit.partition('/')
+        rate, per = float(rate), float(per or 1)
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(name, (rate, now))
+        tokens = min(rate, tokens + (now - updated_at) * rate / per)
+        allowed = tokens >= 1
+        self._buckets[name] = [tokens - 1 if allowed else tokens, now]
+        return allowed
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the event loop.
+
+    Records are queued with their exception info, so tracebacks are only
+    formatted by the listener thread. Records are dropped when the queue is
+    full and the next record queued reports how many were dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # Only freeze the message, formatting is left to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: LogRecord):
+        if self.dropped:
+            _annotate(record, f'{self.dropped} records dropped')
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+def configure_logging(config: 'Config') -> QueueListener:
+    """
+    Route every log record through a queue to a listener thread writing to stderr.
+
+    Returns the started listener, stop it to flush the remaining records.
+    """
+    formatter = JsonFormatter() if config.LOG_FORMAT == 'json' else Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(
+        parse_logger_settings(config.LOG_RATE_LIMITS),
+        parse_logger_settings(config.LOG_SAMPLING)
+    ))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LEVEL)
+    # The gateway debug logs would flood the queue
+    logging.getLogger('discord').setLevel(max(config.LEVEL, logging.INFO))
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
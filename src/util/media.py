@@ -0,0 +1,160 @@
+"""Media util"""
+import asyncio
+import logging
+import os
+import queue
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+import aiohttp
+import yarl
+from discord import Embed, HTTPException, Message
+from discord.http import HTTPClient, Route
+
+from src.extensions import db
+from src.models.post_attachment import PostAttachment
+from src.util.dispatcher import MAX_CONTENT_LENGTH, MAX_EMBEDS
+
+# Discord refreshes at most 50 attachment URLs per request
+REFRESH_BATCH_SIZE = 50
+MAX_PENDING_CHUNKS = 16 # Downloaded chunks waiting to be written at a time
+
+
+def url_expiry(url: str) -> Optional[datetime]:
+    """Return when a Discord CDN URL expires, read from its hexadecimal ex parameter"""
+    value = yarl.URL(url).query.get('ex')
+    if value is None:
+        return None
+    try:
+        return datetime.fromtimestamp(int(value, 16), timezone.utc)
+    except ValueError:
+        return None
+
+async def download(url: str, path: str, chunk_size: int) -> int:
+    """Stream the file at the URL to the path without holding it in memory, return its size
+
+    One thread writes the chunks while the next ones download, at most MAX_PENDING_CHUNKS behind.
+    The file is removed if the download fails.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    loop = asyncio.get_running_loop()
+    chunks: queue.SimpleQueue = queue.SimpleQueue()
+    pending = asyncio.Semaphore(MAX_PENDING_CHUNKS)
+
+    def write(fp):
+        # Keeps taking chunks after an error so the download never waits on a stopped writer
+        error = None
+        while (chunk := chunks.get()) is not None:
+            if error is None:
+                try:
+                    fp.write(chunk)
+                except OSError as e:
+                    error = e
+            loop.call_soon_threadsafe(pending.release)
+        if error is not None:
+            raise error
+
+    size = 0
+    fp = open(path, 'wb') # pylint: disable=consider-using-with
+    try:
+        with fp:
+            writer = asyncio.create_task(asyncio.to_thread(write, fp))
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            await pending.acquire()
+                            chunks.put(chunk)
+                            size += len(chunk)
+            finally:
+                chunks.put(None)
+                await writer
+    except BaseException:
+        # A partial file would later be sent as the whole attachment
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return size
+
+class AttachmentCache:
+    """
+    Reuses the CDN URLs of post attachments.
+
+    Attachments with a cached URL are sent as embed images or links instead
+    of being uploaded. Expiring URLs are refreshed through Discord in batches,
+    attachments whose URL Discord no longer serves are uploaded from disk on
+    their next send and the URL of that upload is cached. The files are on the
+    volume of the replica that saved them, an attachment whose file is on
+    another replica is left out until its URL is usable again.
+    """
+
+    def __init__(self, http: HTTPClient, margin: float):
+        self.http = http
+        self.margin = timedelta(seconds=margin)
+        self._log = logging.getLogger('AttachmentCache')
+
+    async def refresh(self, attachments: list[PostAttachment], now: datetime):
+        """Refresh the cached URLs expiring before the margin, forgetting those Discord no longer serves"""
+        stale = [
+            attachment for attachment in attachments
+            if attachment.url is not None and not attachment.has_url(now + self.margin)
+        ]
+        for i in range(0, len(stale), REFRESH_BATCH_SIZE):
+            batch = stale[i:i + REFRESH_BATCH_SIZE]
+            try:
+                data = await self.http.request(
+                    Route('POST', '/attachments/refresh-urls'),
+                    json={'attachment_urls': [attachment.url for attachment in batch]}
+                )
+                refreshed = {entry['original']: entry['refreshed'] for entry in data.get('refreshed_urls', [])}
+            except HTTPException:
+                # Kept to refresh on the next send, the file may not be on this replica
+                self._log.warning('Could not refresh %d attachment URLs.', len(batch), exc_info=True)
+                continue
+
+            async with db.transaction():
+                for attachment in batch:
+                    url = refreshed.get(attachment.url)
+                    await attachment.update(url=url, expires_at=url_expiry(url) if url else None)
+
+    def message_parts(
+        self,
+        content: Optional[str],
+        embeds: Optional[list[dict[str, Any]]],
+        attachments: list[PostAttachment],
+        now: datetime
+    ) -> tuple[Optional[str], list[Embed], list[PostAttachment]]:
+        """Return the content, embeds and attachments to upload of a post
+
+        Cached images become embeds and other cached files links in the
+        content, as long as the message stays within Discord's limits.
+        The others are uploaded if their file is on this replica.
+        """
+        embeds = [Embed.from_dict(embed) for embed in embeds or []]
+        links = []
+        uploads = []
+        for attachment in attachments:
+            if attachment.has_url(now):
+                if attachment.is_image and len(embeds) < MAX_EMBEDS:
+                    embeds.append(Embed().set_image(url=attachment.url))
+                    continue
+                if len(content or '') + sum(len(link) + 1 for link in links) + len(attachment.url) < MAX_CONTENT_LENGTH:
+                    links.append(attachment.url)
+                    continue
+            if os.path.exists(attachment.path):
+                uploads.append(attachment)
+            else:
+                self._log.warning('Left out attachment ID %d, its file is not on this replica.', attachment.id)
+
+        if links:
+            content = '\n'.join([content, *links]) if content else '\n'.join(links)
+        return content, embeds, uploads
+
+    async def record_uploads(self, uploads: list[PostAttachment], message: Message):
+        """Cache the CDN URLs of the attachments uploaded with the message"""
+        async with db.transaction():
+            for attachment, uploaded in zip(uploads, message.attachments):
+                await attachment.update(url=uploaded.url, expires_at=url_expiry(uploaded.url))
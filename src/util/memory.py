@@ -0,0 +1,18 @@
+"""Memory util"""
+import os
+import resource
+import sys
+
+
+def memory_usage() -> tuple[int, int]:
+    """Return the current and peak resident set size of the process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = peak if sys.platform == 'darwin' else peak * 1024
+
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as statm:
+            rss = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        rss = peak
+    return rss, max(rss, peak)
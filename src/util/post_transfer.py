@@ -0,0 +1,201 @@
+"""Weekly post import and export util"""
+import asyncio
+import csv
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import IO, Any, Awaitable, Callable, Iterator, Optional
+
+from src.exceptions.cron import InvalidCronException
+from src.extensions import db
+from src.models.weekly_post import WeeklyPost
+from src.util.cron import parse_cron
+from src.util.date_util import next_weekly_occurrence, utcnow
+from src.util.dispatcher import MAX_CONTENT_LENGTH, MAX_EMBEDS
+
+COLUMNS = (
+    'guild_id', 'channel_id', 'content', 'embeds', 'day_of_week', 'hour', 'minute', 'recurrence', 'next_run_at'
+)
+FORMATS = ('csv', 'jsonl')
+MAX_ERRORS = 100 # Rejected rows kept in a report, the others are only counted
+MAX_ID = 2 ** 63 - 1 # Largest value of the BIGINT id columns
+
+Progress = Callable[[int], Awaitable[None]]
+
+
+@dataclass
+class ImportReport:
+    """Outcome of an import"""
+    imported: int = 0
+    rejected: int = 0
+    # Line number and reason of the first rejected rows
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+def format_for(path: str, default: str = 'jsonl') -> str:
+    """Return the format of a file from its extension"""
+    extension = path.rpartition('.')[2].lower()
+    return extension if extension in FORMATS else default
+
+def read_rows(fp: IO[str], fmt: str) -> Iterator[tuple[int, dict[str, Any]]]:
+    """Yield the line number and values of each row of a CSV or JSONL file, one line at a time"""
+    if fmt == 'csv':
+        reader = csv.DictReader(fp)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if value != ''}
+        return
+
+    for line_num, line in enumerate(fp, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            row = {'_error': f'invalid JSON: {e.msg}'}
+        yield line_num, row if isinstance(row, dict) else {'_error': 'not a JSON object'}
+
+def _integer(row: dict[str, Any], column: str, low: int = None, high: int = None) -> Optional[int]:
+    value = row.get(column)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'{column} is not an integer') from e
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f'{column} is outside {low}-{high}')
+    return value
+
+def validate_row(row: dict[str, Any], now: datetime) -> dict[str, Any]:
+    """Return the column values of a row to import, raise ValueError if it is invalid
+
+    Rows without a next run, or with one in the past, are scheduled at their next occurrence.
+    """
+    if '_error' in row:
+        raise ValueError(row['_error'])
+
+    content = row.get('content')
+    if not isinstance(content, str) or not content:
+        raise ValueError('content is missing')
+    if len(content) > MAX_CONTENT_LENGTH:
+        raise ValueError(f'content is longer than {MAX_CONTENT_LENGTH} characters')
+
+    embeds = row.get('embeds')
+    if isinstance(embeds, str):
+        try:
+            embeds = json.loads(embeds)
+        except json.JSONDecodeError as e:
+            raise ValueError('embeds is not JSON') from e
+    if embeds is not None and (
+        not isinstance(embeds, list) or len(embeds) > MAX_EMBEDS or not all(isinstance(e, dict) for e in embeds)
+    ):
+        raise ValueError(f'embeds is not a list of at most {MAX_EMBEDS} embed objects')
+
+    values = {
+        'guild_id': _integer(row, 'guild_id', 0, MAX_ID),
+        'channel_id': _integer(row, 'channel_id', 0, MAX_ID),
+        'content': content,
+        'embeds': embeds or None,
+        'day_of_week': _integer(row, 'day_of_week', 0, 6),
+        'hour': _integer(row, 'hour', 0, 23),
+        'minute': _integer(row, 'minute', 0, 59) or 0,
+        'recurrence': row.get('recurrence') or None,
+    }
+
+    if values['recurrence'] is not None:
+        if values['day_of_week'] is not None or values['hour'] is not None:
+            raise ValueError('has both a recurrence and a day of week and hour')
+        try:
+            next_occurrence = parse_cron(values['recurrence']).next_after
+        except InvalidCronException as e:
+            raise ValueError(str(e)) from e
+    elif values['day_of_week'] is None or values['hour'] is None:
+        raise ValueError('needs a day of week and hour, or a recurrence')
+    else:
+        def next_occurrence(after: datetime) -> datetime:
+            return next_weekly_occurrence(after, values['day_of_week'], values['hour'], values['minute'])
+
+    next_run_at = row.get('next_run_at')
+    if next_run_at is not None:
+        try:
+            next_run_at = datetime.fromisoformat(str(next_run_at))
+        except ValueError as e:
+            raise ValueError('next_run_at is not an ISO 8601 datetime') from e
+        if next_run_at.tzinfo is None:
+            next_run_at = next_run_at.replace(tzinfo=timezone.utc)
+    if next_run_at is None or next_run_at <= now:
+        next_run_at = next_occurrence(now)
+    values['next_run_at'] = next_run_at
+    return values
+
+def _read_valid_rows(
+    rows: Iterator[tuple[int, dict[str, Any]]],
+    chunk_size: int,
+    now: datetime,
+    report: ImportReport
+) -> list[dict[str, Any]]:
+    """Read rows until chunk_size of them are valid or the rows run out, reporting the invalid ones"""
+    chunk = []
+    for line_num, row in rows:
+        try:
+            chunk.append(validate_row(row, now))
+        except ValueError as e:
+            report.rejected += 1
+            if len(report.errors) < MAX_ERRORS:
+                report.errors.append((line_num, str(e)))
+            continue
+        if len(chunk) >= chunk_size:
+            break
+    return chunk
+
+async def import_posts(
+    rows: Iterator[tuple[int, dict[str, Any]]],
+    chunk_size: int,
+    progress: Optional[Progress] = None
+) -> ImportReport:
+    """
+    Validate and insert the rows a chunk at a time in one transaction.
+    Invalid rows are skipped and reported, the valid ones are imported.
+    The rows are read and validated in a thread, a large file does not block the event loop.
+    """
+    report = ImportReport()
+    now = utcnow()
+
+    async with db.transaction():
+        while True:
+            chunk = await asyncio.to_thread(_read_valid_rows, rows, chunk_size, now, report)
+            if chunk:
+                await WeeklyPost.copy_many(chunk, COLUMNS, commit=False)
+                report.imported += len(chunk)
+                if progress is not None:
+                    await progress(report.imported)
+            if len(chunk) < chunk_size:
+                return report
+
+def _write_rows(fp: IO[str], writer: Optional[Any], rows: list[tuple]):
+    """Write the rows of a chunk as CSV with the writer, or as JSONL without one"""
+    for row in rows:
+        values = dict(zip(COLUMNS, row))
+        values['next_run_at'] = values['next_run_at'].isoformat()
+        if writer is not None:
+            values['embeds'] = json.dumps(values['embeds']) if values['embeds'] else None
+            writer.writerow(values[column] for column in COLUMNS)
+        else:
+            fp.write(json.dumps(values) + '\n')
+
+async def export_posts(fp: IO[str], fmt: str, chunk_size: int, progress: Optional[Progress] = None) -> int:
+    """Write every weekly post to the file as CSV or JSONL a chunk at a time, return the number of posts
+
+    Each chunk is formatted and written in a thread while the event loop keeps running.
+    """
+    exported = 0
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(fp)
+        await asyncio.to_thread(writer.writerow, COLUMNS)
+
+    async for chunk in WeeklyPost.stream_rows(COLUMNS, chunk_size=chunk_size):
+        await asyncio.to_thread(_write_rows, fp, writer, chunk)
+        exported += len(chunk)
+        if progress is not None:
+            await progress(exported)
+    return exported
@@ -0,0 +1,61 @@
+"""In-memory schedule index"""
+import heapq
+from datetime import datetime
+from typing import Optional
+
+
+class Schedule:
+    """
+    Min-heap of keys ordered by their next fire time.
+
+    Rescheduling or removing a key leaves its old heap entry behind,
+    stale entries are skipped lazily when they reach the top of the heap.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[datetime, int]] = []
+        self._fire_times: dict[int, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._fire_times)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._fire_times
+
+    def add(self, key: int, fire_at: datetime):
+        """Schedule a key, replacing any previous fire time"""
+        self._fire_times[key] = fire_at
+        heapq.heappush(self._heap, (fire_at, key))
+
+    def remove(self, key: int):
+        """Unschedule a key"""
+        self._fire_times.pop(key, None)
+
+    def clear(self):
+        """Unschedule every key"""
+        self._heap.clear()
+        self._fire_times.clear()
+
+    def next_fire_time(self) -> Optional[datetime]:
+        """Return the earliest fire time, or None if nothing is scheduled"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> list[tuple[datetime, int]]:
+        """Remove and return every key due at or before now, earliest first"""
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, key = heapq.heappop(self._heap)
+            del self._fire_times[key]
+            due.append((fire_at, key))
+            self._drop_stale()
+        return due
+
+    def _drop_stale(self):
+        """Pop heap entries that were rescheduled or removed"""
+        while self._heap:
+            fire_at, key = self._heap[0]
+            if self._fire_times.get(key) == fire_at:
+                return
+            heapq.heappop(self._heap)
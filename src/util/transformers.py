@@ -0,0 +1,23 @@
+"""App command transformers"""
+from discord import AppCommandOptionType, ChannelType, Interaction, app_commands
+from discord.app_commands import AppCommandChannel
+
+
+class TextChannelTransformer(app_commands.Transformer):
+    """
+    Text channel option taken from the interaction payload.
+
+    Unlike a TextChannel annotation it does not need the guild cache,
+    which is empty after a resumed gateway session.
+    """
+
+    @property
+    def type(self) -> AppCommandOptionType:
+        return AppCommandOptionType.channel
+
+    @property
+    def channel_types(self) -> list[ChannelType]:
+        return [ChannelType.text, ChannelType.news]
+
+    async def transform(self, interaction: Interaction, value: AppCommandChannel) -> AppCommandChannel:
+        return value
@@ -0,0 +1,32 @@
+"""Test fixtures"""
+import asyncio
+
+import pytest
+from sqlmodel import SQLModel
+
+from src.config import EmbeddedConfig
+from src.extensions import db
+# Imported so the metadata holds every table, as in the migrations
+from src.models import bot_state, command_audit, post_attachment, post_delivery, scheduler_lease, weekly_post # pylint: disable=unused-import
+from src.models.mixins import DustyModel
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Return a runner of coroutine functions against a new embedded SQLite database"""
+    config = EmbeddedConfig(SQLALCHEMY_DATABASE_URI=f'sqlite+aiosqlite:///{tmp_path}/test.db')
+    for model in DustyModel.__subclasses__():
+        if model.__cache__ is not None:
+            model.__cache__.clear()
+
+    def run(test):
+        async def main():
+            db.init_engine(config)
+            async with db.engine.begin() as connection:
+                await connection.run_sync(SQLModel.metadata.create_all)
+            try:
+                return await test()
+            finally:
+                await db.engine.dispose()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,27 @@
+"""Audit log tests"""
+import asyncio
+
+from src.extensions.audit import AuditLog
+
+
+def test_flush_loop_survives_unexpected_errors():
+    async def test():
+        audit = AuditLog()
+        audit.enabled = True
+        audit.flush_interval = 0.01
+        flushes = []
+
+        async def flush():
+            flushes.append(len(flushes))
+            if len(flushes) == 1:
+                raise RuntimeError('unexpected')
+
+        async def flushed_again():
+            while len(flushes) < 3:
+                await asyncio.sleep(0.01)
+
+        audit.flush = flush
+        await audit.start()
+        await asyncio.wait_for(flushed_again(), timeout=1)
+        await audit.stop()
+    asyncio.run(test())
@@ -0,0 +1,24 @@
+"""Bot configuration tests"""
+from dataclasses import replace
+
+import pytest
+
+from src.bot import DustyBot, parse_shard_ids
+from src.config import EmbeddedConfig
+from src.exceptions.bot import MissingShardCountException
+
+CONFIG = EmbeddedConfig(DISCORD_BOT_TOKEN='token', DISCORD_SHARD_COUNT='', DISCORD_SHARD_IDS='')
+
+
+def test_parse_shard_ids():
+    assert parse_shard_ids('') is None
+    assert parse_shard_ids('0, 2,4-6') == [0, 2, 4, 5, 6]
+
+def test_shard_ids_need_a_shard_count():
+    with pytest.raises(MissingShardCountException, match='DISCORD_SHARD_COUNT.*DISCORD_SHARD_IDS'):
+        DustyBot(replace(CONFIG, DISCORD_SHARD_IDS='0-1'))
+
+def test_shard_ids_with_a_shard_count():
+    bot = DustyBot(replace(CONFIG, DISCORD_SHARD_COUNT='4', DISCORD_SHARD_IDS='0-1'))
+    assert (bot.shard_count, bot.shard_ids) == (4, [0, 1])
+    assert bot.owns_guild(1 << 22) and not bot.owns_guild(2 << 22)
@@ -0,0 +1,53 @@
+"""Cron expression tests"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.exceptions.cron import InvalidCronException
+from src.util.cron import CronExpression
+
+START = datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc)
+
+
+def fire_times(expression: str, count: int) -> list[datetime]:
+    """Return the next fire times of the expression after START"""
+    cron = CronExpression(expression)
+    times, now = [], START
+    for _ in range(count):
+        now = cron.next_after(now)
+        times.append(now)
+    return times
+
+def test_stepped_weekday_only_fires_on_its_days():
+    # Sunday, Tuesday, Thursday and Saturday, as Monday = 0 weekdays
+    times = fire_times('0 0 * * */2', 12)
+    assert {time.weekday() for time in times} == {1, 3, 5, 6}
+    assert all(time.hour == 0 and time.minute == 0 for time in times)
+
+def test_stepped_day_of_month_matches_either_day_field():
+    times = fire_times('0 0 */10 * mon', 20)
+    assert all(time.day in (1, 11, 21, 31) or time.weekday() == 0 for time in times)
+    assert any(time.weekday() != 0 for time in times)
+    assert any(time.day not in (1, 11, 21, 31) for time in times)
+
+def test_bare_star_day_leaves_the_weekdays():
+    times = fire_times('15 9 * * mon-fri', 10)
+    assert all(time.weekday() < 5 and (time.hour, time.minute) == (9, 15) for time in times)
+
+@pytest.mark.parametrize('expression, matches', [
+    ('0 0 */2 * */3', lambda t: (t.hour, t.minute) == (0, 0) and (t.day % 2 == 1 or t.isoweekday() % 7 % 3 == 0)),
+    ('*/20 */6 1-7 * 1', lambda t: t.minute % 20 == 0 and t.hour % 6 == 0 and (t.day <= 7 or t.weekday() == 0)),
+    ('30 8 * * */2', lambda t: (t.hour, t.minute) == (8, 30) and t.isoweekday() % 7 % 2 == 0),
+    ('0 6 1,15 */4 *', lambda t: (t.hour, t.minute) == (6, 0) and t.day in (1, 15) and t.month in (1, 5, 9)),
+])
+def test_matches_a_minute_by_minute_search(expression, matches):
+    now = START
+    for expected in fire_times(expression, 5):
+        now += timedelta(minutes=1)
+        while not matches(now):
+            now += timedelta(minutes=1)
+        assert now == expected
+
+def test_invalid_step():
+    with pytest.raises(InvalidCronException):
+        CronExpression('0 0 */0 * *')
@@ -0,0 +1,98 @@
+"""Post dispatcher tests"""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from discord import Embed, HTTPException
+
+from src.util.dispatcher import MAX_CONTENT_LENGTH, MAX_EMBEDS, Delivery, PostDispatcher, can_pack, pack
+
+SLOT = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+
+
+def http_error(status: int, retry_after: str = None) -> HTTPException:
+    headers = {'Retry-After': retry_after} if retry_after is not None else {}
+    return HTTPException(SimpleNamespace(status=status, reason='Error', headers=headers), 'error')
+
+class FakeChannel:
+    """Channel raising the given errors on its first sends, then recording the sent contents"""
+
+    def __init__(self, channel_id: int = 1, errors: list[Exception] = ()):
+        self.id = channel_id
+        self.errors = list(errors)
+        self.attempts = 0
+        self.sent: list[str] = []
+
+    async def send(self, content=None, **kwargs): # pylint: disable=unused-argument
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(content)
+        return SimpleNamespace(id=self.attempts)
+
+def dispatch(channel: FakeChannel, max_attempts: int = 3):
+    dispatcher = PostDispatcher(max_attempts=max_attempts, base_delay=0.001, max_delay=0.01)
+    # A rate limit empties the channel bucket, refilled here in milliseconds instead of seconds
+    dispatcher.CHANNEL_RATE = (5, 0.005)
+    return asyncio.run(dispatcher.dispatch([Delivery(1, channel, 'Hello')]))[0]
+
+def test_rate_limits_and_server_errors_are_retried():
+    channel = FakeChannel(errors=[http_error(429, '0'), http_error(503)])
+    result = dispatch(channel)
+    assert result.sent
+    assert result.attempts == 3
+    assert channel.sent == ['Hello']
+
+def test_retries_stop_after_max_attempts():
+    channel = FakeChannel(errors=[http_error(500)] * 3)
+    result = dispatch(channel, max_attempts=2)
+    assert not result.sent
+    assert result.attempts == 2
+    assert result.error.status == 500
+    assert channel.attempts == 2
+
+def test_client_errors_are_not_retried():
+    channel = FakeChannel(errors=[http_error(403)])
+    result = dispatch(channel)
+    assert not result.sent
+    assert result.attempts == 1
+    assert channel.sent == []
+
+def test_deliveries_keep_their_order_and_results():
+    first, second = FakeChannel(1), FakeChannel(2, errors=[http_error(404)])
+    deliveries = [Delivery(10, first, 'a'), Delivery(11, second, 'b'), Delivery(12, first, 'c')]
+    results = asyncio.run(PostDispatcher().dispatch(deliveries))
+    assert [(result.post_id, result.sent) for result in results] == [(10, True), (11, False), (12, True)]
+    assert first.sent == ['a', 'c']
+
+def delivery(post_id: int, content: str = None, embeds: int = 0, slot: datetime = SLOT, **kwargs) -> Delivery:
+    if embeds:
+        kwargs['embeds'] = [Embed(title=f'Embed {i}') for i in range(embeds)]
+    return Delivery(post_id, FakeChannel(), content, kwargs, slot=slot)
+
+def test_deliveries_of_a_slot_within_the_limits_pack():
+    assert can_pack(delivery(1, 'a'), delivery(2, 'b', embeds=2))
+    assert can_pack(delivery(1, 'a' * 1000), delivery(2, 'b' * (MAX_CONTENT_LENGTH - 1002)))
+
+def test_deliveries_over_the_limits_do_not_pack():
+    assert not can_pack(delivery(1, 'a' * 1000), delivery(2, 'b' * (MAX_CONTENT_LENGTH - 1001)))
+    assert not can_pack(delivery(1, embeds=MAX_EMBEDS - 1), delivery(2, embeds=2))
+    assert not can_pack(delivery(1, 'a'), delivery(2, 'b', slot=SLOT.replace(minute=1)))
+    assert not can_pack(delivery(1, 'a', slot=None), delivery(2, 'b', slot=None))
+    assert not can_pack(delivery(1, 'a'), delivery(2, 'b', tts=True))
+
+    with_file = delivery(2, 'b')
+    with_file.files.append(('/tmp/image.png', 'image.png'))
+    assert not can_pack(delivery(1, 'a'), with_file)
+
+def test_pack_merges_consecutive_deliveries_in_order():
+    deliveries = [
+        delivery(1, 'a'), delivery(2, 'b', embeds=1), delivery(3, 'c' * MAX_CONTENT_LENGTH), delivery(4, 'd')
+    ]
+    packed = pack(list(enumerate(deliveries)))
+
+    assert [indexes for indexes, _ in packed] == [[0, 1], [2], [3]]
+    merged = packed[0][1]
+    assert merged.content == 'a\n\nb'
+    assert len(merged.kwargs['embeds']) == 1
+    assert merged.slot == SLOT
@@ -0,0 +1,47 @@
+"""CRUD mixin tests"""
+from src.extensions import db
+from src.models.bot_state import BotState
+from src.models.weekly_post import WeeklyPost
+
+
+def post(content: str, hour: int = 9) -> dict:
+    return {'guild_id': 1, 'channel_id': 2, 'content': content, 'day_of_week': 0, 'hour': hour}
+
+def test_create_many_returns_the_ids_in_order(database):
+    async def test():
+        ids = await WeeklyPost.create_many([post('first'), post('second'), post('third')], returning=True)
+        posts = {post.id: post.content for post in await WeeklyPost.get_all()}
+        assert [posts[post_id] for post_id in ids] == ['first', 'second', 'third']
+        assert await WeeklyPost.create_many([], returning=True) == []
+    database(test)
+
+def test_update_many_returns_the_updated_ids(database):
+    async def test():
+        first, second, third = await WeeklyPost.create_many([post('a'), post('b', 10), post('c')], returning=True)
+        updated = await WeeklyPost.update_many({'hour': 9}, {'content': 'updated'}, returning=True)
+        assert updated == [first, third]
+        contents = {post.id: post.content for post in await WeeklyPost.get_all()}
+        assert contents == {first: 'updated', second: 'b', third: 'updated'}
+        assert await WeeklyPost.update_many({'hour': 23}, {'content': 'none'}, returning=True) == []
+    database(test)
+
+def test_delete_where_returns_the_deleted_ids(database):
+    async def test():
+        first, second, third = await WeeklyPost.create_many([post('a'), post('b', 10), post('c')], returning=True)
+        assert await WeeklyPost.delete_where(WeeklyPost.hour == 9, returning=True) == [first, third]
+        assert [post.id for post in await WeeklyPost.get_all()] == [second]
+    database(test)
+
+def test_returning_writes_join_the_transaction(database):
+    async def test():
+        try:
+            async with db.transaction():
+                [post_id] = await WeeklyPost.create_many([post('a')], returning=True, commit=False)
+                assert await WeeklyPost.delete_where({'id': post_id}, returning=True, commit=False) == [post_id]
+                await BotState.set_value('key', 'value')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert await WeeklyPost.get_all() == []
+        assert await BotState.get_value('key') is None
+    database(test)
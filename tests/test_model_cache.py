@@ -0,0 +1,97 @@
+"""Model cache tests"""
+from sqlalchemy import event, update
+
+from src.extensions import db
+from src.models.bot_state import BotState
+from src.models.mixins import CACHE_VERSION_KEY
+from src.models.weekly_post import WeeklyPost
+
+
+class StatementCounter:
+    """Counts the statements sent to the database"""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(db.engine.sync_engine, 'before_cursor_execute', self._increment)
+
+    def _increment(self, *args): # pylint: disable=unused-argument
+        self.count += 1
+
+async def create_post(content: str) -> WeeklyPost:
+    return await WeeklyPost.create(guild_id=1, channel_id=2, content=content, day_of_week=0, hour=9)
+
+async def write_from_another_replica(post_id: int, content: str):
+    """Update a post and its cache version without going through this process's cache"""
+    async with db.transaction() as session:
+        await session.execute(update(WeeklyPost.__table__).where(WeeklyPost.id == post_id).values(content=content))
+        await BotState.touch(f'{CACHE_VERSION_KEY}{WeeklyPost.__tablename__}')
+
+def test_repeated_reads_cost_no_round_trips(database):
+    async def test():
+        post = await create_post('first')
+        await WeeklyPost.get(post.id)
+        await WeeklyPost.get_listed(1, None, 10)
+
+        counter = StatementCounter()
+        assert (await WeeklyPost.get(post.id)).content == 'first'
+        assert [record.id for record in await WeeklyPost.get_listed(1, None, 10)] == [post.id]
+        assert counter.count == 0
+        assert WeeklyPost.cache_stats().hits == 2
+    database(test)
+
+def test_cached_instances_are_copies(database):
+    async def test():
+        post = await create_post('first')
+        (await WeeklyPost.get(post.id)).content = 'changed without saving'
+        assert (await WeeklyPost.get(post.id)).content == 'first'
+    database(test)
+
+def test_writes_invalidate_the_local_cache(database):
+    async def test():
+        post = await create_post('first')
+        assert len(await WeeklyPost.get_listed(1, None, 10)) == 1
+        await WeeklyPost.get(post.id)
+
+        await create_post('second')
+        assert len(await WeeklyPost.get_listed(1, None, 10)) == 2
+        await WeeklyPost.update_many({'id': post.id}, {'content': 'updated'})
+        assert (await WeeklyPost.get(post.id)).content == 'updated'
+        await WeeklyPost.delete_where({'id': post.id})
+        assert await WeeklyPost.get(post.id) is None
+        assert len(await WeeklyPost.get_listed(1, None, 10)) == 1
+    database(test)
+
+def test_writes_of_another_replica_are_seen_after_the_check_interval(database, monkeypatch):
+    async def test():
+        post = await create_post('first')
+        await WeeklyPost.get(post.id)
+        await write_from_another_replica(post.id, 'from another replica')
+
+        # Until the version is checked again the cached row is served
+        assert (await WeeklyPost.get(post.id)).content == 'first'
+        monkeypatch.setattr(WeeklyPost.__cache__, 'check_interval', 0)
+        assert (await WeeklyPost.get(post.id)).content == 'from another replica'
+    database(test)
+
+def test_checking_the_version_costs_one_round_trip(database, monkeypatch):
+    async def test():
+        post = await create_post('first')
+        await WeeklyPost.get(post.id)
+        monkeypatch.setattr(WeeklyPost.__cache__, 'check_interval', 0)
+        counter = StatementCounter()
+        await WeeklyPost.get(post.id)
+        assert counter.count == 1
+    database(test)
+
+def test_reads_in_a_rolled_back_transaction_are_not_cached(database):
+    async def test():
+        post = await create_post('first')
+        try:
+            async with db.transaction():
+                await WeeklyPost.update_many({'id': post.id}, {'content': 'rolled back'})
+                assert (await WeeklyPost.get(post.id)).content == 'rolled back'
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert (await WeeklyPost.get(post.id)).content == 'first'
+    database(test)
@@ -0,0 +1,92 @@
+"""Weekly post import and export tests"""
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.models.weekly_post import WeeklyPost
+from src.util.post_transfer import COLUMNS, MAX_ID, export_posts, import_posts, read_rows, validate_row
+
+NOW = datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc) # A Sunday
+WEEKLY = {'content': 'Hello', 'day_of_week': 0, 'hour': 9}
+
+
+def test_validate_row_schedules_weekly_posts_at_their_next_occurrence():
+    values = validate_row({**WEEKLY, 'guild_id': '1', 'minute': '15'}, NOW)
+    assert values['guild_id'] == 1
+    assert values['next_run_at'] == datetime(2026, 10, 19, 9, 15, tzinfo=timezone.utc)
+
+def test_validate_row_schedules_recurrences():
+    values = validate_row({'content': 'Hello', 'recurrence': '0 8 * * *'}, NOW)
+    assert values['next_run_at'] == datetime(2026, 10, 19, 8, 0, tzinfo=timezone.utc)
+
+def test_validate_row_keeps_a_future_next_run_and_reschedules_a_past_one():
+    future = NOW + timedelta(days=3)
+    assert validate_row({**WEEKLY, 'next_run_at': future.isoformat()}, NOW)['next_run_at'] == future
+    naive = (NOW + timedelta(days=3)).replace(tzinfo=None).isoformat()
+    assert validate_row({**WEEKLY, 'next_run_at': naive}, NOW)['next_run_at'] == future
+    past = (NOW - timedelta(days=3)).isoformat()
+    assert validate_row({**WEEKLY, 'next_run_at': past}, NOW)['next_run_at'] > NOW
+
+@pytest.mark.parametrize('row, error', [
+    ({'day_of_week': 0, 'hour': 9}, 'content is missing'),
+    ({**WEEKLY, 'content': 'x' * 2001}, 'content is longer'),
+    ({**WEEKLY, 'hour': 24}, 'hour is outside 0-23'),
+    ({**WEEKLY, 'guild_id': MAX_ID + 1}, 'guild_id is outside'),
+    ({**WEEKLY, 'channel_id': 'abc'}, 'channel_id is not an integer'),
+    ({**WEEKLY, 'embeds': '{"title": "x"}'}, 'embeds is not a list'),
+    ({**WEEKLY, 'recurrence': '0 9 * * *'}, 'both a recurrence'),
+    ({'content': 'Hello', 'recurrence': '0 9 * *'}, 'Invalid cron expression'),
+    ({'content': 'Hello'}, 'needs a day of week and hour'),
+    ({**WEEKLY, 'next_run_at': 'tomorrow'}, 'not an ISO 8601'),
+    ({'_error': 'not a JSON object'}, 'not a JSON object'),
+])
+def test_validate_row_rejects_invalid_rows(row, error):
+    with pytest.raises(ValueError, match=error):
+        validate_row(row, NOW)
+
+def test_read_rows_reports_invalid_lines():
+    rows = list(read_rows(io.StringIO('{"content": "a"}\n\nnot json\n[1]\n'), 'jsonl'))
+    assert [line_num for line_num, _ in rows] == [1, 3, 4]
+    assert rows[1][1]['_error'].startswith('invalid JSON')
+    assert rows[2][1] == {'_error': 'not a JSON object'}
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_export_and_import_round_trip(database, fmt):
+    async def test():
+        next_run_at = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+        post = dict.fromkeys(COLUMNS)
+        await WeeklyPost.create_many([
+            {**post, **WEEKLY, 'guild_id': 1, 'channel_id': 2, 'minute': 0, 'next_run_at': next_run_at},
+            {**post, 'content': 'Cron, with "quotes"', 'recurrence': '0 8 * * mon-fri', 'guild_id': 1,
+             'channel_id': 3, 'embeds': [{'title': 'Embed'}], 'minute': 0, 'next_run_at': next_run_at},
+            {**post, **WEEKLY, 'content': 'Line\nbreak', 'minute': 30, 'next_run_at': next_run_at},
+        ])
+        before = await WeeklyPost.project(COLUMNS)
+
+        fp = io.StringIO(newline='')
+        assert await export_posts(fp, fmt, chunk_size=2) == 3
+        await WeeklyPost.delete_where([])
+
+        fp.seek(0)
+        progress = []
+        async def record_progress(imported: int):
+            progress.append(imported)
+        report = await import_posts(read_rows(fp, fmt), 2, record_progress)
+        assert (report.imported, report.rejected, progress) == (3, 0, [2, 3])
+        assert await WeeklyPost.project(COLUMNS) == before
+    database(test)
+
+def test_import_skips_and_reports_invalid_rows(database):
+    async def test():
+        lines = [
+            '{"content": "a", "day_of_week": 0, "hour": 9}',
+            '{"content": "b", "day_of_week": 9, "hour": 9}',
+            '{"content": "c", "recurrence": "0 9 * * *"}',
+            'not json',
+        ]
+        report = await import_posts(read_rows(io.StringIO('\n'.join(lines)), 'jsonl'), 1)
+        assert (report.imported, report.rejected) == (2, 2)
+        assert [line_num for line_num, _ in report.errors] == [2, 4]
+        assert sorted(post.content for post in await WeeklyPost.project(['content'])) == ['a', 'c']
+    database(test)
@@ -0,0 +1,17 @@
+"""Profiler tests"""
+from collections import Counter
+
+from src.extensions.profiler import Profiler
+
+
+def test_top_frames_counts_the_innermost_frames(tmp_path):
+    path = str(tmp_path / 'profile.folded')
+    Profiler._write_stacks(path, Counter({ # pylint: disable=protected-access
+        'main (bot.py:1);run (loop.py:10);select (selectors.py:5)': 6,
+        'main (bot.py:1);send_posts (weekly_post.py:20);select (selectors.py:5)': 2,
+        'main (bot.py:1);send_posts (weekly_post.py:20)': 2,
+    }))
+
+    lines = Profiler.top_frames(path, limit=1).splitlines()
+    assert lines == ['      8  80.0% select (selectors.py:5)']
+    assert len(Profiler.top_frames(path).splitlines()) == 2
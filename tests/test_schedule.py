@@ -0,0 +1,71 @@
+"""Schedule tests"""
+from datetime import datetime, timedelta, timezone
+
+from src.util.schedule import Schedule
+
+START = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> datetime:
+    return START + timedelta(minutes=minutes)
+
+def test_pop_due_returns_the_due_keys_earliest_first():
+    schedule = Schedule()
+    schedule.add(1, at(10))
+    schedule.add(2, at(0))
+    schedule.add(3, at(5))
+    schedule.add(4, at(20))
+
+    assert schedule.pop_due(at(10)) == [(at(0), 2), (at(5), 3), (at(10), 1)]
+    assert len(schedule) == 1
+    assert 4 in schedule and 1 not in schedule
+    assert schedule.next_fire_time() == at(20)
+
+def test_keys_due_at_once_pop_in_key_order():
+    schedule = Schedule()
+    for key in (3, 1, 2):
+        schedule.add(key, at(0))
+    assert [key for _, key in schedule.pop_due(at(0))] == [1, 2, 3]
+
+def test_pop_due_before_the_first_fire_time_is_empty():
+    schedule = Schedule()
+    schedule.add(1, at(10))
+    assert schedule.pop_due(at(9)) == []
+    assert len(schedule) == 1
+
+def test_adding_again_replaces_the_fire_time():
+    schedule = Schedule()
+    schedule.add(1, at(0))
+    schedule.add(1, at(30))
+
+    assert len(schedule) == 1
+    assert schedule.next_fire_time() == at(30)
+    assert schedule.pop_due(at(10)) == []
+    assert schedule.pop_due(at(30)) == [(at(30), 1)]
+    assert schedule.next_fire_time() is None
+
+def test_removed_keys_are_skipped():
+    schedule = Schedule()
+    schedule.add(1, at(0))
+    schedule.add(2, at(5))
+    schedule.remove(1)
+    schedule.remove(3)
+
+    assert len(schedule) == 1
+    assert schedule.next_fire_time() == at(5)
+    assert schedule.pop_due(at(5)) == [(at(5), 2)]
+
+def test_removed_then_added_at_the_same_time_pops_once():
+    schedule = Schedule()
+    schedule.add(1, at(0))
+    schedule.remove(1)
+    schedule.add(1, at(0))
+    assert schedule.pop_due(at(0)) == [(at(0), 1)]
+    assert schedule.pop_due(at(0)) == []
+
+def test_clear_unschedules_every_key():
+    schedule = Schedule()
+    schedule.add(1, at(0))
+    schedule.clear()
+    assert len(schedule) == 0
+    assert schedule.next_fire_time() is None
@@ -0,0 +1,114 @@
+"""Scheduler lease and post delivery tests"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from src.cogs.weekly_post import WeeklyPostCog
+from src.models.post_delivery import PostDelivery
+from src.models.scheduler_lease import SchedulerLease
+from src.models.weekly_post import WeeklyPost
+from src.util.schedule import Schedule
+
+NOW = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+TTL = timedelta(seconds=30)
+
+
+async def create_posts(count: int) -> list[int]:
+    posts = [
+        await WeeklyPost.create(guild_id=1, channel_id=2, content=f'Post {i}', day_of_week=0, hour=9)
+        for i in range(count)
+    ]
+    return [post.id for post in posts]
+
+def test_slots_are_claimed_once(database):
+    async def test():
+        first, second, third = await create_posts(3)
+        _, claimed = await PostDelivery.claim_slots([(first, NOW), (second, NOW)], 'replica-a')
+        assert claimed == {first, second}
+
+        _, claimed = await PostDelivery.claim_slots([(first, NOW), (second, NOW), (third, NOW)], 'replica-b')
+        assert claimed == {third}
+        _, claimed = await PostDelivery.claim_slots([(first, NOW), (second, NOW), (third, NOW)], 'replica-a')
+        assert claimed == set()
+    database(test)
+
+def test_later_slots_of_a_post_are_claimed_again(database):
+    async def test():
+        [post_id] = await create_posts(1)
+        await PostDelivery.claim_slots([(post_id, NOW)], 'replica-a')
+        _, claimed = await PostDelivery.claim_slots([(post_id, NOW + timedelta(weeks=1))], 'replica-a')
+        assert claimed == {post_id}
+    database(test)
+
+def test_claims_are_marked_by_claim(database):
+    async def test():
+        first, second = await create_posts(2)
+        claim, _ = await PostDelivery.claim_slots([(first, NOW)], 'replica-a')
+        await PostDelivery.claim_slots([(second, NOW)], 'replica-b')
+        await PostDelivery.mark(claim, [first, second], 'sent')
+
+        deliveries = {delivery.post_id: delivery.status for delivery in await PostDelivery.get_all()}
+        assert deliveries == {first: 'sent', second: 'claimed'}
+    database(test)
+
+def test_lease_is_held_by_one_replica_until_it_expires(database):
+    async def test():
+        assert await SchedulerLease.acquire('posts', 'replica-a', TTL, NOW)
+        assert not await SchedulerLease.acquire('posts', 'replica-b', TTL, NOW + TTL / 2)
+        assert await SchedulerLease.acquire('posts', 'replica-b', TTL, NOW + TTL)
+        assert not await SchedulerLease.acquire('posts', 'replica-a', TTL, NOW + TTL)
+    database(test)
+
+def test_renewing_extends_the_lease(database):
+    async def test():
+        assert await SchedulerLease.acquire('posts', 'replica-a', TTL, NOW)
+        assert await SchedulerLease.acquire('posts', 'replica-a', TTL, NOW + TTL / 2)
+        assert not await SchedulerLease.acquire('posts', 'replica-b', TTL, NOW + TTL)
+        assert len(await SchedulerLease.get_all()) == 1
+    database(test)
+
+def test_released_lease_is_taken_over_at_once(database):
+    async def test():
+        assert await SchedulerLease.acquire('posts', 'replica-a', TTL, NOW)
+        # Only the holder releases the lease
+        await SchedulerLease.release('posts', 'replica-b', NOW)
+        assert not await SchedulerLease.acquire('posts', 'replica-b', TTL, NOW)
+
+        await SchedulerLease.release('posts', 'replica-a', NOW)
+        assert await SchedulerLease.acquire('posts', 'replica-b', TTL, NOW)
+    database(test)
+
+def test_leases_are_independent_by_name(database):
+    async def test():
+        assert await SchedulerLease.acquire('posts', 'replica-a', TTL, NOW)
+        assert await SchedulerLease.acquire('audit', 'replica-b', TTL, NOW)
+    database(test)
+
+def test_posts_due_at_once_are_ordered_by_id(database):
+    async def test():
+        post_ids = await create_posts(3)
+        await WeeklyPost.set_next_runs({post_id: NOW for post_id in reversed(post_ids)})
+        assert [post.id for post in await WeeklyPost.get_due(NOW)] == post_ids
+        assert [post.id for post in await WeeklyPost.get_fire_times()] == post_ids
+        assert [post.id for post in await WeeklyPost.get_listed(1, None, 10)] == post_ids
+    database(test)
+
+def test_posts_committed_after_a_higher_id_are_scheduled_before_they_are_due(database):
+    async def test():
+        later, missed = await create_posts(2)
+        await WeeklyPost.set_next_runs({later: NOW + timedelta(hours=1), missed: NOW})
+        # Only the state load_new_posts uses, the loops are not started
+        cog = WeeklyPostCog.__new__(WeeklyPostCog) # pylint: disable=no-value-for-parameter
+        cog.bot = SimpleNamespace(shard_ids=None)
+        cog.schedule = Schedule()
+        cog._schedule_changed = asyncio.Event() # pylint: disable=protected-access
+        cog._log = logging.getLogger('WeeklyPostCog') # pylint: disable=protected-access
+        # The schedule has seen a higher id, committed before the missed post
+        cog.schedule.add(later, NOW + timedelta(hours=1))
+        cog._last_post_id = later + 1 # pylint: disable=protected-access
+
+        await cog.load_new_posts()
+        assert cog.schedule.next_fire_time() == NOW
+        assert missed in cog.schedule
+    database(test)
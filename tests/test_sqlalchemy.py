@@ -0,0 +1,44 @@
+"""SQLAlchemy extension tests"""
+import asyncio
+
+from sqlalchemy.util import await_only
+
+from src.config import EmbeddedConfig
+from src.extensions.sqlalchemy import SQLAlchemy
+
+
+class SlowConnectSQLAlchemy(SQLAlchemy):
+    """Takes a while to open a connection, as over TLS"""
+
+    def _timed_connect(self, *args):
+        await_only(asyncio.sleep(0.2))
+        return super()._timed_connect(*args)
+
+def test_pool_counts_only_the_checkouts_waiting_for_a_connection(tmp_path):
+    async def test():
+        db = SlowConnectSQLAlchemy()
+        db.init_engine(EmbeddedConfig(
+            SQLALCHEMY_DATABASE_URI=f'sqlite+aiosqlite:///{tmp_path}/pool.db',
+            SQLALCHEMY_POOL_SIZE=1,
+            SQLALCHEMY_MAX_OVERFLOW=1
+        ))
+        connections = []
+        try:
+            opening = asyncio.create_task(db.engine.connect().start())
+            await asyncio.sleep(0.1)
+            assert db.pool_stats().waiting == 0
+            connections.append(await opening)
+            connections.append(await db.engine.connect().start())
+
+            waiter = asyncio.create_task(db.engine.connect().start())
+            await asyncio.sleep(0.1)
+            assert db.pool_stats().waiting == 1
+
+            await connections.pop().close()
+            connections.append(await waiter)
+            assert db.pool_stats().waiting == 0
+        finally:
+            for connection in connections:
+                await connection.close()
+            await db.engine.dispose()
+    asyncio.run(test())